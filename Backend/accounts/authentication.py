@@ -0,0 +1,278 @@
+from typing import NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from eshtarek.tenant_context import user_identity
+from .denylist import ais_token_denied, is_token_denied
+from .models import UserRole
+
+_UNRESOLVED = object()
+
+# Claims embedded by TenantTokenObtainPairSerializer
+TENANT_CLAIMS = ('tenant_id', 'role', 'is_superuser')
+
+
+class TenantTokenUser(TokenUser):
+    """Stateless user backed by the tenant claims of an access token."""
+
+    @cached_property
+    def tenant_id(self) -> Optional[str]:
+        return self.token.get('tenant_id')
+
+    @cached_property
+    def role(self) -> Optional[str]:
+        return self.token.get('role')
+
+
+class Principal(NamedTuple):
+    """Who is calling: the identity facts tenant scoping and RLS need."""
+
+    user_id: Optional[int] = None
+    tenant_id: Optional[str] = None
+    role: Optional[str] = None
+    is_superuser: bool = False
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self.user_id is not None
+
+    @property
+    def is_platform_admin(self) -> bool:
+        return self.is_superuser or self.role == UserRole.ADMIN
+
+    @property
+    def is_tenant_admin(self) -> bool:
+        return self.is_platform_admin or self.role == UserRole.TENANT_ADMIN
+
+    def can_access_tenant(self, tenant_id) -> bool:
+        return self.is_platform_admin or (
+            self.tenant_id is not None and self.tenant_id == str(tenant_id)
+        )
+
+    @classmethod
+    def from_user(cls, user) -> 'Principal':
+        if not getattr(user, 'is_authenticated', False):
+            return ANONYMOUS
+        if isinstance(user, TenantTokenUser):
+            return cls(
+                user_id=user.id,
+                tenant_id=user.tenant_id,
+                role=user.role,
+                is_superuser=bool(user.is_superuser),
+            )
+        profile = load_profile(user)
+        tenant_id = getattr(profile, 'tenant_id', None)
+        return cls(
+            user_id=user.pk,
+            tenant_id=str(tenant_id) if tenant_id else None,
+            role=getattr(profile, 'role', None),
+            is_superuser=bool(getattr(user, 'is_superuser', False)),
+        )
+
+
+ANONYMOUS = Principal()
+
+
+def load_profile(user):
+    """
+    ``user.profile`` or None. The caller's tenant is not known before it is
+    read, so an unloaded profile is read under the user's own identity
+    (tenant_context.user_identity) rather than whatever context is set.
+    """
+    descriptor = getattr(type(user), 'profile', None)
+    if descriptor is None or descriptor.is_cached(user):
+        return getattr(user, 'profile', None)
+    with user_identity(user.pk):
+        return getattr(user, 'profile', None)
+
+
+def load_user(user_model, user_id):
+    """The user ``user_id`` (the token's user id claim) with their profile, or None."""
+    with user_identity(user_id):
+        return (
+            user_model.objects.select_related('profile')
+            .filter(**{api_settings.USER_ID_FIELD: user_id})
+            .first()
+        )
+
+
+def add_tenant_claims(token, user) -> None:
+    """Embeds the caller's tenant, role and superuser flag into a token."""
+    principal = Principal.from_user(user)
+    token['tenant_id'] = principal.tenant_id
+    token['role'] = principal.role
+    token['is_superuser'] = principal.is_superuser
+
+
+class TenantJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that decodes the bearer token at most once per request.
+
+    The result (or the authentication error) is cached on the underlying
+    Django request, so TenantContextMiddleware and DRF's authenticator share
+    a single token decode and a single user + profile lookup.
+
+    With ``JWT_STATELESS_USER`` enabled, tokens carrying the tenant claims are
+    served by a TenantTokenUser and cost no identity queries at all; older
+    tokens without the claims fall back to the database lookup.
+    """
+
+    def authenticate(self, request):
+        django_request = getattr(request, '_request', request)
+        cached = getattr(django_request, '_jwt_auth', _UNRESOLVED)
+        if cached is _UNRESOLVED:
+            try:
+                cached = super().authenticate(django_request)
+            except APIException as exc:
+                cached = exc
+            django_request._jwt_auth = cached
+        if isinstance(cached, APIException):
+            raise cached
+        return cached
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate`` for async views and middleware: the denylist is read
+        through the async cache API and a user lookup, which needs an atomic
+        block (see load_user), through ``sync_to_async``. Shares the
+        per-request cache with ``authenticate``.
+        """
+        django_request = getattr(request, '_request', request)
+        cached = getattr(django_request, '_jwt_auth', _UNRESOLVED)
+        if cached is _UNRESOLVED:
+            try:
+                cached = await self._aauthenticate(django_request)
+            except APIException as exc:
+                cached = exc
+            django_request._jwt_auth = cached
+        if isinstance(cached, APIException):
+            raise cached
+        return cached
+
+    async def _aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = super().get_validated_token(raw_token)
+        if await ais_token_denied(validated_token):
+            raise InvalidToken(_("Token has been revoked"))
+        return await self.aget_user(validated_token), validated_token
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if is_token_denied(validated_token):
+            raise InvalidToken(_("Token has been revoked"))
+        return validated_token
+
+    def _token_user(self, validated_token):
+        """TenantTokenUser for tokens that carry the tenant claims, when stateless users are enabled."""
+        if getattr(settings, 'JWT_STATELESS_USER', False) and all(
+            claim in validated_token for claim in TENANT_CLAIMS
+        ):
+            if api_settings.USER_ID_CLAIM not in validated_token:
+                raise InvalidToken(_("Token contained no recognizable user identification"))
+            return TenantTokenUser(validated_token)
+        return None
+
+    def _user_lookup(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        return load_user(self.user_model, user_id)
+
+    @staticmethod
+    def _check_user(user):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    def get_user(self, validated_token):
+        token_user = self._token_user(validated_token)
+        if token_user is not None:
+            return token_user
+        return self._check_user(self._user_lookup(validated_token))
+
+    async def aget_user(self, validated_token):
+        token_user = self._token_user(validated_token)
+        if token_user is not None:
+            return token_user
+        return self._check_user(await sync_to_async(self._user_lookup)(validated_token))
+
+
+def authenticate_request(request):
+    """Returns the cached ``(user, token)`` for a bearer token, or None."""
+    try:
+        return TenantJWTAuthentication().authenticate(request)
+    except APIException:
+        # Invalid tokens are reported by DRF's authenticator inside the view.
+        return None
+
+
+def get_principal(request) -> Principal:
+    """
+    Resolves the caller once per request.
+
+    For a DRF request this follows ``request.user`` (already authenticated by
+    TenantJWTAuthentication); for a plain Django request the bearer token is
+    tried first and the session user second. The principal is cached on the
+    Django request next to the user it was built from, so the middleware and
+    the view share it as long as they see the same user object.
+    """
+    django_request = getattr(request, '_request', request)
+    if django_request is not request:
+        user = request.user
+    else:
+        auth = authenticate_request(request)
+        user = auth[0] if auth else getattr(request, 'user', None)
+
+    cached = getattr(django_request, '_principal', None)
+    if cached is not None and cached[0] is user:
+        return cached[1]
+    principal = Principal.from_user(user)
+    django_request._principal = (user, principal)
+    return principal
+
+
+async def aget_principal(request) -> Principal:
+    """
+    ``get_principal`` for async code handling a plain Django request.
+
+    Resolves the bearer token with ``aauthenticate`` and otherwise the session
+    user with ``request.auser()``, then caches both the principal and the
+    resolved ``request.user``, so later sync calls (DRF authentication,
+    permission classes, ``get_principal``) find everything without I/O.
+    """
+    cached = getattr(request, '_principal', None)
+    if cached is not None:
+        return cached[1]
+    try:
+        auth = await TenantJWTAuthentication().aauthenticate(request)
+    except APIException:
+        auth = None
+    if auth:
+        user = auth[0]
+    elif hasattr(request, 'auser'):
+        user = await request.auser()
+        if user.is_authenticated:
+            # Principal.from_user reads the profile; load it with the user
+            user = await sync_to_async(load_user)(type(user), user.pk)
+        request.user = user
+    else:
+        user = getattr(request, 'user', None)
+    principal = Principal.from_user(user)
+    request._principal = (user, principal)
+    return principal
@@ -0,0 +1,76 @@
+"""
+Compact JWT denylist backed by the shared cache.
+
+Access tokens are short-lived, so revocation only has to outlive a token's own
+``exp``: each denied ``jti`` is stored with a TTL equal to its remaining
+lifetime and disappears on its own. ``deny_user`` revokes every token issued
+to a user so far with a single key: it stores a new random revision, tokens
+carry the revision current when they were issued (``REVISION_CLAIM``, added
+by ``add_revision_claim``), and a token is denied when its revision is not
+the stored one. Unlike an issue time, which JWTs only give in whole seconds,
+a revision tells apart a token issued right after a revocation (a login
+following a password change) from one issued just before it. A token issued
+before any revocation carries none and is denied once one is stored; the
+key outlives every token that could still be presented, so its expiry
+revokes nothing that is still valid. accounts.signals calls it when a
+user's password (set through ``set_password``), ``is_active`` or
+``is_superuser``, or their profile's tenant or role changes, and when either
+is deleted; stateless TenantTokenUser requests thus stop with the revocation
+instead of at token expiry.
+
+Entries must be seen by every worker: run more than one only with a shared
+cache (``REDIS_URL``, see eshtarek.server).
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+
+JTI_KEY = 'jwt:deny:jti:{}'
+USER_KEY = 'jwt:deny:user:{}'
+REVISION_CLAIM = 'rev'
+
+
+def _remaining(token) -> int:
+    return max(int(token.get('exp', 0) - time.time()), 1)
+
+
+def deny_token(token) -> None:
+    jti = token.get(api_settings.JTI_CLAIM)
+    if jti:
+        cache.set(JTI_KEY.format(jti), 1, timeout=_remaining(token))
+
+
+def deny_user(user_id) -> None:
+    # Must outlive the longest-lived token that could still be presented.
+    timeout = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    cache.set(USER_KEY.format(user_id), uuid.uuid4().hex, timeout=timeout)
+
+
+def add_revision_claim(token, user_id) -> None:
+    """Marks ``token`` as issued after every revocation of ``user_id`` so far."""
+    revision = cache.get(USER_KEY.format(user_id))
+    if revision is not None:
+        token[REVISION_CLAIM] = revision
+
+
+def _keys(token):
+    return JTI_KEY.format(token.get(api_settings.JTI_CLAIM)), USER_KEY.format(token.get(api_settings.USER_ID_CLAIM))
+
+
+def _is_denied(token, jti_key, user_key, found) -> bool:
+    if jti_key in found:
+        return True
+    revision = found.get(user_key)
+    return revision is not None and token.get(REVISION_CLAIM) != revision
+
+
+def is_token_denied(token) -> bool:
+    keys = _keys(token)
+    return _is_denied(token, *keys, cache.get_many(keys))
+
+
+async def ais_token_denied(token) -> bool:
+    keys = _keys(token)
+    return _is_denied(token, *keys, await cache.aget_many(keys))
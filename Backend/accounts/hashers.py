@@ -0,0 +1,55 @@
+"""
+Password hashers with their cost taken from settings.
+
+Each hasher keeps the algorithm name of the Django hasher it extends, so
+existing hashes keep verifying. Django rehashes a password at the next
+successful login (``User.check_password``, which ``authenticate`` and the
+token endpoint use) whenever its stored hash was made by another algorithm
+or with another cost than the current settings. Raising or lowering a cost
+therefore takes effect for each user at their next login.
+
+The algorithm for new hashes is chosen with ``PASSWORD_HASHER`` (see
+``settings.PASSWORD_HASHERS``); Argon2 needs the ``argon2-cffi`` package.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', hashers.PBKDF2PasswordHasher.iterations)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_WORK_FACTOR', hashers.ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_BLOCK_SIZE', hashers.ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_PARALLELISM', 0) or hashers.ScryptPasswordHasher.parallelism
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * N * r bytes and OpenSSL refuses more than 32 MiB
+        # unless told; leave room to verify hashes made at 4x the work factor.
+        return 4 * 128 * self.work_factor * self.block_size + 1024 * 1024
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_TIME_COST', hashers.Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_MEMORY_COST', hashers.Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_ARGON2_PARALLELISM', hashers.Argon2PasswordHasher.parallelism)
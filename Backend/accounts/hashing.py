@@ -0,0 +1,48 @@
+"""
+Password hashing for bulk operations, spread over worker processes.
+
+Kept free of model imports: pool workers are spawned and import this module
+before Django is set up.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.utils.module_loading import import_string
+
+
+def _hash_chunk(hasher_path: str, passwords: List[str]) -> List[str]:
+    hasher = import_string(hasher_path)()
+    return [hasher.encode(password, hasher.salt()) for password in passwords]
+
+
+def _init_hash_worker():
+    import django
+    django.setup()
+
+
+def hash_passwords(passwords: List[str], workers: Optional[int] = None) -> List[str]:
+    """
+    Hashes ``passwords`` with the default hasher, spread over ``workers``
+    processes (default ``BULK_PROVISION_WORKERS`` or one per core) once there
+    are at least ``BULK_PROVISION_POOL_MIN`` of them.
+    """
+    hasher = type(get_hasher())
+    hasher_path = f"{hasher.__module__}.{hasher.__qualname__}"
+    workers = workers or getattr(settings, "BULK_PROVISION_WORKERS", None) or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) < getattr(settings, "BULK_PROVISION_POOL_MIN", 64):
+        return _hash_chunk(hasher_path, passwords)
+
+    size = -(-len(passwords) // (workers * 4))
+    chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    # spawn, not fork: a forked child would share this process's database sockets
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_hash_worker,
+    ) as pool:
+        hashed = pool.map(_hash_chunk, [hasher_path] * len(chunks), chunks)
+        return [encoded for chunk in hashed for encoded in chunk]
@@ -0,0 +1,42 @@
+import sys
+from itertools import islice
+from uuid import UUID
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.provisioning import provision, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create users in bulk from a CSV (with header) or JSONL file; invalid rows are reported and skipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or - for stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Default: from the file extension")
+        parser.add_argument("--tenant", help="Tenant id for rows without tenant_id")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, help="Password hashing processes (default: one per core)")
+        parser.add_argument("--ignore-quota", action="store_true", help="Do not enforce the plans' max_users")
+
+    def handle(self, *args, path, format=None, tenant=None, batch_size=1000, workers=None, ignore_quota=False, **options):
+        fmt = format or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        try:
+            tenant_id = UUID(tenant) if tenant else None
+        except ValueError:
+            raise CommandError(f"Invalid --tenant: {tenant}")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8-sig")
+        created = failed = 0
+        try:
+            rows = read_rows(stream, fmt)
+            while batch := list(islice(rows, batch_size)):
+                result = provision(batch, tenant_id, enforce_quota=not ignore_quota, workers=workers)
+                created += len(result.created)
+                failed += len(result.errors)
+                for error in result.errors:
+                    self.stderr.write(f"line {error['row']}: {error['errors']}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Created {created} user(s), {failed} row(s) rejected"))
@@ -0,0 +1,21 @@
+from importlib import import_module
+
+from django.db import migrations
+
+from eshtarek.rls import TenantRowLevelSecurity
+
+
+def restore_legacy_policies(apps, schema_editor):
+    import_module('accounts.migrations.0002_rls').enable_rls_accounts(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('accounts', '0002_rls'),
+    ]
+
+    operations = [
+        # Replaces the policies of 0002_rls; reversing restores them
+        migrations.RunPython(migrations.RunPython.noop, restore_legacy_policies),
+        TenantRowLevelSecurity('userprofile'),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from eshtarek.rls import enable_tenant_rls
+
+
+def _replace_policies(apps, schema_editor, identity_column):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    with schema_editor.connection.cursor() as cursor:
+        enable_tenant_rls(cursor, UserProfile._meta.db_table, identity_column=identity_column)
+
+
+def add_own_identity_policy(apps, schema_editor):
+    _replace_policies(apps, schema_editor, 'user_id')
+
+
+def remove_own_identity_policy(apps, schema_editor):
+    _replace_policies(apps, schema_editor, None)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('accounts', '0003_rls_tenant_policies'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_own_identity_policy, remove_own_identity_policy),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from tenants.managers import TenantScopedManager
 from tenants.models import Tenant
 
 
@@ -17,6 +18,8 @@ class UserProfile(models.Model):
     role = models.CharField(max_length=20, choices=UserRole.choices, default=UserRole.TENANT_USER)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantScopedManager()
+
     class Meta:
         unique_together = ("user", "tenant")
 
@@ -1,29 +1,51 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
+from subscriptions import entitlements
+from .authentication import get_principal
+
 
 class IsPlatformAdmin(BasePermission):
     """Allow only platform admins (User.is_superuser or UserProfile.role == ADMIN)."""
 
     def has_permission(self, request, view):
-        user = request.user
-        if not getattr(user, 'is_authenticated', False):
-            return False
-        if getattr(user, 'is_superuser', False):
-            return True
-        profile = getattr(user, 'profile', None)
-        return bool(profile and getattr(profile, 'role', '') == 'ADMIN')
+        principal = get_principal(request)
+        return principal.is_authenticated and principal.is_platform_admin
 
 
 class IsTenantAdminOrReadOnly(BasePermission):
     """Read-only for authenticated; write only for tenant admins or platform admins."""
 
     def has_permission(self, request, view):
-        user = request.user
         if request.method in SAFE_METHODS:
             return True
-        if not getattr(user, 'is_authenticated', False):
+        principal = get_principal(request)
+        return principal.is_authenticated and principal.is_tenant_admin
+
+
+class IsTenantAdmin(BasePermission):
+    """Allow only tenant admins and platform admins, for any method."""
+
+    def has_permission(self, request, view):
+        principal = get_principal(request)
+        return principal.is_authenticated and principal.is_tenant_admin
+
+
+class HasEntitlement(BasePermission):
+    """
+    Allow tenant members whose plan includes every feature flag in the view's
+    ``required_entitlements``, and platform admins. Answered from the cached
+    entitlements (subscriptions.entitlements): no query once warm.
+    """
+
+    message = "Your plan does not include this feature."
+
+    def has_permission(self, request, view):
+        principal = get_principal(request)
+        if not principal.is_authenticated:
             return False
-        if getattr(user, 'is_superuser', False):
+        if principal.is_platform_admin:
             return True
-        profile = getattr(user, 'profile', None)
-        return bool(profile and getattr(profile, 'role', '') in ('ADMIN', 'TENANT_ADMIN'))
+        if principal.tenant_id is None:
+            return False
+        granted = entitlements.for_tenant(principal.tenant_id)
+        return all(granted.has(feature) for feature in getattr(view, 'required_entitlements', ()))
@@ -0,0 +1,197 @@
+"""
+Bulk user provisioning for tenant onboarding.
+
+``read_rows`` turns a CSV (header row) or JSONL stream into numbered rows and
+``provision`` creates one batch of them:
+
+1. every row is validated up front (fields, tenant, role, username unique in
+   the batch and in the database) with a fixed number of queries;
+2. passwords of the valid rows are hashed, in a process pool when the batch
+   is large enough to pay for it;
+3. in one transaction, each tenant's ``users`` counter is locked once and the
+   rows that fit the plan are inserted with ``bulk_create``.
+
+A username registered by another transaction after step 1 makes a chunk's
+insert fail; the chunk is rolled back to its savepoint, the usernames that now
+exist are reported, and the rest of the chunk is inserted again. Rejected rows
+are reported with their line number and never abort the batch.
+"""
+import csv
+import json
+from collections import defaultdict
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+
+from tenants import quotas
+from tenants.models import Tenant
+from .hashing import hash_passwords
+from .models import UserProfile, UserRole
+from .serializers import BulkUserRowSerializer
+
+FORMATS = {
+    "text/csv": "csv",
+    "application/jsonl": "jsonl",
+    "application/x-ndjson": "jsonl",
+    "application/jsonlines": "jsonl",
+}
+
+Row = Tuple[int, object]
+
+BATCH_SIZE = 1000
+
+
+class ProvisionResult(NamedTuple):
+    created: List[dict]
+    errors: List[dict]
+
+
+def read_rows(lines: Iterable[str], fmt: str) -> Iterator[Row]:
+    """(line number, data) per record; data is a dict, or an error message for unreadable lines."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, {
+                key.strip(): value.strip() for key, value in record.items()
+                if key and isinstance(value, str) and value.strip()
+            }
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_num, "Invalid JSON"
+                continue
+            yield line_num, record if isinstance(record, dict) else "Expected a JSON object"
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _validate(rows, tenant_id, principal):
+    """Splits ``rows`` into valid (line, data) pairs and row errors."""
+    valid, errors = [], []
+    for line, data in rows:
+        if not isinstance(data, dict):
+            errors.append({"row": line, "errors": {"non_field_errors": [data]}})
+            continue
+        serializer = BulkUserRowSerializer(data=data)
+        if not serializer.is_valid():
+            errors.append({"row": line, "errors": serializer.errors})
+            continue
+        row = serializer.validated_data
+        row["tenant_id"] = row.get("tenant_id") or tenant_id
+        if row["tenant_id"] is None:
+            errors.append({"row": line, "errors": {"tenant_id": ["This field is required."]}})
+        elif principal is not None and not principal.can_access_tenant(row["tenant_id"]):
+            errors.append({"row": line, "errors": {"tenant_id": ["You cannot add users to this tenant."]}})
+        elif principal is not None and row["role"] == UserRole.ADMIN and not principal.is_platform_admin:
+            errors.append({"row": line, "errors": {"role": ["Only platform admins can create admins."]}})
+        else:
+            valid.append((line, row))
+
+    tenants = {
+        tenant.pk: tenant
+        for tenant in quotas.with_user_limit(Tenant.objects.filter(pk__in={row["tenant_id"] for _, row in valid}))
+    }
+    taken = set(
+        User.objects.filter(username__in={row["username"] for _, row in valid}).values_list("username", flat=True)
+    )
+    accepted = []
+    for line, row in valid:
+        if row["tenant_id"] not in tenants:
+            errors.append({"row": line, "errors": {"tenant_id": ["Invalid tenant_id"]}})
+        elif row["username"] in taken:
+            errors.append({"row": line, "errors": {"username": ["Username already exists"]}})
+        else:
+            taken.add(row["username"])
+            row["tenant"] = tenants[row["tenant_id"]]
+            accepted.append((line, row))
+    return accepted, errors
+
+
+def _insert_users(pending, errors):
+    """
+    Inserts ``pending`` (line, user, tenant, role) entries a chunk at a time,
+    dropping rows whose username was taken since validation into ``errors``.
+    Returns the inserted entries.
+    """
+    inserted = []
+    for start in range(0, len(pending), BATCH_SIZE):
+        chunk = pending[start:start + BATCH_SIZE]
+        while chunk:
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_create([user for _, user, _, _ in chunk])
+            except IntegrityError:
+                taken = set(
+                    User.objects.filter(username__in=[user.username for _, user, _, _ in chunk])
+                    .values_list("username", flat=True)
+                )
+                if not taken:
+                    raise
+                for line, user, _, _ in chunk:
+                    if user.username in taken:
+                        errors.append({"row": line, "errors": {"username": ["Username already exists"]}})
+                chunk = [entry for entry in chunk if entry[1].username not in taken]
+            else:
+                inserted.extend(chunk)
+                break
+    return inserted
+
+
+def provision(rows: Iterable[Row], tenant_id=None, *, principal=None, enforce_quota: bool = True,
+              workers: Optional[int] = None) -> ProvisionResult:
+    """
+    Creates the users in ``rows``. Rows without ``tenant_id`` join
+    ``tenant_id``; a ``principal`` restricts rows to tenants it may manage.
+    """
+    accepted, errors = _validate(list(rows), tenant_id, principal)
+    hashed = hash_passwords([row["password"] for _, row in accepted], workers)
+
+    by_tenant = defaultdict(list)
+    for (line, row), password in zip(accepted, hashed):
+        by_tenant[row["tenant"].pk].append((line, row, password))
+
+    with transaction.atomic():
+        pending = []
+        # Lock counters in a fixed order so concurrent batches cannot deadlock
+        for tenant_pk in sorted(by_tenant, key=str):
+            rows = by_tenant[tenant_pk]
+            tenant = rows[0][1]["tenant"]
+            limit = (tenant.max_users or None) if enforce_quota else None
+            used = quotas.check(tenant_pk, quotas.USERS)
+            room = len(rows) if limit is None else max(limit - used, 0)
+            for line, row, password in rows[room:]:
+                errors.append({"row": line, "errors": {"non_field_errors": [quotas.MESSAGES[quotas.USERS]]}})
+            for line, row, password in rows[:room]:
+                user = User(username=row["username"], email=row.get("email", ""), password=password)
+                pending.append((line, user, tenant, row["role"]))
+
+        inserted = _insert_users(pending, errors)
+        if inserted and not connection.features.can_return_rows_from_bulk_insert:
+            ids = dict(
+                User.objects.filter(username__in=[user.username for _, user, _, _ in inserted])
+                .values_list("username", "pk")
+            )
+            for _, user, _, _ in inserted:
+                user.pk = ids[user.username]
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user, tenant=tenant, role=role) for _, user, tenant, role in inserted],
+            batch_size=BATCH_SIZE,
+        )
+        # bulk_create sends no post_save, so the counters are updated here
+        added = defaultdict(int)
+        for _, _, tenant, _ in inserted:
+            added[tenant.pk] += 1
+        for tenant_pk, count in added.items():
+            quotas.increment(tenant_pk, quotas.USERS, count)
+
+    created = [
+        {"row": line, "id": user.pk, "username": user.username, "tenant_id": str(tenant.pk), "role": role}
+        for line, user, tenant, role in inserted
+    ]
+    errors.sort(key=lambda error: error["row"])
+    return ProvisionResult(created, errors)
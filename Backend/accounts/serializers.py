@@ -1,9 +1,15 @@
 from typing import Optional
 from uuid import UUID
 from django.contrib.auth.models import User
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 from tenants.models import Tenant
+from .authentication import add_tenant_claims, load_user
+from .denylist import add_revision_claim, is_token_denied
 from .models import UserProfile, UserRole
 
 
@@ -15,6 +21,12 @@ class UserRegistrationSerializer(serializers.Serializer):
     role = serializers.ChoiceField(choices=UserRole.choices, required=False, default=UserRole.TENANT_USER)
 
 
+class BulkUserRowSerializer(UserRegistrationSerializer):
+    """One row of a bulk registration; ``tenant_id`` defaults to the batch's tenant."""
+
+    tenant_id = serializers.UUIDField(required=False)
+
+
 class TenantNestedSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tenant
@@ -34,3 +46,42 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ("user", "tenant", "role", "created_at")
+
+
+class TenantTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issues tokens that carry tenant_id, role, is_superuser and revision claims."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        add_tenant_claims(token, user)
+        add_revision_claim(token, user.pk)
+        return token
+
+
+class TenantTokenRefreshSerializer(TokenRefreshSerializer):
+    """Re-reads the user on refresh so role/tenant changes reach new access tokens."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        if is_token_denied(refresh):
+            raise InvalidToken(_("Token has been revoked"))
+
+        user = load_user(User, refresh.get(api_settings.USER_ID_CLAIM))
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        add_tenant_claims(refresh, user)
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+
+        return data
+
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False)
@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from tenants import quotas
+from .denylist import deny_user
+from .models import UserProfile
+
+
+# The ``users`` counter follows UserProfile rows in the same transaction
+@receiver(post_save, sender=UserProfile, dispatch_uid="accounts.count_user")
+def count_user(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        quotas.increment(instance.tenant_id, quotas.USERS)
+
+
+@receiver(post_delete, sender=UserProfile, dispatch_uid="accounts.uncount_user")
+def uncount_user(sender, instance, **kwargs):
+    quotas.increment(instance.tenant_id, quotas.USERS, -1)
+
+
+# Tokens carry these (or are only valid while they hold): changing any of
+# them revokes every token issued to the user so far
+REVOKING_FIELDS = {
+    User: ("is_active", "is_superuser"),
+    UserProfile: ("tenant_id", "role"),
+}
+
+
+def _watched(sender, instance, raw, update_fields):
+    if raw or instance.pk is None:
+        return ()
+    fields = REVOKING_FIELDS[sender]
+    if update_fields is not None:
+        # e.g. update_last_login saves last_login alone
+        fields = tuple(field for field in fields if field in update_fields or field.removesuffix("_id") in update_fields)
+    return fields
+
+
+@receiver(pre_save, sender=User, dispatch_uid="accounts.remember_user_claims")
+@receiver(pre_save, sender=UserProfile, dispatch_uid="accounts.remember_profile_claims")
+def remember_claims(sender, instance, raw=False, update_fields=None, **kwargs):
+    fields = _watched(sender, instance, raw, update_fields)
+    if fields:
+        instance._stored_claims = (fields, sender.objects.filter(pk=instance.pk).values_list(*fields).first())
+
+
+@receiver(post_save, sender=User, dispatch_uid="accounts.revoke_user_tokens")
+@receiver(post_save, sender=UserProfile, dispatch_uid="accounts.revoke_profile_tokens")
+def revoke_on_claim_change(sender, instance, created, raw=False, **kwargs):
+    fields, stored = instance.__dict__.pop("_stored_claims", ((), None))
+    changed = stored is not None and stored != tuple(getattr(instance, field) for field in fields)
+    # set_password() keeps the raw password until save() returns; hash
+    # upgrades at login go through check_password() and leave it unset
+    password_changed = sender is User and not created and getattr(instance, "_password", None) is not None
+    if changed or password_changed:
+        deny_user(instance.pk if sender is User else instance.user_id)
+
+
+@receiver(post_delete, sender=User, dispatch_uid="accounts.revoke_deleted_user")
+@receiver(post_delete, sender=UserProfile, dispatch_uid="accounts.revoke_deleted_profile")
+def revoke_on_delete(sender, instance, **kwargs):
+    deny_user(instance.pk if sender is User else instance.user_id)
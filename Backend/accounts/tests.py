@@ -1,3 +1,478 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import hashers as django_hashers
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from eshtarek.testing import NonOwnerRoleMixin, QueryBudgetMixin, requires_postgres
+from plans.models import Plan
+from subscriptions.models import Subscription
+from tenants import quotas
+from tenants.models import Tenant, TenantUsage
+from . import provisioning
+from .authentication import Principal
+from .denylist import is_token_denied
+from .models import UserProfile, UserRole
+from .hashers import ScryptPasswordHasher
+from .hashing import hash_passwords
+from .serializers import TenantTokenObtainPairSerializer
+
+
+class AccountsQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+
+    def setUp(self):
+        token = TenantTokenObtainPairSerializer.get_token(self.member).access_token
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_me(self):
+        # profile with user and tenant, no separate identity lookup
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/accounts/me/', **self.auth)
+        self.assertEqual(response.json()['tenant']['id'], str(self.tenant.id))
+
+    def test_tenant_user_cannot_list_tenants(self):
+        with self.assertDataQueries(0):
+            response = self.client.get('/api/tenants/', **self.auth)
+        self.assertEqual(response.status_code, 403)
+
+    def test_profiles_for_principal(self):
+        other = Tenant.objects.create(name='Globex')
+        principal = Principal(user_id=99, tenant_id=str(other.id), role=UserRole.TENANT_ADMIN)
+        self.assertFalse(UserProfile.objects.for_principal(principal).exists())
+
+
+class TokenRevocationTests(TestCase):
+    """Stateless tokens stop working as soon as the claims or credentials behind them change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.member = User.objects.create_user('member', password='pw123456')
+        cls.profile = UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        token = TenantTokenObtainPairSerializer.get_token(self.member).access_token
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def me(self):
+        return self.client.get('/api/accounts/me/', **self.auth).status_code
+
+    def test_deactivation(self):
+        self.member.is_active = False
+        self.member.save()
+        self.assertEqual(self.me(), 401)
+
+    def test_password_change(self):
+        self.member.set_password('new-password')
+        self.member.save(update_fields=['password'])
+        self.assertEqual(self.me(), 401)
+
+    def test_role_change(self):
+        self.profile.role = UserRole.TENANT_ADMIN
+        self.profile.save()
+        self.assertEqual(self.me(), 401)
+
+    def test_login_right_after_revocation(self):
+        # Revoked and issued again within the same second
+        now = datetime.now(dt_timezone.utc)
+        with mock.patch('rest_framework_simplejwt.tokens.aware_utcnow', return_value=now), \
+                mock.patch('accounts.denylist.time.time', return_value=now.timestamp()):
+            self.member.set_password('new-password')
+            self.member.save(update_fields=['password'])
+            response = self.client.post('/api/auth/token/', {'username': 'member', 'password': 'new-password'})
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {response.json()["access"]}'}
+        self.assertEqual(self.client.get('/api/accounts/me/', **auth).status_code, 200)
+        refreshed = self.client.post('/api/auth/token/refresh/', {'refresh': response.json()['refresh']})
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertEqual(self.me(), 401)
+
+    def test_other_changes_keep_tokens(self):
+        self.member.first_name = 'Mem'
+        self.member.save()
+        self.member.save(update_fields=['last_login'])
+        self.profile.save()
+        self.assertEqual(self.me(), 200)
+
+
+@override_settings(ROOT_URLCONF='eshtarek.async_urls')
+class AsyncMeTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def auth(self, user):
+        token = TenantTokenObtainPairSerializer.get_token(user).access_token
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_matches_sync_view(self):
+        for user in (self.member, self.admin):
+            auth = self.auth(user)
+            actual = self.client.get('/api/accounts/me/', **auth)
+            with override_settings(ROOT_URLCONF='eshtarek.urls'):
+                expected = self.client.get('/api/accounts/me/', **auth)
+            self.assertEqual(actual.status_code, expected.status_code)
+            self.assertEqual(actual.content, expected.content)
+        self.assertEqual(actual.status_code, 404)
+
+    def test_query_budget(self):
+        auth = self.auth(self.member)
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/accounts/me/', **auth)
+        self.assertEqual(response.json()['tenant']['id'], str(self.tenant.id))
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 401)
+        self.assertEqual(self.client.get('/api/accounts/me/', HTTP_AUTHORIZATION='Bearer bogus').status_code, 401)
+
+    def test_other_methods_not_allowed(self):
+        response = self.client.post('/api/accounts/me/', {}, **self.auth(self.member))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_served_by_asgi_handler(self):
+        token = TenantTokenObtainPairSerializer.get_token(self.member).access_token
+        response = await self.async_client.get('/api/accounts/me/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'member')
+
+
+def register(client, tenant, username, **extra):
+    return client.post('/api/accounts/register/', {
+        'username': username, 'password': 'pw123456', 'tenant_id': str(tenant.id),
+    }, content_type='application/json', **extra)
+
+
+class RegistrationQuotaTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Team', max_users=2, features={'limits': {'projects': 3}})
+        cls.tenant = Tenant.objects.create(name='Acme')
+        Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        owner = User.objects.create_user('owner', password='pw123456')
+        UserProfile.objects.create(user=owner, tenant=cls.tenant, role=UserRole.TENANT_ADMIN)
+
+    def used(self, metric=quotas.USERS):
+        return quotas.usage(self.tenant.id).get(metric, 0)
+
+    def test_register_updates_counter(self):
+        # tenant with plan limit, counter lock, user, profile, counter update; no COUNT(*)
+        with self.assertDataQueries(5) as ctx:
+            response = register(self.client, self.tenant, 'second')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(any('COUNT(' in q['sql'].upper() for q in ctx.captured_queries))
+        self.assertEqual(self.used(), 2)
+
+    def test_limit_reached(self):
+        self.assertEqual(register(self.client, self.tenant, 'second').status_code, 201)
+        response = register(self.client, self.tenant, 'third')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['detail'], "Max users limit reached for the tenant's current plan")
+        self.assertFalse(User.objects.filter(username='third').exists())
+        self.assertEqual(self.used(), 2)
+
+    def test_duplicate_username(self):
+        response = register(self.client, self.tenant, 'owner')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'Username already exists')
+        self.assertEqual(self.used(), 1)
+
+    def test_invalid_tenant(self):
+        response = register(self.client, Tenant(name='Ghost'), 'ghost')
+        self.assertEqual(response.status_code, 400)
+
+    def test_no_plan_is_unlimited(self):
+        tenant = Tenant.objects.create(name='Globex')
+        for i in range(3):
+            self.assertEqual(register(self.client, tenant, f'g{i}').status_code, 201)
+        self.assertEqual(quotas.usage(tenant.id), {quotas.USERS: 3})
+
+    def test_deleting_profile_releases_seat(self):
+        UserProfile.objects.get(user__username='owner').delete()
+        self.assertEqual(self.used(), 0)
+
+    def test_metered_feature(self):
+        with transaction.atomic():
+            self.assertEqual(quotas.consume(self.tenant.id, 'projects', 2), 2)
+        with self.assertRaises(quotas.QuotaExceeded) as raised, transaction.atomic():
+            quotas.consume(self.tenant.id, 'projects', 2)
+        self.assertEqual((raised.exception.limit, raised.exception.used), (3, 2))
+        self.assertEqual(self.used('projects'), 2)
+
+    def test_recount(self):
+        TenantUsage.objects.filter(tenant=self.tenant).update(value=42)
+        out = StringIO()
+        call_command('recount_usage', stdout=out)
+        self.assertIn('users counter', out.getvalue())
+        self.assertEqual(self.used(), 1)
+
+
+@requires_postgres
+class NonOwnerRoleTests(NonOwnerRoleMixin, QueryBudgetMixin, TestCase):
+    """Registration, login and tenant requests with the tenant policies in force."""
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Team', max_users=2)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        owner = User.objects.create_user('owner', password='pw123456')
+        UserProfile.objects.create(user=owner, tenant=cls.tenant, role=UserRole.TENANT_ADMIN)
+        cls.other = Tenant.objects.create(name='Globex')
+        outsider = User.objects.create_user('outsider', password='pw123456')
+        UserProfile.objects.create(user=outsider, tenant=cls.other, role=UserRole.TENANT_USER)
+
+    def login(self, username):
+        response = self.client.post('/api/auth/token/', {'username': username, 'password': 'pw123456'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_register_within_plan_limit(self):
+        response = register(self.client, self.tenant, 'second')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['tenant']['id'], str(self.tenant.id))
+        self.assertEqual(register(self.client, self.tenant, 'third').status_code, 403)
+
+    def test_login_carries_tenant_claims(self):
+        access = AccessToken(self.login('owner')['access'])
+        self.assertEqual((access['tenant_id'], access['role']), (str(self.tenant.id), UserRole.TENANT_ADMIN))
+
+    def test_refresh_carries_tenant_claims(self):
+        refresh = self.login('owner')['refresh']
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+        self.assertEqual(AccessToken(response.json()['access'])['tenant_id'], str(self.tenant.id))
+
+    def test_tenant_requests_see_their_tenant_only(self):
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {self.login('owner')['access']}"}
+        response = self.client.get('/api/accounts/me/', **auth)
+        self.assertEqual(response.json()['tenant']['id'], str(self.tenant.id))
+        self.assertFalse(UserProfile.objects.filter(tenant=self.other).exists())
+
+    @override_settings(JWT_STATELESS_USER=False)
+    def test_database_user_lookup_resolves_the_tenant(self):
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {self.login('owner')['access']}"}
+        response = self.client.get('/api/accounts/me/', **auth)
+        self.assertEqual(response.json()['tenant']['id'], str(self.tenant.id))
+
+
+@requires_postgres
+class RegistrationConcurrencyTests(TransactionTestCase):
+    """Parallel signups against one tenant, each on its own connection."""
+
+    workers = 8
+
+    def test_limit_holds_under_concurrency(self):
+        plan = Plan.objects.create(name='Team', max_users=3)
+        tenant = Tenant.objects.create(name='Acme')
+        Subscription.objects.create(tenant=tenant, plan=plan)
+        barrier = threading.Barrier(self.workers)
+        statuses = []
+
+        def signup(i):
+            try:
+                barrier.wait()
+                statuses.append(register(Client(), tenant, f'user{i}').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=signup, args=(i,)) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] * 3 + [403] * (self.workers - 3))
+        self.assertEqual(UserProfile.objects.filter(tenant=tenant).count(), 3)
+        self.assertEqual(quotas.usage(tenant.id), {quotas.USERS: 3})
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def csv_body(rows, header='username,email,password,role,tenant_id'):
+    return '\n'.join([header] + [','.join(row) for row in rows]) + '\n'
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BulkProvisioningTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Team', max_users=50)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.other = Tenant.objects.create(name='Globex')
+        Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        cls.admin = User.objects.create_user('acme-admin', password='pw123456')
+        UserProfile.objects.create(user=cls.admin, tenant=cls.tenant, role=UserRole.TENANT_ADMIN)
+
+    def setUp(self):
+        token = TenantTokenObtainPairSerializer.get_token(self.admin).access_token
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def post(self, body, content_type='text/csv', **extra):
+        return self.client.post('/api/accounts/register/bulk/', body, content_type=content_type, **self.auth, **extra)
+
+    def test_csv_with_row_errors(self):
+        response = self.post(csv_body([
+            ('alice', 'alice@example.com', 'pw123456', '', ''),
+            ('bob', 'not-an-email', 'pw123456', '', ''),
+            ('alice', '', 'pw123456', '', ''),
+            ('acme-admin', '', 'pw123456', '', ''),
+            ('carol', '', 'pw123456', 'ADMIN', ''),
+            ('dave', '', 'pw123456', '', str(self.other.id)),
+            ('erin', '', 'pw123456', 'TENANT_ADMIN', ''),
+        ]))
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([u['username'] for u in body['users']], ['alice', 'erin'])
+        self.assertEqual(
+            {error['row']: list(error['errors']) for error in body['errors']},
+            {3: ['email'], 4: ['username'], 5: ['username'], 6: ['role'], 7: ['tenant_id']},
+        )
+        alice = UserProfile.objects.select_related('user').get(user__username='alice')
+        self.assertEqual((alice.tenant_id, alice.role), (self.tenant.id, UserRole.TENANT_USER))
+        self.assertTrue(check_password('pw123456', alice.user.password))
+        self.assertEqual(quotas.usage(self.tenant.id), {quotas.USERS: 3})
+
+    def test_queries_do_not_grow_with_rows(self):
+        # tenants, usernames, counter lock, users, profiles, counter update
+        for count in (3, 30):
+            rows = [(f'u{count}-{i}', '', 'pw123456', '', '') for i in range(count)]
+            with self.assertDataQueries(6):
+                response = self.post(csv_body(rows))
+            self.assertEqual(response.json()['created'], count)
+
+    def test_quota_checked_once_per_batch(self):
+        Subscription.objects.filter(tenant=self.tenant).update(plan=Plan.objects.create(name='Small', max_users=3))
+        response = self.post(csv_body([(f'u{i}', '', 'pw123456', '', '') for i in range(4)]))
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (2, 2))
+        self.assertEqual(body['errors'][0]['errors'], {
+            'non_field_errors': ["Max users limit reached for the tenant's current plan"],
+        })
+        self.assertEqual(UserProfile.objects.filter(tenant=self.tenant).count(), 3)
+
+    def test_jsonl(self):
+        lines = [json.dumps({'username': 'jo', 'password': 'pw123456'}), '{broken', '', '[1]']
+        body = self.post('\n'.join(lines), content_type='application/x-ndjson').json()
+        self.assertEqual(body['created'], 1)
+        self.assertEqual(body['errors'], [
+            {'row': 2, 'errors': {'non_field_errors': ['Invalid JSON']}},
+            {'row': 4, 'errors': {'non_field_errors': ['Expected a JSON object']}},
+        ])
+
+    def test_rejects_other_content_types_and_members(self):
+        self.assertEqual(self.post('[]', content_type='application/json').status_code, 415)
+        member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=member, tenant=self.tenant, role=UserRole.TENANT_USER)
+        token = TenantTokenObtainPairSerializer.get_token(member).access_token
+        response = self.client.post(
+            '/api/accounts/register/bulk/', csv_body([]), content_type='text/csv',
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/accounts/register/bulk/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 403)
+
+    def test_username_taken_after_validation(self):
+        real_hash = provisioning.hash_passwords
+
+        def hash_and_race(passwords, workers):
+            # Another registration commits between validation and the insert
+            User.objects.create_user('bob', password='pw123456')
+            return real_hash(passwords, workers)
+
+        rows = list(provisioning.read_rows(StringIO(csv_body([
+            ('alice', '', 'pw123456', '', ''),
+            ('bob', '', 'pw123456', '', ''),
+            ('carol', '', 'pw123456', '', ''),
+        ])), 'csv'))
+        with mock.patch.object(provisioning, 'hash_passwords', side_effect=hash_and_race):
+            result = provisioning.provision(rows, self.tenant.id)
+        self.assertEqual([user['username'] for user in result.created], ['alice', 'carol'])
+        self.assertEqual(result.errors, [{'row': 3, 'errors': {'username': ['Username already exists']}}])
+        self.assertFalse(UserProfile.objects.filter(user__username='bob').exists())
+        self.assertEqual(quotas.usage(self.tenant.id), {quotas.USERS: 3})
+
+    @override_settings(BULK_PROVISION_MAX_ROWS=2)
+    def test_row_limit(self):
+        response = self.post(csv_body([(f'u{i}', '', 'pw123456', '', '') for i in range(3)]))
+        self.assertEqual(response.status_code, 413)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(csv_body([(f'cmd{i}', '', 'pw123456', '', '') for i in range(5)] + [('x', '', 'short', '', '')]))
+        self.addCleanup(os.unlink, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('provision_users', f.name, tenant=str(self.other.id), batch_size=2, stdout=out, stderr=err)
+        self.assertIn('Created 5 user(s), 1 row(s) rejected', out.getvalue())
+        self.assertIn('line 7', err.getvalue())
+        self.assertEqual(quotas.usage(self.other.id), {quotas.USERS: 5})
+
+    @override_settings(BULK_PROVISION_POOL_MIN=1)
+    def test_hash_passwords_in_pool(self):
+        hashed = hash_passwords(['first-pw', 'second-pw', 'third-pw'], workers=2)
+        self.assertEqual(len(hashed), 3)
+        self.assertTrue(check_password('second-pw', hashed[1]))
+        self.assertTrue(hashed[0].startswith('md5$'))
+
+
+TUNED_HASHERS = ['accounts.hashers.PBKDF2PasswordHasher', 'accounts.hashers.ScryptPasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=TUNED_HASHERS, PASSWORD_PBKDF2_ITERATIONS=1000)
+class PasswordRehashTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member', password='pw123456')
+
+    def login(self, password='pw123456'):
+        return self.client.post('/api/auth/token/', {'username': 'member', 'password': password})
+
+    def stored(self):
+        return User.objects.values_list('password', flat=True).get(pk=self.user.pk)
+
+    def test_cost_from_settings(self):
+        self.assertTrue(self.stored().startswith('pbkdf2_sha256$1000$'))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=2000)
+    def test_rehash_on_login_after_cost_change(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.stored().startswith('pbkdf2_sha256$2000$'))
+        # A hash upgrade is not a password change: the new token stays valid
+        self.assertFalse(is_token_denied(AccessToken(response.json()['access'])))
+
+    @override_settings(PASSWORD_HASHERS=TUNED_HASHERS[::-1], PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+    def test_rehash_on_login_after_algorithm_change(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.stored().startswith('scrypt$1024$'))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_stock_scrypt_hashes_are_kept(self):
+        # The default costs are Django's: its hashes are not rehashed at login
+        stock = django_hashers.ScryptPasswordHasher()
+        self.assertFalse(ScryptPasswordHasher().must_update(stock.encode('pw123456', stock.salt())))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=2000)
+    def test_no_rehash_on_failed_login(self):
+        before = self.stored()
+        self.assertEqual(self.login('wrong-password').status_code, 401)
+        self.assertEqual(self.stored(), before)
@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import RegisterView, MeView
+from .views import BulkRegisterView, RegisterView, MeView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
+    path('register/bulk/', BulkRegisterView.as_view(), name='register-bulk'),
     path('me/', MeView.as_view(), name='me'),
 ]
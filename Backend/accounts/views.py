@@ -1,13 +1,26 @@
+import io
+from uuid import UUID
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from eshtarek.aio import AsyncReadView
+from eshtarek.tenant_context import apply_tenant_context
+from tenants import quotas
 from tenants.models import Tenant
-from subscriptions.models import Subscription, SubscriptionStatus
+from . import provisioning
+from .authentication import get_principal
+from .denylist import deny_token
 from .models import UserProfile, UserRole
-from .serializers import UserRegistrationSerializer, UserProfileSerializer
+from .permissions import IsTenantAdmin
+from .serializers import LogoutSerializer, UserRegistrationSerializer, UserProfileSerializer
 
 # Create your views here.
 
@@ -19,47 +32,116 @@ class RegisterView(APIView):
         serializer.is_valid(raise_exception=True)
 
         username = serializer.validated_data["username"]
-        email = serializer.validated_data.get("email")
+        email = serializer.validated_data.get("email", "")
         password = serializer.validated_data["password"]
         tenant_id = serializer.validated_data["tenant_id"]
         role = serializer.validated_data.get("role", UserRole.TENANT_USER)
 
-        try:
-            tenant = Tenant.objects.get(id=tenant_id)
-        except Tenant.DoesNotExist:
-            return Response({"detail": "Invalid tenant_id"}, status=status.HTTP_400_BAD_REQUEST)
-
-        if User.objects.filter(username=username).exists():
-            return Response({"detail": "Username already exists"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Enforce usage limit based on active subscription plan (if any)
-        if not request.user.is_superuser:
-            sub = (
-                Subscription.objects.filter(tenant=tenant, status=SubscriptionStatus.ACTIVE)
-                .select_related("plan")
-                .first()
-            )
-            if sub and sub.plan and sub.plan.max_users:
-                current_users = UserProfile.objects.filter(tenant=tenant).count()
-                if current_users >= sub.plan.max_users:
-                    return Response({
-                        "detail": "Max users limit reached for the tenant's current plan"
-                    }, status=status.HTTP_403_FORBIDDEN)
+        with transaction.atomic():
+            # Registration is anonymous: act as the target tenant for this
+            # transaction, so its plan is visible and the RLS policies admit
+            # its counter and the new profile.
+            apply_tenant_context(str(tenant_id), False)
+            tenant = quotas.with_user_limit(Tenant.objects.filter(id=tenant_id)).first()
+            if tenant is None:
+                return Response({"detail": "Invalid tenant_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = User(username=username, email=email)
-        user.set_password(password)
-        user.save()
+            user = User(username=username, email=email)
+            user.set_password(password)
 
-        profile = UserProfile.objects.create(user=user, tenant=tenant, role=role)
+            # Enforce usage limit based on active subscription plan (if any).
+            # The tenant's counter stays locked until the profile is committed.
+            if not request.user.is_superuser:
+                quotas.check(tenant.pk, quotas.USERS, limit=tenant.max_users or None)
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError:
+                return Response({"detail": "Username already exists"}, status=status.HTTP_400_BAD_REQUEST)
+            profile = UserProfile.objects.create(user=user, tenant=tenant, role=role)
 
         return Response(UserProfileSerializer(profile).data, status=status.HTTP_201_CREATED)
 
 
+class BulkRegisterView(APIView):
+    """
+    Registers users from a CSV (with header) or JSONL body; see
+    accounts.provisioning. Rows without ``tenant_id`` join ``?tenant_id=`` or
+    the caller's tenant. Invalid rows are reported and the rest are created.
+    """
+
+    permission_classes = [IsTenantAdmin]
+
+    def post(self, request):
+        fmt = provisioning.FORMATS.get(request.content_type.split(";")[0].strip().lower())
+        if fmt is None:
+            return Response(
+                {"detail": f"Unsupported content type; use one of {', '.join(provisioning.FORMATS)}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        principal = get_principal(request)
+        try:
+            tenant_id = request.query_params.get("tenant_id") or principal.tenant_id
+            tenant_id = UUID(str(tenant_id)) if tenant_id else None
+            text = request.body.decode("utf-8-sig")
+        except ValueError:
+            return Response({"detail": "Invalid tenant_id or body encoding"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(provisioning.read_rows(io.StringIO(text, newline=""), fmt))
+        max_rows = getattr(settings, "BULK_PROVISION_MAX_ROWS", 5000)
+        if len(rows) > max_rows:
+            return Response(
+                {"detail": f"At most {max_rows} rows per request"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        result = provisioning.provision(rows, tenant_id, principal=principal, enforce_quota=not principal.is_superuser)
+        return Response({
+            "created": len(result.created),
+            "failed": len(result.errors),
+            "users": result.created,
+            "errors": result.errors,
+        })
+
+
 class MeView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_profile_queryset(self):
+        # request.user may be a stateless token user, so load the profile explicitly
+        return UserProfile.objects.select_related("user", "tenant").filter(user_id=self.request.user.id)
+
     def get(self, request):
-        profile = getattr(request.user, "profile", None)
+        return self.profile_response(self.get_profile_queryset().first())
+
+    @staticmethod
+    def profile_response(profile):
         if not profile:
             return Response({"detail": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
         return Response(UserProfileSerializer(profile).data)
+
+
+class AsyncMeView(AsyncReadView):
+    view_class = MeView
+
+    async def handle(self, view, request, *args, **kwargs):
+        return view.profile_response(await view.get_profile_queryset().afirst())
+
+
+class LogoutView(APIView):
+    """Revokes the presented access token and, optionally, its refresh token."""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = LogoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if request.auth is not None:
+            deny_token(request.auth)
+        refresh = serializer.validated_data.get("refresh")
+        if refresh:
+            try:
+                deny_token(RefreshToken(refresh))
+            except TokenError:
+                return Response({"detail": "Invalid refresh token"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_205_RESET_CONTENT)
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import BillingRollup
+
+
+@admin.register(BillingRollup)
+class BillingRollupAdmin(admin.ModelAdmin):
+    list_display = ("day", "tenant", "plan", "currency", "invoiced_cents", "paid_cents", "failed_cents")
+    list_filter = ("currency", "day")
+    search_fields = ("tenant__name",)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily billing rollups from invoices and payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tenant", action="append", dest="tenants", help="Only this tenant id (repeatable)")
+
+    def handle(self, *args, tenants=None, **options):
+        written = rebuild(tenants)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup row(s)"))
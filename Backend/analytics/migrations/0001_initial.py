@@ -0,0 +1,101 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:39
+
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Sum, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+# As of this migration; kept here so later changes to the app code can't alter it
+METRICS = ('invoiced_count', 'invoiced_cents', 'paid_count', 'paid_cents', 'failed_count', 'failed_cents')
+PAID = 'paid'
+FAILED = 'failed'
+
+
+def build_rollups(apps, schema_editor):
+    Invoice = apps.get_model('billing', 'Invoice')
+    Payment = apps.get_model('billing', 'Payment')
+    BillingRollup = apps.get_model('analytics', 'BillingRollup')
+    tz = timezone.get_current_timezone()
+    # (day, tenant_id, plan_id, currency) -> metric -> amount
+    deltas = defaultdict(Counter)
+
+    invoices = (
+        Invoice.objects.order_by()
+        .values(
+            'tenant_id', 'plan_id', 'currency',
+            issued_day=TruncDate('issued_at', tzinfo=tz),
+            paid_day=Case(When(status=PAID, then=TruncDate(Coalesce('paid_at', 'issued_at'), tzinfo=tz)), default=None),
+        )
+        .annotate(n=Count('id'), cents=Sum('amount_cents'))
+    )
+    for row in invoices:
+        invoiced = deltas[(row['issued_day'], row['tenant_id'], row['plan_id'], row['currency'])]
+        invoiced['invoiced_count'] += row['n']
+        invoiced['invoiced_cents'] += row['cents']
+        if row['paid_day'] is not None:
+            paid = deltas[(row['paid_day'], row['tenant_id'], row['plan_id'], row['currency'])]
+            paid['paid_count'] += row['n']
+            paid['paid_cents'] += row['cents']
+
+    # Payments have no tenant column at this point (billing 0009 adds it)
+    failed_payments = (
+        Payment.objects.filter(status=FAILED).order_by()
+        .values(
+            day=TruncDate('created_at', tzinfo=tz),
+            tenant_id=F('invoice__tenant_id'),
+            plan_id=F('invoice__plan_id'),
+            currency=F('invoice__currency'),
+        )
+        .annotate(n=Count('id'), cents=Sum('amount_cents'))
+    )
+    for row in failed_payments:
+        failed = deltas[(row['day'], row['tenant_id'], row['plan_id'], row['currency'])]
+        failed['failed_count'] += row['n']
+        failed['failed_cents'] += row['cents']
+
+    BillingRollup.objects.bulk_create(
+        [
+            BillingRollup(day=day, tenant_id=tenant_id, plan_id=plan_id, currency=currency, **{m: counts[m] for m in METRICS})
+            for (day, tenant_id, plan_id, currency), counts in deltas.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('plans', '0001_initial'),
+        ('tenants', '0003_tenantusage'),
+        ('billing', '0007_invoice_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=10)),
+                ('invoiced_count', models.BigIntegerField(default=0)),
+                ('invoiced_cents', models.BigIntegerField(default=0)),
+                ('paid_count', models.BigIntegerField(default=0)),
+                ('paid_cents', models.BigIntegerField(default=0)),
+                ('failed_count', models.BigIntegerField(default=0)),
+                ('failed_cents', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='billing_rollups', to='plans.plan')),
+                ('tenant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='billing_rollups', to='tenants.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='billing_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'day', 'plan', 'currency'), name='uniq_billing_rollup_key')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
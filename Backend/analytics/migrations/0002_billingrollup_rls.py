@@ -0,0 +1,13 @@
+from django.db import migrations
+
+from eshtarek.rls import TenantRowLevelSecurity
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        TenantRowLevelSecurity('billingrollup'),
+    ]
@@ -0,0 +1,43 @@
+from django.db import models
+
+from plans.models import Plan
+from tenants.managers import TenantScopedManager
+from tenants.models import Tenant
+
+
+class BillingRollup(models.Model):
+    """
+    Billing totals of one day, tenant, plan and currency (see analytics.rollups).
+
+    Invoices count as invoiced on the day they were issued and as paid on the
+    day they were paid; failed payments count on the day they were attempted.
+    """
+
+    day = models.DateField()
+    # Indexed through uniq_billing_rollup_key (tenant_id leads)
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="billing_rollups", db_index=False)
+    # A plan with billing history is kept, as its invoices keep it
+    plan = models.ForeignKey(Plan, on_delete=models.PROTECT, related_name="billing_rollups", null=True, blank=True, db_index=False)
+    currency = models.CharField(max_length=10)
+    invoiced_count = models.BigIntegerField(default=0)
+    invoiced_cents = models.BigIntegerField(default=0)
+    paid_count = models.BigIntegerField(default=0)
+    paid_cents = models.BigIntegerField(default=0)
+    failed_count = models.BigIntegerField(default=0)
+    failed_cents = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TenantScopedManager()
+
+    class Meta:
+        constraints = [
+            # Upsert target; also serves per-tenant date range reads
+            models.UniqueConstraint(fields=["tenant", "day", "plan", "currency"], name="uniq_billing_rollup_key"),
+        ]
+        indexes = [
+            # Platform-wide date range reads
+            models.Index(fields=["day"], name="billing_rollup_day_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.day} {self.tenant_id} plan={self.plan_id} {self.currency}"
@@ -0,0 +1,141 @@
+"""
+Billing reports computed from BillingRollup rows only; raw invoices and
+payments are never scanned, so a report costs one indexed range read of at
+most (days x tenants x plans x currencies) rows.
+
+- ``billing_summary``: invoiced, paid and failed totals per day or month
+  and currency, optionally per tenant and plan, with the collection rate
+  (paid / invoiced cents).
+- ``revenue``: MRR of a month per currency, its plan breakdown, customer and
+  revenue churn against the previous month, and the month's collection rate.
+
+MRR is invoice based: a monthly plan contributes what was invoiced for it in
+the month, a yearly plan a twelfth of what was invoiced for it in the twelve
+months up to and including the month. Rollups without a plan count as
+monthly. A tenant churned when it had MRR in the previous month and has
+none in this one.
+"""
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+
+from plans.models import BillingInterval
+from .rollups import METRICS
+
+DAY, MONTH = "day", "month"
+GROUP_FIELDS = {"tenant": "tenant_id", "plan": "plan_id"}
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def rate(part: int, whole: int) -> Optional[float]:
+    return round(part / whole, 4) if whole else None
+
+
+def billing_summary(rollups, start: date, end: date, interval: str = DAY, group_by: Sequence[str] = ()) -> Dict:
+    """Totals of ``rollups`` (a BillingRollup queryset) from ``start`` to ``end`` inclusive."""
+    period = F("day") if interval == DAY else TruncMonth("day")
+    keys = [GROUP_FIELDS[name] for name in group_by]
+    rows = (
+        rollups.filter(day__gte=start, day__lte=end)
+        .order_by()
+        .values("currency", *keys, period=period)
+        .annotate(**{metric: Sum(metric) for metric in METRICS})
+        .order_by("period", "currency", *keys)
+    )
+    results, totals = [], defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for row in rows:
+        row["collection_rate"] = rate(row["paid_cents"], row["invoiced_cents"])
+        results.append(row)
+        total = totals[row["currency"]]
+        for metric in METRICS:
+            total[metric] += row[metric]
+    return {
+        "start": start,
+        "end": end,
+        "interval": interval,
+        "results": results,
+        "totals": [
+            {"currency": currency, **total, "collection_rate": rate(total["paid_cents"], total["invoiced_cents"])}
+            for currency, total in sorted(totals.items())
+        ],
+    }
+
+
+def revenue(rollups, month: date) -> Dict:
+    """MRR, churn and collection of ``month`` (its first day) from ``rollups``."""
+    previous = add_months(month, -1)
+    rows = (
+        rollups.filter(day__gte=add_months(month, -12), day__lt=add_months(month, 1))
+        .order_by()
+        .values("currency", "tenant_id", "plan_id", interval=F("plan__interval"), month=TruncMonth("day"))
+        .annotate(invoiced_cents=Sum("invoiced_cents"), paid_cents=Sum("paid_cents"))
+    )
+
+    # currency -> (tenant, plan) -> MRR in cents, for this and the previous month
+    mrr = {month: defaultdict(lambda: defaultdict(int)), previous: defaultdict(lambda: defaultdict(int))}
+    collected = defaultdict(lambda: {"invoiced_cents": 0, "paid_cents": 0})
+    for row in rows:
+        key = (row["tenant_id"], row["plan_id"])
+        if row["interval"] == BillingInterval.YEARLY:
+            for target in mrr:
+                if add_months(target, -11) <= row["month"] <= target:
+                    mrr[target][row["currency"]][key] += row["invoiced_cents"] / 12
+        else:
+            if row["month"] in mrr:
+                mrr[row["month"]][row["currency"]][key] += row["invoiced_cents"]
+        if row["month"] == month:
+            collected[row["currency"]]["invoiced_cents"] += row["invoiced_cents"]
+            collected[row["currency"]]["paid_cents"] += row["paid_cents"]
+
+    currencies = sorted(set(mrr[month]) | set(mrr[previous]) | set(collected))
+    return {
+        "month": month.strftime("%Y-%m"),
+        "currencies": [
+            _currency_revenue(currency, mrr[month][currency], mrr[previous][currency], collected[currency])
+            for currency in currencies
+        ],
+    }
+
+
+def _per_tenant(mrr) -> Dict:
+    tenants = defaultdict(float)
+    for (tenant_id, _), cents in mrr.items():
+        tenants[tenant_id] += cents
+    return {tenant_id: cents for tenant_id, cents in tenants.items() if cents > 0}
+
+
+def _currency_revenue(currency: str, current, previous, collected) -> Dict:
+    current_tenants, previous_tenants = _per_tenant(current), _per_tenant(previous)
+    churned = set(previous_tenants) - set(current_tenants)
+    previous_mrr = round(sum(previous_tenants.values()))
+    churned_mrr = round(sum(previous_tenants[tenant_id] for tenant_id in churned))
+    plans = defaultdict(float)
+    for (_, plan_id), cents in current.items():
+        plans[plan_id] += cents
+    by_plan: List[Dict] = [
+        {"plan_id": plan_id, "mrr_cents": round(cents)}
+        for plan_id, cents in sorted(plans.items(), key=lambda item: (item[0] is None, item[0] or 0))
+        if cents
+    ]
+    return {
+        "currency": currency,
+        "mrr_cents": round(sum(current_tenants.values())),
+        "previous_mrr_cents": previous_mrr,
+        "customers": len(current_tenants),
+        "previous_customers": len(previous_tenants),
+        "churned_customers": len(churned),
+        "customer_churn_rate": rate(len(churned), len(previous_tenants)),
+        "churned_mrr_cents": churned_mrr,
+        "revenue_churn_rate": rate(churned_mrr, previous_mrr),
+        "invoiced_cents": collected["invoiced_cents"],
+        "paid_cents": collected["paid_cents"],
+        "collection_rate": rate(collected["paid_cents"], collected["invoiced_cents"]),
+        "plans": by_plan,
+    }
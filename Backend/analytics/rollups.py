@@ -0,0 +1,239 @@
+"""
+Daily billing rollups (BillingRollup), maintained incrementally.
+
+Every invoice and failed payment contributes to the rollup row of its day,
+tenant, plan and currency:
+
+- an invoice adds to ``invoiced_*`` on its ``issued_at`` day and, once paid,
+  to ``paid_*`` on its ``paid_at`` day;
+- a failed payment adds to ``failed_*`` on its ``created_at`` day.
+
+When a row changes, the difference between its new and old contribution is
+added to the rollups with one ``INSERT ... ON CONFLICT DO UPDATE SET
+m = m + EXCLUDED.m`` in the same transaction, so rollups commit or roll back
+with the change. Concurrent writers only ever add, in key order, so they
+neither lose updates nor deadlock on each other. Model saves and deletes are
+picked up by analytics.signals; ``bulk_create`` callers record their rows with
+``record_invoices`` / ``record_payments``.
+
+``rebuild`` rewrites the rollups from the invoice and payment tables, e.g.
+after rows were changed with ``update()`` or raw SQL
+(``manage.py rebuild_rollups``). Reports only ever read the rollups.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from django.db import connections, router, transaction
+from django.db.models import Case, Count, F, Sum, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from billing.models import Invoice, InvoiceStatus, Payment, PaymentStatus
+from .models import BillingRollup
+
+METRICS = ("invoiced_count", "invoiced_cents", "paid_count", "paid_cents", "failed_count", "failed_cents")
+
+# Rows per upsert statement
+BATCH_SIZE = 200
+
+
+class Key(NamedTuple):
+    day: date
+    tenant_id: object
+    plan_id: Optional[int]
+    currency: str
+
+
+class InvoiceState(NamedTuple):
+    """The invoice fields rollups depend on."""
+
+    tenant_id: object
+    plan_id: Optional[int]
+    currency: str
+    amount_cents: int
+    status: str
+    issued_at: datetime
+    paid_at: Optional[datetime]
+
+
+TRACKED_FIELDS = frozenset(InvoiceState._fields) | {"tenant", "plan"}
+
+# Key -> metric -> amount to add
+Deltas = Dict[Key, Counter]
+
+
+def new_deltas() -> Deltas:
+    return defaultdict(Counter)
+
+
+def local_day(value) -> date:
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def invoice_state(invoice, base: Optional[InvoiceState] = None) -> Optional[InvoiceState]:
+    """
+    ``invoice``'s state from its loaded fields, falling back to ``base`` for
+    deferred ones; None when a field is neither loaded nor in ``base``.
+    """
+    values = invoice.__dict__
+    state = []
+    for name in InvoiceState._fields:
+        if name in values:
+            state.append(values[name])
+        elif base is not None:
+            state.append(getattr(base, name))
+        else:
+            return None
+    return InvoiceState(*state)
+
+
+def stored_invoice_state(pk, using=None) -> Optional[InvoiceState]:
+    row = Invoice.objects.using(using).filter(pk=pk).values_list(*InvoiceState._fields).first()
+    return InvoiceState(*row) if row else None
+
+
+def add_invoice(deltas: Deltas, state: Optional[InvoiceState], sign: int = 1) -> None:
+    if state is None:
+        return
+    invoiced = deltas[Key(local_day(state.issued_at), state.tenant_id, state.plan_id, state.currency)]
+    invoiced["invoiced_count"] += sign
+    invoiced["invoiced_cents"] += sign * state.amount_cents
+    if state.status == InvoiceStatus.PAID:
+        paid = deltas[Key(local_day(state.paid_at or state.issued_at), state.tenant_id, state.plan_id, state.currency)]
+        paid["paid_count"] += sign
+        paid["paid_cents"] += sign * state.amount_cents
+
+
+def add_payment(deltas: Deltas, payment, invoice, sign: int = 1) -> None:
+    """Adds ``payment`` of ``invoice`` (an Invoice or InvoiceState); only failed payments count."""
+    if payment.status != PaymentStatus.FAILED:
+        return
+    failed = deltas[Key(local_day(payment.created_at), invoice.tenant_id, invoice.plan_id, invoice.currency)]
+    failed["failed_count"] += sign
+    failed["failed_cents"] += sign * payment.amount_cents
+
+
+def add_stored_invoices(deltas: Deltas, invoices) -> None:
+    """Adds the invoices of the ``invoices`` queryset, aggregated by the database in one query."""
+    tz = timezone.get_current_timezone()
+    paid_day = Case(
+        When(status=InvoiceStatus.PAID, then=TruncDate(Coalesce("paid_at", "issued_at"), tzinfo=tz)),
+        default=None,
+    )
+    rows = (
+        invoices.order_by()
+        .values("tenant_id", "plan_id", "currency", issued_day=TruncDate("issued_at", tzinfo=tz), paid_day=paid_day)
+        .annotate(n=Count("id"), cents=Sum("amount_cents"))
+    )
+    for row in rows:
+        invoiced = deltas[Key(row["issued_day"], row["tenant_id"], row["plan_id"], row["currency"])]
+        invoiced["invoiced_count"] += row["n"]
+        invoiced["invoiced_cents"] += row["cents"]
+        if row["paid_day"] is not None:
+            paid = deltas[Key(row["paid_day"], row["tenant_id"], row["plan_id"], row["currency"])]
+            paid["paid_count"] += row["n"]
+            paid["paid_cents"] += row["cents"]
+
+
+def add_stored_payments(deltas: Deltas, payments) -> None:
+    """Adds the failed payments of the ``payments`` queryset, aggregated by the database."""
+    rows = (
+        payments.filter(status=PaymentStatus.FAILED).order_by()
+        .values(
+            "tenant_id",
+            day=TruncDate("created_at", tzinfo=timezone.get_current_timezone()),
+            plan_id=F("invoice__plan_id"),
+            currency=F("invoice__currency"),
+        )
+        .annotate(n=Count("id"), cents=Sum("amount_cents"))
+    )
+    for row in rows:
+        failed = deltas[Key(row["day"], row["tenant_id"], row["plan_id"], row["currency"])]
+        failed["failed_count"] += row["n"]
+        failed["failed_cents"] += row["cents"]
+
+
+def _sort_key(key: Key):
+    return key.day, str(key.tenant_id), key.plan_id or 0, key.currency
+
+
+def apply(deltas: Deltas, using: Optional[str] = None) -> int:
+    """Adds ``deltas`` to the rollups; returns the number of rows written."""
+    rows = sorted(
+        ((key, counts) for key, counts in deltas.items() if any(counts.values())),
+        key=lambda item: _sort_key(item[0]),
+    )
+    if not rows:
+        return 0
+    using = using or router.db_for_write(BillingRollup)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = BillingRollup._meta
+    # Columns of uniq_billing_rollup_key. Keys without a plan never conflict
+    # (NULLs are distinct) and get rows of their own; reports sum rows anyway.
+    key_fields = [opts.get_field(name) for name in ("day", "tenant", "plan", "currency")]
+    table = qn(opts.db_table)
+    columns = [field.column for field in key_fields] + list(METRICS) + ["updated_at"]
+    updates = [f"{qn(m)} = {table}.{qn(m)} + EXCLUDED.{qn(m)}" for m in METRICS]
+    updates.append(f"{qn('updated_at')} = EXCLUDED.{qn('updated_at')}")
+    updated_at = opts.get_field("updated_at").get_db_prep_save(timezone.now(), connection)
+    placeholder = f"({', '.join(['%s'] * len(columns))})"
+
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), BATCH_SIZE):
+            batch = rows[i:i + BATCH_SIZE]
+            params = []
+            for key, counts in batch:
+                params += [field.get_db_prep_save(value, connection) for field, value in zip(key_fields, key)]
+                params += [counts[m] for m in METRICS]
+                params.append(updated_at)
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) "
+                f"VALUES {', '.join([placeholder] * len(batch))} "
+                f"ON CONFLICT ({', '.join(qn(field.column) for field in key_fields)}) "
+                f"DO UPDATE SET {', '.join(updates)}",
+                params,
+            )
+    return len(rows)
+
+
+def record_invoices(invoices: Iterable, using: Optional[str] = None) -> int:
+    """Records Invoice instances inserted with ``bulk_create``."""
+    deltas = new_deltas()
+    for invoice in invoices:
+        add_invoice(deltas, invoice_state(invoice))
+    return apply(deltas, using)
+
+
+def record_payments(payments: Iterable, using: Optional[str] = None) -> int:
+    """Records Payment instances inserted with ``bulk_create``; their invoices must be loaded."""
+    deltas = new_deltas()
+    for payment in payments:
+        add_payment(deltas, payment, payment.invoice)
+    return apply(deltas, using)
+
+
+def rebuild(tenant_ids=None) -> int:
+    """Rewrites the rollups (of ``tenant_ids``, default all) from invoices and payments; returns the rows written."""
+    using = router.db_for_write(BillingRollup)
+    connection = connections[using]
+    invoices = Invoice.objects.using(using).all()
+    payments = Payment.objects.using(using).all()
+    existing = BillingRollup.objects.using(using).all()
+    if tenant_ids is not None:
+        invoices = invoices.filter(tenant_id__in=tenant_ids)
+        payments = payments.filter(tenant_id__in=tenant_ids)
+        existing = existing.filter(tenant_id__in=tenant_ids)
+
+    with transaction.atomic(using=using):
+        if connection.vendor == "postgresql":
+            # Waits for transactions with pending increments and holds off new
+            # ones, so none is counted twice or lost while the counts are taken
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {connection.ops.quote_name(BillingRollup._meta.db_table)} IN SHARE ROW EXCLUSIVE MODE")
+        deltas = new_deltas()
+        add_stored_invoices(deltas, invoices)
+        add_stored_payments(deltas, payments)
+        existing.delete()
+        return apply(deltas, using)
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+
+from .reports import DAY, GROUP_FIELDS, MONTH
+
+# Longest range of a daily summary, in days
+MAX_DAILY_RANGE = 366
+
+
+class BillingSummaryParamsSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=[DAY, MONTH], default=DAY)
+    group_by = serializers.CharField(required=False, default="", help_text="Comma-separated: tenant, plan")
+    tenant = serializers.UUIDField(required=False)
+
+    def validate_group_by(self, value):
+        names = [name for name in value.split(",") if name]
+        unknown = sorted(set(names) - set(GROUP_FIELDS))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown group(s): {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+
+    def validate(self, attrs):
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=29))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError({"start": ["Must not be after end"]})
+        if attrs["interval"] == DAY and (attrs["end"] - attrs["start"]).days >= MAX_DAILY_RANGE:
+            raise serializers.ValidationError({"start": [f"Daily summaries cover at most {MAX_DAILY_RANGE} days"]})
+        return attrs
+
+
+class RevenueParamsSerializer(serializers.Serializer):
+    month = serializers.DateField(required=False, input_formats=["%Y-%m"])
+    tenant = serializers.UUIDField(required=False)
+
+    def validate_month(self, value):
+        return value.replace(day=1)
+
+    def validate(self, attrs):
+        attrs.setdefault("month", timezone.localdate().replace(day=1))
+        return attrs
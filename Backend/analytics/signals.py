@@ -0,0 +1,104 @@
+from weakref import WeakKeyDictionary
+
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from billing.models import Invoice, Payment, PaymentStatus
+from tenants.models import Tenant
+from . import rollups
+
+
+# Billing rollups follow Invoice and Payment rows in the same transaction.
+# An invoice remembers the state it was loaded with, so a save only writes
+# the difference to the rollups.
+@receiver(post_init, sender=Invoice, dispatch_uid="analytics.remember_invoice")
+def remember_invoice(sender, instance, **kwargs):
+    instance._rollup_state = rollups.invoice_state(instance) if instance.pk is not None else None
+
+
+def _touches_rollups(update_fields) -> bool:
+    return update_fields is None or not rollups.TRACKED_FIELDS.isdisjoint(update_fields)
+
+
+def _tenant_deleted(origin) -> bool:
+    # Deleting a tenant cascades to its rollups; don't write new ones for it
+    return getattr(origin, "model", type(origin)) is Tenant
+
+
+@receiver(pre_save, sender=Invoice, dispatch_uid="analytics.load_invoice_state")
+def load_invoice_state(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    # Loaded with deferred fields (or not loaded at all): read the stored state
+    if raw or instance._state.adding or getattr(instance, "_rollup_state", None) is not None:
+        return
+    if _touches_rollups(update_fields):
+        instance._rollup_state = rollups.stored_invoice_state(instance.pk, using)
+
+
+@receiver(post_save, sender=Invoice, dispatch_uid="analytics.roll_up_invoice")
+def roll_up_invoice(sender, instance, created, raw=False, using=None, update_fields=None, **kwargs):
+    if raw or not (created or _touches_rollups(update_fields)):
+        return
+    old = None if created else getattr(instance, "_rollup_state", None)
+    if old is None and not created:
+        return
+    new = rollups.invoice_state(instance, base=old)
+    if new != old:
+        deltas = rollups.new_deltas()
+        rollups.add_invoice(deltas, old, -1)
+        rollups.add_invoice(deltas, new)
+        rollups.apply(deltas, using)
+    instance._rollup_state = new
+
+
+# A delete cascades from an invoice to its payments, and the payments go
+# first: keep the state of the invoices being deleted, by the origin of the
+# delete, so their payments can be unrolled without loading them again.
+_deleting_invoices = WeakKeyDictionary()
+
+
+@receiver(pre_delete, sender=Invoice, dispatch_uid="analytics.keep_deleted_invoice")
+def keep_deleted_invoice(sender, instance, origin=None, **kwargs):
+    if origin is not None and not _tenant_deleted(origin):
+        state = rollups.invoice_state(instance, base=getattr(instance, "_rollup_state", None))
+        _deleting_invoices.setdefault(origin, {})[instance.pk] = state
+
+
+@receiver(post_delete, sender=Invoice, dispatch_uid="analytics.unroll_invoice")
+def unroll_invoice(sender, instance, using=None, origin=None, **kwargs):
+    if _tenant_deleted(origin):
+        return
+    if origin is not None:
+        _deleting_invoices.get(origin, {}).pop(instance.pk, None)
+    deltas = rollups.new_deltas()
+    rollups.add_invoice(deltas, rollups.invoice_state(instance, base=getattr(instance, "_rollup_state", None)), -1)
+    rollups.apply(deltas, using)
+
+
+# Payments are never updated, only created and (with their invoice) deleted
+@receiver(post_save, sender=Payment, dispatch_uid="analytics.roll_up_payment")
+def roll_up_payment(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw:
+        rollups.record_payments([instance], using)
+
+
+def _payment_invoice(payment, origin, using):
+    invoice = _deleting_invoices.get(origin, {}).get(payment.invoice_id) if origin is not None else None
+    if invoice is not None:
+        return invoice
+    if Payment.invoice.is_cached(payment):
+        return payment.invoice
+    # None when the invoice is gone, e.g. its partition was detached
+    return rollups.stored_invoice_state(payment.invoice_id, using)
+
+
+@receiver(post_delete, sender=Payment, dispatch_uid="analytics.unroll_payment")
+def unroll_payment(sender, instance, using=None, origin=None, **kwargs):
+    # Only failed payments count, and those need their invoice's plan and currency
+    if _tenant_deleted(origin) or instance.status != PaymentStatus.FAILED:
+        return
+    invoice = _payment_invoice(instance, origin, using)
+    if invoice is None:
+        return
+    deltas = rollups.new_deltas()
+    rollups.add_payment(deltas, instance, invoice, -1)
+    rollups.apply(deltas, using)
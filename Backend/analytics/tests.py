@@ -0,0 +1,273 @@
+from datetime import datetime, timezone as dt_timezone
+from importlib import import_module
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import ProtectedError, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import UserProfile, UserRole
+from accounts.serializers import TenantTokenObtainPairSerializer
+from billing.models import Invoice, InvoiceStatus, Payment, PaymentStatus, WebhookEvent
+from billing.renewals import renew_due
+from billing.webhooks import process_events
+from eshtarek.testing import QueryBudgetMixin, requires_postgres
+from plans.models import BillingInterval, Plan
+from subscriptions.models import Subscription
+from tenants.models import Tenant
+from .models import BillingRollup
+from .rollups import METRICS, rebuild
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def auth_header(user):
+    token = TenantTokenObtainPairSerializer.get_token(user).access_token
+    return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+
+def rollup_totals():
+    """Non-zero rollup totals per (day, tenant, plan, currency)."""
+    rows = (
+        BillingRollup.objects.order_by()
+        .values_list('day', 'tenant_id', 'plan_id', 'currency')
+        .annotate(*[Sum(metric) for metric in METRICS])
+    )
+    return {row[:4]: row[4:] for row in rows if any(row[4:])}
+
+
+class IncrementalRollupTests(TestCase):
+    """Rollups kept up by saves, deletes and bulk paths match a rebuild from the raw tables."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.pro = Plan.objects.create(name='Pro', price_cents=5000)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=cls.plan)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+
+    def invoice(self, **fields):
+        fields = {'tenant': self.tenant, 'subscription': self.sub, 'amount_cents': 1000, **fields}
+        return Invoice.objects.create(**fields)
+
+    def assertMatchesRebuild(self):
+        incremental = rollup_totals()
+        rebuild()
+        self.assertEqual(incremental, rollup_totals())
+        return incremental
+
+    def test_invoice_records_plan_billed(self):
+        invoice = self.invoice()
+        self.sub.plan = self.pro
+        self.sub.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.plan_id, self.plan.pk)
+
+    def test_pay_endpoint(self):
+        invoice = self.invoice(issued_at=utc(2024, 3, 1, 12))
+        auth = auth_header(self.member)
+        url = f'/api/billing/{invoice.pk}/pay/'
+        self.assertEqual(self.client.post(url, {'simulate': 'fail'}, content_type='application/json', **auth).status_code, 402)
+        self.assertEqual(self.client.post(url, {}, content_type='application/json', **auth).status_code, 200)
+
+        totals = self.assertMatchesRebuild()
+        invoice.refresh_from_db()
+        summed = [sum(values) for values in zip(*totals.values())]
+        self.assertEqual(summed, [1, 1000, 1, 1000, 1, 1000])
+        self.assertIn((invoice.paid_at.date(), self.tenant.pk, self.plan.pk, 'USD'), totals)
+
+    def test_status_changes_move_amounts(self):
+        invoice = self.invoice(issued_at=utc(2024, 3, 1))
+        invoice.status, invoice.paid_at = InvoiceStatus.PAID, utc(2024, 3, 5)
+        invoice.save()
+        invoice.status, invoice.paid_at = InvoiceStatus.VOID, None
+        invoice.save(update_fields=['status', 'paid_at'])
+        totals = self.assertMatchesRebuild()
+        self.assertEqual(totals, {(utc(2024, 3, 1).date(), self.tenant.pk, self.plan.pk, 'USD'): (1, 1000, 0, 0, 0, 0)})
+
+    def test_deferred_instance(self):
+        self.invoice(issued_at=utc(2024, 3, 1))
+        invoice = Invoice.objects.only('id').get()
+        invoice.status, invoice.paid_at = InvoiceStatus.PAID, utc(2024, 3, 2)
+        invoice.save(update_fields=['status', 'paid_at'])
+        totals = self.assertMatchesRebuild()
+        self.assertEqual(totals[(utc(2024, 3, 2).date(), self.tenant.pk, self.plan.pk, 'USD')], (0, 0, 1, 1000, 0, 0))
+
+    def test_untracked_update_writes_nothing(self):
+        invoice = self.invoice()
+        invoice.period_end = utc(2024, 4, 1)
+        with self.assertNumQueries(1):
+            invoice.save(update_fields=['period_end'])
+
+    def test_delete(self):
+        invoice = self.invoice(status=InvoiceStatus.PAID, paid_at=utc(2024, 3, 2))
+        Payment.objects.create(invoice=invoice, amount_cents=1000, status=PaymentStatus.FAILED)
+        self.sub.delete()
+        self.assertEqual(self.assertMatchesRebuild(), {})
+
+    def test_tenant_delete(self):
+        tenant = Tenant.objects.create(name='Globex')
+        sub = Subscription.objects.create(tenant=tenant, plan=self.plan)
+        invoice = self.invoice(tenant=tenant, subscription=sub)
+        Payment.objects.create(invoice=invoice, amount_cents=1000, status=PaymentStatus.FAILED)
+        tenant.delete()
+        self.assertFalse(BillingRollup.objects.filter(tenant_id=tenant.pk).exists())
+        self.assertFalse(BillingRollup.objects.exists())
+
+    def test_delete_reads_no_invoices(self):
+        invoice = self.invoice(issued_at=utc(2024, 3, 1))
+        for status in [PaymentStatus.FAILED, PaymentStatus.FAILED, PaymentStatus.SUCCEEDED]:
+            Payment.objects.create(invoice=invoice, amount_cents=1000, status=status)
+        with CaptureQueriesContext(connection) as ctx:
+            invoice.delete()
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "billing_invoice"' in q['sql']])
+        self.assertEqual(self.assertMatchesRebuild(), {})
+
+    @requires_postgres
+    def test_payment_of_missing_invoice(self):
+        # Payments have no foreign key once invoices are partitioned
+        invoice = self.invoice()
+        payment = Payment.objects.create(invoice=invoice, amount_cents=1000, status=PaymentStatus.FAILED)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM billing_invoice WHERE id = %s', [invoice.pk])
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.delete()
+        self.assertFalse(Payment.objects.exists())
+
+    def test_plan_with_rollups_is_kept(self):
+        plan = Plan.objects.create(name='Legacy', price_cents=100)
+        BillingRollup.objects.create(day=utc(2024, 3, 1).date(), tenant=self.tenant, plan=plan, currency='USD', invoiced_count=1)
+        with self.assertRaises(ProtectedError):
+            plan.delete()
+
+    def test_webhook_events(self):
+        invoices = [self.invoice(), self.invoice()]
+        events = [
+            WebhookEvent.objects.create(event_id='a', type='payment_intent.failed', invoice=invoices[0]),
+            WebhookEvent.objects.create(event_id='b', type='payment_intent.succeeded', invoice=invoices[0]),
+            WebhookEvent.objects.create(event_id='c', type='payment_intent.failed', invoice=invoices[1], amount_cents=300),
+        ]
+        process_events({'events': [event.pk for event in events]})
+        summed = [sum(values) for values in zip(*self.assertMatchesRebuild().values())]
+        self.assertEqual(summed, [2, 2000, 1, 1000, 2, 1300])
+
+    def test_renewals(self):
+        monthly = Subscription.objects.create(
+            tenant=Tenant.objects.create(name='Globex'), plan=self.pro,
+            started_at=utc(2024, 1, 10), current_period_end=utc(2024, 2, 10),
+        )
+        renew_due(utc(2024, 3, 20))
+        renew_due(utc(2024, 3, 20))
+        totals = self.assertMatchesRebuild()
+        # One invoice per period, each issued on its period's first day
+        self.assertEqual(
+            [values for key, values in totals.items() if key[1] == monthly.tenant_id],
+            [(1, 5000, 0, 0, 0, 0)] * 2,
+        )
+
+    def test_command(self):
+        self.invoice()
+        BillingRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_rollups', '--tenant', str(self.tenant.pk), stdout=out)
+        self.assertIn('Rebuilt 1 rollup row(s)', out.getvalue())
+        self.assertEqual(BillingRollup.objects.get().invoiced_cents, 1000)
+
+    def test_initial_migration_matches_rebuild(self):
+        paid = self.invoice(plan=self.pro, status=InvoiceStatus.PAID, paid_at=utc(2024, 3, 2), issued_at=utc(2024, 3, 1))
+        Payment.objects.create(invoice=paid, amount_cents=5000, status=PaymentStatus.FAILED)
+        self.invoice()
+        expected = self.assertMatchesRebuild()
+        BillingRollup.objects.all().delete()
+        # The models as the migration sees them: payments without their tenant column
+        state = MigrationLoader(connection).project_state(('analytics', '0001_initial'))
+        import_module('analytics.migrations.0001_initial').build_rollups(state.apps, None)
+        self.assertEqual(rollup_totals(), expected)
+
+
+class ReportTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        monthly = Plan.objects.create(name='Basic', price_cents=1000)
+        yearly = Plan.objects.create(name='Annual', price_cents=12000, interval=BillingInterval.YEARLY)
+        cls.acme = Tenant.objects.create(name='Acme')
+        cls.globex = Tenant.objects.create(name='Globex')
+        cls.initech = Tenant.objects.create(name='Initech')
+
+        def bill(tenant, plan, issued_at, paid=True):
+            sub = Subscription.objects.filter(tenant=tenant).first() or Subscription.objects.create(tenant=tenant, plan=plan)
+            Invoice.objects.create(
+                tenant=tenant, subscription=sub, amount_cents=plan.price_cents, issued_at=issued_at,
+                status=InvoiceStatus.PAID if paid else InvoiceStatus.DUE, paid_at=issued_at if paid else None,
+            )
+
+        # Acme monthly in February and March; Globex monthly in February only; Initech yearly since January
+        bill(cls.acme, monthly, utc(2024, 2, 3))
+        bill(cls.acme, monthly, utc(2024, 3, 3), paid=False)
+        bill(cls.globex, monthly, utc(2024, 2, 10))
+        bill(cls.initech, yearly, utc(2024, 1, 20))
+
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+        cls.owner = User.objects.create_user('owner', password='pw123456')
+        UserProfile.objects.create(user=cls.owner, tenant=cls.acme, role=UserRole.TENANT_ADMIN)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.acme, role=UserRole.TENANT_USER)
+
+    def setUp(self):
+        self.auth = {user: auth_header(user) for user in (self.admin, self.owner, self.member)}
+
+    def get(self, url, user, **params):
+        return self.client.get(url, params, **self.auth[user])
+
+    def test_monthly_summary(self):
+        with self.assertDataQueries(1):
+            response = self.get('/api/analytics/billing/', self.admin, start='2024-01-01', end='2024-03-31', interval='month')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(
+            [(row['period'], row['invoiced_cents'], row['paid_cents']) for row in body['results']],
+            [('2024-01-01', 12000, 12000), ('2024-02-01', 2000, 2000), ('2024-03-01', 1000, 0)],
+        )
+        self.assertEqual(body['totals'][0]['invoiced_count'], 4)
+        self.assertEqual(body['totals'][0]['collection_rate'], round(14000 / 15000, 4))
+
+    def test_tenant_admin_sees_own_tenant(self):
+        response = self.get('/api/analytics/billing/', self.owner, start='2024-01-01', end='2024-03-31', group_by='tenant')
+        self.assertEqual({row['tenant_id'] for row in response.json()['results']}, {str(self.acme.pk)})
+        other = self.get('/api/analytics/billing/', self.owner, tenant=str(self.globex.pk))
+        self.assertEqual(other.status_code, 403)
+
+    def test_members_and_anonymous_are_refused(self):
+        self.assertEqual(self.get('/api/analytics/revenue/', self.member).status_code, 403)
+        self.assertEqual(self.client.get('/api/analytics/revenue/').status_code, 401)
+
+    def test_invalid_params(self):
+        response = self.get('/api/analytics/billing/', self.admin, start='2024-03-01', end='2024-01-01', group_by='region')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group_by', response.json())
+
+    def test_revenue(self):
+        with self.assertDataQueries(1):
+            response = self.get('/api/analytics/revenue/', self.admin, month='2024-03')
+        self.assertEqual(response.status_code, 200)
+        usd, = response.json()['currencies']
+        # March: Acme 1000 + Initech 12000 / 12; February also had Globex
+        self.assertEqual((usd['mrr_cents'], usd['previous_mrr_cents']), (2000, 3000))
+        self.assertEqual((usd['customers'], usd['previous_customers'], usd['churned_customers']), (2, 3, 1))
+        self.assertEqual(usd['churned_mrr_cents'], 1000)
+        self.assertEqual(usd['revenue_churn_rate'], round(1000 / 3000, 4))
+        self.assertEqual(usd['collection_rate'], 0.0)
+        self.assertEqual(sorted(plan['mrr_cents'] for plan in usd['plans']), [1000, 1000])
+
+    def test_revenue_for_tenant(self):
+        response = self.get('/api/analytics/revenue/', self.owner, month='2024-03')
+        usd, = response.json()['currencies']
+        self.assertEqual((usd['mrr_cents'], usd['churned_customers']), (1000, 0))
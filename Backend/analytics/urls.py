@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import BillingSummaryView, RevenueView
+
+urlpatterns = [
+    path('billing/', BillingSummaryView.as_view(), name='analytics_billing'),
+    path('revenue/', RevenueView.as_view(), name='analytics_revenue'),
+]
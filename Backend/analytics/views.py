@@ -0,0 +1,47 @@
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.authentication import get_principal
+from accounts.permissions import IsTenantAdmin
+from .models import BillingRollup
+from .reports import billing_summary, revenue
+from .serializers import BillingSummaryParamsSerializer, RevenueParamsSerializer
+
+
+class RollupReportView(APIView):
+    """Reports over the caller's rollups: every tenant's for platform admins, their own for tenant admins."""
+
+    permission_classes = [IsTenantAdmin]
+    params_serializer_class = None
+
+    def get_params(self):
+        serializer = self.params_serializer_class(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_rollups(self, tenant_id=None):
+        principal = get_principal(self.request)
+        rollups = BillingRollup.objects.for_principal(principal)
+        if tenant_id is not None:
+            if not principal.can_access_tenant(tenant_id):
+                raise PermissionDenied("Not allowed for this tenant")
+            rollups = rollups.for_tenant(tenant_id)
+        return rollups
+
+
+class BillingSummaryView(RollupReportView):
+    params_serializer_class = BillingSummaryParamsSerializer
+
+    def get(self, request):
+        params = self.get_params()
+        rollups = self.get_rollups(params.get("tenant"))
+        return Response(billing_summary(rollups, params["start"], params["end"], params["interval"], params["group_by"]))
+
+
+class RevenueView(RollupReportView):
+    params_serializer_class = RevenueParamsSerializer
+
+    def get(self, request):
+        params = self.get_params()
+        return Response(revenue(self.get_rollups(params.get("tenant")), params["month"]))
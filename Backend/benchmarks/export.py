@@ -0,0 +1,87 @@
+"""
+Streaming export memory and throughput.
+
+Seeds a throwaway test database with growing numbers of invoices and streams
+``/api/billing/export/invoices.{csv,jsonl}`` through the whole Django stack,
+reporting rows/s and the peak Python memory allocated while streaming
+(tracemalloc). The peak should stay about the same at every size.
+
+Usage (from Backend/; any configured database):
+    python -m benchmarks.export --rows 1000,10000,100000
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from accounts.serializers import TenantTokenObtainPairSerializer  # noqa: E402
+from billing.models import Invoice  # noqa: E402
+from plans.models import Plan  # noqa: E402
+from subscriptions.models import Subscription  # noqa: E402
+from tenants.models import Tenant  # noqa: E402
+
+
+def seed_invoices(sub, start, count):
+    now = timezone.now()
+    for offset in range(start, start + count, 10000):
+        Invoice.objects.bulk_create(
+            Invoice(tenant_id=sub.tenant_id, subscription=sub, plan_id=sub.plan_id, amount_cents=1000 + i,
+                    issued_at=now - timedelta(seconds=i), paid_at=now if i % 2 else None)
+            for i in range(offset, min(offset + 10000, start + count))
+        )
+
+
+def measure(client, url, auth):
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(url, **auth)
+    size = lines = 0
+    for chunk in response.streaming_content:
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return lines, size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', default='1000,10000,100000', help='Comma-separated invoice counts')
+    args = parser.parse_args()
+    sizes = sorted(int(n) for n in args.rows.split(','))
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        plan = Plan.objects.create(name='Bench', price_cents=1000)
+        sub = Subscription.objects.create(tenant=Tenant.objects.create(name='Bench'), plan=plan)
+        admin = User.objects.create_user('bench-admin', password='bench-pass', is_superuser=True)
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {TenantTokenObtainPairSerializer.get_token(admin).access_token}'}
+        client = Client()
+        seeded = 0
+        for rows in sizes:
+            seed_invoices(sub, seeded, rows - seeded)
+            seeded = rows
+            for fmt in ('csv', 'jsonl'):
+                lines, size, elapsed, peak = measure(client, f'/api/billing/export/invoices.{fmt}', auth)
+                print(f'{rows:>9} invoices  {fmt:<5} {lines:>9} lines  {size / 2**20:8.1f} MiB  '
+                      f'{rows / elapsed:9.0f} rows/s  peak {peak / 2**20:6.2f} MiB')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
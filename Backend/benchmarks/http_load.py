@@ -0,0 +1,161 @@
+"""
+HTTP load test against a running server.
+
+Keeps ``--concurrency`` keep-alive connections busy for ``--duration``
+seconds, cycling through ``--paths`` with a bearer token, and reports
+requests/s and latency percentiles overall and per path. Point it at each
+launch mode to compare them on the same machine and database, e.g.:
+
+    python manage.py runserver 8000                       # dev server
+    gunicorn -c gunicorn.conf.py                          # SERVER_MODE=wsgi
+    SERVER_MODE=asgi ASYNC_READ_VIEWS=True gunicorn -c gunicorn.conf.py
+
+``--seed`` first creates (or reuses) a tenant, a tenant admin
+``loadtest`` and ``--seed`` invoices in the database configured for this
+process, which must be the server's.
+
+Usage (from Backend/):
+    python -m benchmarks.http_load --seed 200
+    python -m benchmarks.http_load --url http://127.0.0.1:8000 --concurrency 32 --duration 20
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = '/api/plans/,/api/accounts/me/,/api/subscriptions/,/api/billing/'
+USERNAME, PASSWORD = 'loadtest', 'loadtest-pass'
+
+
+def seed(invoices):
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import transaction
+
+    from accounts.models import UserProfile, UserRole
+    from billing.models import Invoice
+    from plans.models import Plan
+    from subscriptions.models import Subscription
+    from tenants.models import Tenant
+
+    with transaction.atomic():
+        plan, _ = Plan.objects.get_or_create(name='Load Test', defaults={'price_cents': 1000, 'max_users': 0})
+        tenant, _ = Tenant.objects.get_or_create(name='Load Test')
+        sub = Subscription.objects.filter(tenant=tenant).first() or Subscription.objects.create(
+            tenant=tenant, plan=plan,
+        )
+        user = User.objects.filter(username=USERNAME).first()
+        if user is None:
+            user = User.objects.create_user(USERNAME, password=PASSWORD)
+            UserProfile.objects.create(user=user, tenant=tenant, role=UserRole.TENANT_ADMIN)
+        missing = invoices - Invoice.objects.filter(tenant=tenant).count()
+        Invoice.objects.bulk_create(
+            Invoice(tenant=tenant, subscription=sub, amount_cents=1000 + i) for i in range(max(missing, 0))
+        )
+
+
+def connect(base):
+    parts = urlsplit(base)
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=30)
+
+
+def login(base):
+    conn = connect(base)
+    body = json.dumps({'username': USERNAME, 'password': PASSWORD})
+    conn.request('POST', '/api/auth/token/', body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = response.read()
+    if response.status != 200:
+        raise SystemExit(f'login failed ({response.status}): {data[:200]!r}; run with --seed first')
+    return json.loads(data)['access']
+
+
+def worker(base, paths, headers, deadline, results, offset):
+    conn = connect(base)
+    latencies, errors = defaultdict(list), defaultdict(int)
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = connect(base)
+            ok = False
+        if ok:
+            latencies[path].append(time.perf_counter() - started)
+        else:
+            errors[path] += 1
+    results.append((latencies, errors))
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def report(label, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    if not latencies:
+        print(f'{label:<28} no successful requests, {errors} errors')
+        return
+    print(f'{label:<28} {len(latencies) / elapsed:9.1f} req/s   p50 {percentile(latencies, 50):7.1f} ms   '
+          f'p95 {percentile(latencies, 95):7.1f} ms   p99 {percentile(latencies, 99):7.1f} ms   '
+          f'mean {1000 * statistics.fmean(latencies):7.1f} ms   errors {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='Comma-separated GET paths')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds')
+    parser.add_argument('--seed', type=int, metavar='INVOICES', help='Create the load test tenant first')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        seed(args.seed)
+    headers = {'Authorization': f'Bearer {login(args.url)}', 'Accept': 'application/json'}
+    paths = args.paths.split(',')
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(args.url, paths, headers, deadline, results, n))
+        for n in range(args.concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.url}: {args.concurrency} connections, {elapsed:.1f}s')
+    merged, failed = defaultdict(list), defaultdict(int)
+    for latencies, errors in results:
+        for path, values in latencies.items():
+            merged[path] += values
+        for path, count in errors.items():
+            failed[path] += count
+    report('all', [v for values in merged.values() for v in values], sum(failed.values()), elapsed)
+    for path in paths:
+        report(path, merged[path], failed[path], elapsed)
+
+
+if __name__ == '__main__':
+    main()
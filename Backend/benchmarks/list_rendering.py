@@ -0,0 +1,96 @@
+"""
+List endpoint throughput: ModelSerializer + JSONRenderer vs the fastjson path.
+
+Seeds a throwaway test database, then requests full pages of invoices and
+subscriptions through the whole Django stack with FAST_JSON_LISTS off and
+on, checking that both paths return identical bytes.
+
+Usage (from Backend/; any configured database):
+    python -m benchmarks.list_rendering --rows 500 --iterations 50
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from accounts.serializers import TenantTokenObtainPairSerializer  # noqa: E402
+from billing.models import Invoice  # noqa: E402
+from eshtarek import fastjson  # noqa: E402
+from plans.models import Plan  # noqa: E402
+from subscriptions.models import Subscription, SubscriptionStatus  # noqa: E402
+from tenants.models import Tenant  # noqa: E402
+
+
+def seed(rows):
+    now = timezone.now()
+    plans = Plan.objects.bulk_create(
+        Plan(name=f'Plan {i}', description='Plan with ünïcode', price_cents=1000 + i,
+             features={'seats': i, 'sso': bool(i % 2)})
+        for i in range(rows)
+    )
+    statuses = list(SubscriptionStatus.values)
+    tenants = Tenant.objects.bulk_create(Tenant(name=f'Tenant {i}') for i in range(rows))
+    subs = Subscription.objects.bulk_create(
+        Subscription(tenant=tenant, plan=plans[i % len(plans)], status=statuses[i % len(statuses)])
+        for i, tenant in enumerate(tenants)
+    )
+    Invoice.objects.bulk_create(
+        Invoice(tenant_id=sub.tenant_id, subscription=sub, amount_cents=1000 + i,
+                issued_at=now - timedelta(minutes=i), paid_at=now if i % 2 else None)
+        for i, sub in enumerate(subs)
+    )
+    admin = User.objects.create_user('bench-admin', password='bench-pass', is_superuser=True)
+    return TenantTokenObtainPairSerializer.get_token(admin).access_token
+
+
+def measure(client, url, auth, fast, iterations):
+    with override_settings(FAST_JSON_LISTS=fast):
+        body = client.get(url, **auth).content  # warm-up
+        started = time.perf_counter()
+        for _ in range(iterations):
+            client.get(url, **auth)
+        elapsed = time.perf_counter() - started
+    return body, iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {seed(args.rows)}'}
+        client = Client()
+        encoder = 'orjson' if fastjson.orjson is not None else 'json'
+        print(f'{args.rows} rows per page, {args.iterations} requests per path, encoder: {encoder}')
+        for url in (
+            f'/api/billing/?page_size={args.rows}',
+            f'/api/billing/?page_size={args.rows}&fields=id,tenant,subscription,amount_cents,status,'
+            'period_start,issued_at,paid_at,created_at',
+            f'/api/subscriptions/?page_size={args.rows}',
+        ):
+            slow_body, slow = measure(client, url, auth, False, args.iterations)
+            fast_body, fast = measure(client, url, auth, True, args.iterations)
+            same = 'identical' if slow_body == fast_body else 'MISMATCH'
+            print(f'{url}\n  serializer {slow:8.1f} req/s   fast {fast:8.1f} req/s   '
+                  f'x{fast / slow:.2f}   {len(fast_body)} bytes, {same}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Login throughput per core for each password hashing setting.
+
+For every setting, creates a user whose password is hashed with it and posts
+to /api/auth/token/ in a single thread, so logins/s is what one core
+sustains; multiply by cores to size auth pods. Also reports the time of the
+hash alone, which is most of a login at production costs.
+
+Settings are ``algorithm:cost``: ``pbkdf2:<iterations>``,
+``scrypt:<work factor>`` or ``argon2:<time cost>:<memory KiB>`` (needs
+argon2-cffi).
+
+Usage (from Backend/; any configured database):
+    python -m benchmarks.login --iterations 20
+    python -m benchmarks.login --settings pbkdf2:1000000,pbkdf2:300000,scrypt:16384
+"""
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from accounts.models import UserProfile, UserRole  # noqa: E402
+from tenants.models import Tenant  # noqa: E402
+
+DEFAULT_SETTINGS = 'pbkdf2:1000000,pbkdf2:600000,pbkdf2:260000,scrypt:16384,scrypt:32768,argon2:2:102400'
+
+HASHERS = {
+    'pbkdf2': 'accounts.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'accounts.hashers.ScryptPasswordHasher',
+    'argon2': 'accounts.hashers.Argon2PasswordHasher',
+}
+
+
+def overrides(spec):
+    algorithm, *costs = spec.split(':')
+    values = {'PASSWORD_HASHERS': [HASHERS[algorithm]] + [p for a, p in HASHERS.items() if a != algorithm]}
+    if algorithm == 'pbkdf2':
+        values['PASSWORD_PBKDF2_ITERATIONS'] = int(costs[0])
+    elif algorithm == 'scrypt':
+        values['PASSWORD_SCRYPT_WORK_FACTOR'] = int(costs[0])
+    else:
+        values['PASSWORD_ARGON2_TIME_COST'] = int(costs[0])
+        if len(costs) > 1:
+            values['PASSWORD_ARGON2_MEMORY_COST'] = int(costs[1])
+    return values
+
+
+def measure(spec, tenant, iterations):
+    with override_settings(**overrides(spec)):
+        started = time.perf_counter()
+        encoded = make_password('bench-pass')
+        hash_ms = 1000 * (time.perf_counter() - started)
+
+        username = f'bench-{spec}'
+        user = User.objects.create(username=username, password=encoded)
+        UserProfile.objects.create(user=user, tenant=tenant, role=UserRole.TENANT_USER)
+        client = Client()
+        credentials = {'username': username, 'password': 'bench-pass'}
+        assert client.post('/api/auth/token/', credentials).status_code == 200  # warm-up
+        started = time.perf_counter()
+        for _ in range(iterations):
+            client.post('/api/auth/token/', credentials)
+        elapsed = time.perf_counter() - started
+    return hash_ms, iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--settings', default=DEFAULT_SETTINGS, help='Comma-separated algorithm:cost list')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        tenant = Tenant.objects.create(name='Bench')
+        print(f'{args.iterations} logins per setting, one thread, {os.cpu_count()} cores available')
+        print(f"current: PASSWORD_HASHER={settings.PASSWORD_HASHER}, "
+              f"PASSWORD_PBKDF2_ITERATIONS={settings.PASSWORD_PBKDF2_ITERATIONS}")
+        for spec in args.settings.split(','):
+            try:
+                hash_ms, rate = measure(spec, tenant, args.iterations)
+            except (ValueError, ImportError) as exc:
+                print(f'{spec:<24} skipped: {exc}')
+                continue
+            print(f'{spec:<24} hash {hash_ms:8.1f} ms   {rate:8.1f} logins/s per core')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
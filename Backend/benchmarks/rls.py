@@ -0,0 +1,174 @@
+"""
+Row-level security cost per query: no RLS, the legacy policies, the generated ones.
+
+Seeds a throwaway test database with tenants, invoices and payments, plus
+one large tenant whose queries are measured. It forces RLS on
+billing_invoice and billing_payment (the benchmark role owns them, and
+owners bypass RLS otherwise) and times the tenant-scoped queries of the
+billing API under each set of policies:
+
+- ``off``: RLS not enforced, the baseline;
+- ``legacy``: ``current_setting('app.admin', true) = 'true' OR tenant_id =
+  current_setting('app.tenant_id', true)::uuid`` as in accounts/0002_rls;
+- ``generated``: the eshtarek.rls policies.
+
+Reports, per query, the median round-trip time and the median planning and
+execution times measured by the server (EXPLAIN ANALYZE), with their
+overhead against ``off``, plus the scans the planner picks for a count that
+relies on RLS alone.
+
+Usage (from Backend/, with DB_* pointing at PostgreSQL):
+    python -m benchmarks.rls --tenants 200 --invoices 50 --large 20000 --repeat 200
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from billing.models import Invoice, Payment  # noqa: E402
+from eshtarek.rls import enable_tenant_rls  # noqa: E402
+from eshtarek.tenant_context import apply_tenant_context  # noqa: E402
+from plans.models import Plan  # noqa: E402
+from subscriptions.models import Subscription  # noqa: E402
+from tenants.models import Tenant  # noqa: E402
+
+TABLES = ('billing_invoice', 'billing_payment')
+
+LEGACY_PREDICATE = (
+    "current_setting('app.admin', true) = 'true' "
+    "OR tenant_id = current_setting('app.tenant_id', true)::uuid"
+)
+
+
+def seed(tenants, invoices, large):
+    """Seeds the tenants; returns the large one."""
+    plan = Plan.objects.create(name='Bench', price_cents=1000)
+    tenant_rows = Tenant.objects.bulk_create([Tenant(name=f'Bench {i:05}') for i in range(tenants + 1)])
+    subs = Subscription.objects.bulk_create([Subscription(tenant=tenant, plan=plan) for tenant in tenant_rows])
+    now = timezone.now()
+    for sub in subs:
+        count = large if sub is subs[-1] else invoices
+        for offset in range(0, count, 5000):
+            rows = Invoice.objects.bulk_create(
+                Invoice(tenant_id=sub.tenant_id, subscription=sub, plan=plan, amount_cents=1000,
+                        issued_at=now - timedelta(minutes=i))
+                for i in range(offset, min(offset + 5000, count))
+            )
+            Payment.objects.bulk_create(
+                Payment(invoice=invoice, tenant_id=invoice.tenant_id, amount_cents=1000) for invoice in rows
+            )
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f'ANALYZE {table}')
+    return tenant_rows[-1]
+
+
+def queries(tenant_id, invoice_id):
+    """(label, sql, params) of queries as the billing endpoints issue them for a tenant member."""
+    invoices = Invoice.objects.for_tenant(tenant_id)
+    compiled = [
+        ('list page', invoices.order_by('-issued_at', '-id')[:20]),
+        ('retrieve', invoices.filter(pk=invoice_id)),
+        ('payments', Payment.objects.for_tenant(tenant_id).filter(invoice_id=invoice_id).order_by('-id')),
+        ('count', invoices.order_by().values('pk')),
+    ]
+    compiled = [(label, *queryset.query.sql_with_params()) for label, queryset in compiled]
+    # A count visits every row of the tenant, so it shows per-row policy costs
+    label, sql, params = compiled[-1]
+    compiled[-1] = (label, f'SELECT count(*) FROM ({sql}) counted', params)
+    return compiled
+
+
+def use_policies(variant):
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            enable_tenant_rls(cursor, table)
+            if variant == 'legacy':
+                cursor.execute(f"DROP POLICY {table}_tenant_isolation ON {table}")
+                cursor.execute(f"DROP POLICY {table}_platform_admin ON {table}")
+                cursor.execute(f"CREATE POLICY {table}_legacy ON {table} USING ({LEGACY_PREDICATE})")
+            force = 'NO FORCE' if variant == 'off' else 'FORCE'
+            cursor.execute(f'ALTER TABLE {table} {force} ROW LEVEL SECURITY')
+
+
+def time_query(sql, params, repeat):
+    """Median (round trip, planning, execution) times of ``sql`` in microseconds."""
+    wall, planning, execution = [], [], []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            wall.append((time.perf_counter() - started) * 1e6)
+            cursor.execute(f'EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0][0]
+            planning.append(plan['Planning Time'] * 1e3)
+            execution.append(plan['Execution Time'] * 1e3)
+    return tuple(statistics.median(values) for values in (wall, planning, execution))
+
+
+def rls_only_scan():
+    """Node types of the plan for a count with no tenant filter of its own."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) SELECT count(*) FROM billing_invoice')
+        plan = cursor.fetchone()[0]
+    found = []
+
+    def walk(node):
+        if 'Scan' in node['Node Type'] and 'Relation Name' in node:
+            found.append(node['Node Type'])
+        for child in node.get('Plans', ()):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return ', '.join(sorted(set(found)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--invoices', type=int, default=50, help='Invoices (and payments) per tenant')
+    parser.add_argument('--large', type=int, default=20000, help='Invoices (and payments) of the measured tenant')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit('This benchmark needs PostgreSQL (set DB_NAME and friends).')
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        tenant_id = seed(args.tenants, args.invoices, args.large).pk
+        invoice_id = Invoice.objects.filter(tenant_id=tenant_id).values_list('pk', flat=True).first()
+        apply_tenant_context(str(tenant_id), False)
+        compiled = queries(tenant_id, invoice_id)
+        print(f'{args.tenants} tenants x {args.invoices} invoices and payments, measured tenant with '
+              f'{args.large}; median of {args.repeat} runs')
+
+        print(f'{"":<22}{"round trip us":>20}{"planning us":>20}{"execution us":>20}')
+        baseline = {}
+        for variant in ('off', 'legacy', 'generated'):
+            use_policies(variant)
+            for label, sql, params in compiled:
+                timings = time_query(sql, params, args.repeat)
+                base = baseline.setdefault(label, timings)
+                print(f'{variant:<10} {label:<11}' + ''.join(
+                    f'{value:>11.1f} ({value - base_value:+6.1f})' for value, base_value in zip(timings, base)
+                ))
+            print(f'{variant:<10} RLS-only count scans: {rls_only_scan()}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
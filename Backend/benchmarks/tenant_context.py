@@ -0,0 +1,82 @@
+"""
+Per-request RLS context round-trips: legacy middleware vs tenant_context engine.
+
+Replays a traffic mix (anonymous catalog hits, repeated tenant users, tenant
+switches, platform admins) against one connection and counts the statements
+each approach sends to Postgres.
+
+Usage (from Backend/, with DB_* pointing at PostgreSQL):
+    python -m benchmarks.tenant_context --requests 5000
+"""
+import argparse
+import os
+import time
+import uuid
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eshtarek.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from eshtarek.tenant_context import apply_tenant_context, forget_tenant_context  # noqa: E402
+
+
+def legacy_apply(tenant_id, is_admin):
+    """The pre-engine middleware: one cursor and one statement per setting."""
+    for key, value in (('app.tenant_id', tenant_id), ('app.admin', 'true' if is_admin else 'false')):
+        with connection.cursor() as cursor:
+            if value is None:
+                cursor.execute("SELECT set_config(%s, '', true)", [key])
+            else:
+                cursor.execute("SELECT set_config(%s, %s, true)", [key, value])
+
+
+def traffic(n):
+    tenant_a, tenant_b = str(uuid.uuid4()), str(uuid.uuid4())
+    mix = [
+        (None, False),      # anonymous /api/plans/
+        (None, False),
+        (tenant_a, False),  # same tenant user, keep-alive
+        (tenant_a, False),
+        (tenant_a, False),
+        (tenant_b, False),
+        (None, True),       # platform admin
+    ]
+    return [mix[i % len(mix)] for i in range(n)]
+
+
+def run(label, apply, requests):
+    statements = 0
+
+    def counter(execute, sql, params, many, context):
+        nonlocal statements
+        statements += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for tenant_id, is_admin in requests:
+            apply(tenant_id, is_admin)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} statements={statements:<7} per_request={statements / len(requests):.2f} "
+          f"elapsed={elapsed * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit('This benchmark needs PostgreSQL (set DB_NAME and friends).')
+
+    requests = traffic(args.requests)
+    run('legacy', legacy_apply, requests)
+    forget_tenant_context()
+    run('engine', apply_tenant_context, requests)
+
+
+if __name__ == '__main__':
+    main()
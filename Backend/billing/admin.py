@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Invoice, Payment
+from .models import Invoice, Payment, WebhookEvent
 
 
 @admin.register(Invoice)
@@ -13,3 +13,10 @@ class InvoiceAdmin(admin.ModelAdmin):
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ("id", "invoice", "amount_cents", "status", "provider_ref", "created_at")
     list_filter = ("status",)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "provider", "event_id", "type", "invoice", "received_at", "processed_at")
+    list_filter = ("provider", "type")
+    search_fields = ("event_id",)
@@ -0,0 +1,150 @@
+"""
+Streaming exports of invoices and payments as CSV or JSON Lines.
+
+``stream(spec, queryset, fmt)`` yields the encoded file in chunks of about
+``EXPORT_CHUNK_BYTES``. Rows are read as tuples (``values_list``, no model
+instances) with ``.iterator(chunk_size=EXPORT_CHUNK_SIZE)``: a server-side
+cursor on PostgreSQL, opened in a transaction of its own so the whole file
+comes from one snapshot. Only one chunk of rows and one chunk of output are
+held in memory at a time, whatever the size of the export.
+
+With DB_POOL=pgbouncer server-side cursors are disabled (a client-side cursor
+would buffer the whole result), so rows are read in keyset batches along the
+export ordering instead, each batch one indexed range query.
+
+Callers pass an already scoped queryset (``for_principal`` / ``for_tenant``),
+so every row respects tenant visibility; under RLS the connection's tenant
+context applies as well.
+"""
+import csv
+from datetime import datetime
+from typing import Iterator, NamedTuple, Tuple
+from uuid import UUID
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from eshtarek.fastjson import dumps
+from eshtarek.pagination import KeysetPagination
+from .models import Invoice, Payment
+
+CSV, JSONL = "csv", "jsonl"
+
+CONTENT_TYPES = {
+    CSV: "text/csv; charset=utf-8",
+    JSONL: "application/x-ndjson",
+}
+
+
+class ExportSpec(NamedTuple):
+    model: type
+    # (output name, values_list lookup)
+    columns: Tuple[Tuple[str, str], ...]
+    # Ascending and unique, over exported columns
+    ordering: Tuple[str, ...]
+
+
+EXPORTS = {
+    "invoices": ExportSpec(
+        model=Invoice,
+        columns=(
+            ("id", "id"),
+            ("tenant", "tenant_id"),
+            ("subscription", "subscription_id"),
+            ("plan", "plan_id"),
+            ("amount_cents", "amount_cents"),
+            ("currency", "currency"),
+            ("status", "status"),
+            ("period_start", "period_start"),
+            ("period_end", "period_end"),
+            ("issued_at", "issued_at"),
+            ("paid_at", "paid_at"),
+            ("created_at", "created_at"),
+            ("updated_at", "updated_at"),
+        ),
+        # Served by the (tenant, issued_at, id) and (issued_at, id) indexes
+        ordering=("issued_at", "id"),
+    ),
+    "payments": ExportSpec(
+        model=Payment,
+        columns=(
+            ("id", "id"),
+            ("invoice", "invoice_id"),
+            ("tenant", "tenant_id"),
+            ("amount_cents", "amount_cents"),
+            ("status", "status"),
+            ("provider_ref", "provider_ref"),
+            ("idempotency_key", "idempotency_key"),
+            ("created_at", "created_at"),
+        ),
+        # Served by the (tenant, id) index and the primary key
+        ordering=("id",),
+    ),
+}
+
+
+def _text(value):
+    """Values as rendered by the API: ISO 8601 datetimes with ``Z`` for UTC, UUIDs as strings."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def rows(spec: ExportSpec, queryset, chunk_size: int) -> Iterator[tuple]:
+    values = queryset.order_by(*spec.ordering).values_list(*(lookup for _, lookup in spec.columns))
+    connection = connections[values.db]
+    if connection.settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        yield from _keyset_rows(spec, values, chunk_size)
+        return
+    with transaction.atomic(using=values.db):
+        yield from values.iterator(chunk_size=chunk_size)
+
+
+def _keyset_rows(spec: ExportSpec, values, chunk_size: int) -> Iterator[tuple]:
+    names = [name for name, _ in spec.columns]
+    positions = [names.index(field) for field in spec.ordering]
+    batch = list(values[:chunk_size])
+    while batch:
+        yield from batch
+        if len(batch) < chunk_size:
+            return
+        last = batch[-1]
+        after = KeysetPagination._seek(spec.ordering, [last[i] for i in positions])
+        batch = list(values.filter(after)[:chunk_size])
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _encode(spec: ExportSpec, fmt: str, records) -> Iterator[bytes]:
+    names = [name for name, _ in spec.columns]
+    if fmt == CSV:
+        writer = csv.writer(_Echo())
+        yield writer.writerow(names).encode()
+        for row in records:
+            yield writer.writerow(["" if value is None else _text(value) for value in row]).encode()
+    else:
+        for row in records:
+            yield dumps({name: _text(value) for name, value in zip(names, row)}) + b"\n"
+
+
+def stream(spec: ExportSpec, queryset, fmt: str, chunk_size: int = None) -> Iterator[bytes]:
+    """The export of ``queryset`` in ``fmt``, as byte chunks of about ``EXPORT_CHUNK_BYTES``."""
+    chunk_size = chunk_size or getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+    chunk_bytes = getattr(settings, "EXPORT_CHUNK_BYTES", 64 * 1024)
+    buffer, size = [], 0
+    for line in _encode(spec, fmt, rows(spec, queryset, chunk_size)):
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from billing.exports import CSV, EXPORTS, JSONL, stream
+
+
+class Command(BaseCommand):
+    help = "Stream the invoice or payment history as CSV or JSON Lines, with flat memory use."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(EXPORTS))
+        parser.add_argument("--format", dest="fmt", choices=[CSV, JSONL], default=CSV)
+        parser.add_argument("--tenant", help="Only this tenant id (default: all tenants)")
+        parser.add_argument("--output", default="-", help="File to write (default: stdout)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows fetched per round-trip")
+
+    def handle(self, *args, kind, fmt=CSV, tenant=None, output="-", chunk_size=None, **options):
+        spec = EXPORTS[kind]
+        queryset = spec.model.objects.all()
+        if tenant:
+            queryset = queryset.for_tenant(tenant)
+        chunks = stream(spec, queryset, fmt, chunk_size)
+        if output == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
+            return
+        written = 0
+        with open(output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written} bytes to {output}")
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from billing.partitions import add_months, detach_partitions, ensure_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the upcoming monthly partitions of billing_invoice, "
+        "and detach (optionally archive or drop) months past retention, with their payments "
+        "and webhook events. PostgreSQL only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead", type=int, default=getattr(settings, "PARTITION_MONTHS_AHEAD", 3),
+            help="Months after the current one to create partitions for",
+        )
+        parser.add_argument(
+            "--retain-months", type=int, default=getattr(settings, "PARTITION_RETAIN_MONTHS", 0),
+            help="Detach months older than this many months before the current one (0: keep all)",
+        )
+        parser.add_argument(
+            "--archive-schema", default=getattr(settings, "PARTITION_ARCHIVE_SCHEMA", ""),
+            help="Move detached partitions to this schema",
+        )
+        parser.add_argument("--drop", action="store_true", help="Drop detached partitions")
+
+    def handle(self, *args, ahead, retain_months, archive_schema, drop, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write("Billing tables are only partitioned on PostgreSQL; nothing to do.")
+            return
+        if ahead < 0 or retain_months < 0:
+            raise CommandError("--ahead and --retain-months must not be negative")
+
+        now = timezone.now()
+        created = ensure_partitions(ahead, now)
+        detached = []
+        if retain_months:
+            detached = detach_partitions(add_months(month_start(now), -retain_months), archive_schema, drop)
+
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        action = "Dropped" if drop else f"Archived to {archive_schema}:" if archive_schema else "Detached"
+        for name in detached:
+            self.stdout.write(f"{action} {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(created)} partition(s), detached {len(detached)} partition(s)"
+        ))
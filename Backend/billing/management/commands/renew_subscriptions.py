@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from billing.renewals import renew_due
+
+
+class Command(BaseCommand):
+    help = "Invoice subscriptions whose current period ends before the cut-off and advance their periods."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--until", help="ISO-8601 cut-off (default: now)")
+        parser.add_argument("--ahead-hours", type=int, default=0, help="Also renew periods ending within this many hours")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, until=None, ahead_hours=0, chunk_size=1000, **options):
+        if until:
+            cutoff = parse_datetime(until)
+            if cutoff is None:
+                raise CommandError(f"Invalid --until: {until}")
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+        else:
+            cutoff = timezone.now()
+        cutoff += timedelta(hours=ahead_hours)
+
+        result = renew_due(cutoff, chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Renewed {result.subscriptions} subscription(s), {result.invoices} invoice(s) up to {cutoff.isoformat()}"
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_payment_idempotency_key_and_more'),
+        ('subscriptions', '0002_rls'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['tenant', '-issued_at', '-id'], name='invoice_tenant_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-issued_at', '-id'], name='invoice_issued_idx'),
+        ),
+    ]
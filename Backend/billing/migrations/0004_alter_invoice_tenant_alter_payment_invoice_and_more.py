@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_invoice_invoice_tenant_issued_idx_and_more'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['invoice', '-id'], name='payment_invoice_id_idx'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='tenants.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='invoice',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='billing.invoice'),
+        ),
+    ]
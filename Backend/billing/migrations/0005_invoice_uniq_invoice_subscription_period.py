@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_alter_invoice_tenant_alter_payment_invoice_and_more'),
+        ('subscriptions', '0004_alter_subscription_tenant'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('period_start__isnull', False)), fields=('subscription', 'period_start'), name='uniq_invoice_subscription_period'),
+        ),
+    ]
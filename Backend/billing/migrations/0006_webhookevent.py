@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_invoice_uniq_invoice_subscription_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(default='mock', max_length=50)),
+                ('event_id', models.CharField(max_length=255)),
+                ('type', models.CharField(max_length=50)),
+                ('amount_cents', models.PositiveIntegerField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('enqueued_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webhook_events', to='billing.invoice')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('provider', 'event_id'), name='uniq_webhook_provider_event')],
+            },
+        ),
+    ]
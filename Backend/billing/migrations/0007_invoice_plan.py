@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_plan(apps, schema_editor):
+    # Invoices so far were always for their subscription's current plan
+    Invoice = apps.get_model('billing', 'Invoice')
+    Subscription = apps.get_model('subscriptions', 'Subscription')
+    plan = Subscription.objects.filter(pk=OuterRef('subscription_id')).values('plan_id')[:1]
+    Invoice.objects.filter(plan__isnull=True).update(plan_id=Subquery(plan))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_webhookevent'),
+        ('plans', '0001_initial'),
+        ('subscriptions', '0002_rls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='plan',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='plans.plan'),
+        ),
+        migrations.RunPython(backfill_plan, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,169 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:57
+
+import re
+from datetime import datetime, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# As of this migration; kept here so later changes to the app code can't alter it.
+# Only invoices are partitioned: payments are read by invoice, never by month.
+TABLE = 'billing_invoice'
+PARTITION_KEY = 'issued_at'
+MONTHS_AHEAD = 3
+# Tables with a foreign key to invoices, which a partitioned table cannot have
+REFERENCING = {
+    'billing_payment': 'billing_payment_invoice_id_fk_billing_invoice_id',
+    'billing_webhookevent': 'billing_webhookevent_invoice_id_fk_billing_invoice_id',
+}
+PERIOD_INDEX = 'uniq_invoice_subscription_period'
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def literal(month):
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def is_partitioned(cursor):
+    cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE])
+    return cursor.fetchone() is not None
+
+
+def rebuild(cursor, partitioned):
+    """
+    Recreates the invoice table, partitioned by month or plain, copying its
+    rows, indexes, foreign keys and sequence position. Runs under an
+    exclusive lock: on a large table, schedule it in a maintenance window.
+    """
+    qn = cursor.db.ops.quote_name
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s) AND NOT indisprimary',
+        [TABLE],
+    )
+    indexes = [definition.replace(' ON ONLY ', ' ON ') for definition, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+    sequence, = cursor.fetchone()
+    cursor.execute(f'SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM {sequence}')
+    next_id, = cursor.fetchone()
+
+    new = f'{TABLE}_rebuild'
+    sql = f'CREATE TABLE {qn(new)} (LIKE {qn(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    if partitioned:
+        sql += f' PARTITION BY RANGE ({qn(PARTITION_KEY)})'
+    cursor.execute(sql)
+    cursor.execute(f'ALTER TABLE {qn(new)} ALTER COLUMN id DROP DEFAULT')
+    key_columns = f'id, {qn(PARTITION_KEY)}' if partitioned else 'id'
+    cursor.execute(f'ALTER TABLE {qn(new)} ADD CONSTRAINT {qn(new + "_pkey")} PRIMARY KEY ({key_columns})')
+
+    if partitioned:
+        cursor.execute(f'SELECT min({qn(PARTITION_KEY)}) FROM {qn(TABLE)}')
+        oldest, = cursor.fetchone()
+        month = month_start(oldest or datetime.now(dt_timezone.utc))
+        last = add_months(month_start(datetime.now(dt_timezone.utc)), MONTHS_AHEAD)
+        while month <= last:
+            cursor.execute(
+                f'CREATE TABLE {qn(f"{TABLE}_p{month:%Y%m}")} PARTITION OF {qn(new)} '
+                f'FOR VALUES FROM ({literal(month)}) TO ({literal(add_months(month, 1))})'
+            )
+            month = add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {qn(TABLE + "_default")} PARTITION OF {qn(new)} DEFAULT')
+
+    cursor.execute(f'INSERT INTO {qn(new)} SELECT * FROM {qn(TABLE)}')
+    cursor.execute(f'DROP TABLE {qn(TABLE)}')
+    cursor.execute(f'ALTER TABLE {qn(new)} RENAME TO {qn(TABLE)}')
+    cursor.execute(f'ALTER TABLE {qn(TABLE)} RENAME CONSTRAINT {qn(new + "_pkey")} TO {qn(TABLE + "_pkey")}')
+    for definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(name)} {definition}')
+    if partitioned:
+        # Partitioned tables cannot have identity columns before PostgreSQL 17
+        sequence = qn(f'{TABLE}_id_seq')
+        cursor.execute(f'CREATE SEQUENCE {sequence} AS bigint OWNED BY {qn(TABLE)}.id')
+        cursor.execute(f"ALTER TABLE {qn(TABLE)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    else:
+        cursor.execute(f'ALTER TABLE {qn(TABLE)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+    cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, false)", [TABLE, next_id])
+
+
+def partition_invoices(apps, schema_editor):
+    # Only run on PostgreSQL; elsewhere the table stays as it is
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        # Check deferred foreign keys now, or the tables can't be altered
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+            [TABLE],
+        )
+        for table, name in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {qn(name)}')
+        cursor.execute(f'DROP INDEX {qn(PERIOD_INDEX)}')
+        rebuild(cursor, partitioned=True)
+        # A unique index on a partitioned table must include the partition key
+        cursor.execute(
+            f'CREATE UNIQUE INDEX {qn(PERIOD_INDEX)} ON {qn(TABLE)} (subscription_id, period_start, {qn(PARTITION_KEY)}) '
+            f'WHERE period_start IS NOT NULL'
+        )
+
+
+def unpartition_invoices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'DROP INDEX {qn(PERIOD_INDEX)}')
+        rebuild(cursor, partitioned=False)
+        cursor.execute(
+            f'CREATE UNIQUE INDEX {qn(PERIOD_INDEX)} ON {qn(TABLE)} (subscription_id, period_start) '
+            f'WHERE period_start IS NOT NULL'
+        )
+        for table, name in REFERENCING.items():
+            cursor.execute(
+                f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} FOREIGN KEY (invoice_id) '
+                f'REFERENCES {qn(TABLE)} (id) DEFERRABLE INITIALLY DEFERRED'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_invoice_plan'),
+        ('plans', '0001_initial'),
+        ('subscriptions', '0005_subscription_sub_status_period_end_idx'),
+        ('tenants', '0003_tenantusage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='subscription',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='subscriptions.subscription'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['subscription', 'period_start'], name='invoice_sub_period_idx'),
+        ),
+        migrations.RunPython(partition_invoices, unpartition_invoices),
+    ]
@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_tenant(apps, schema_editor):
+    Invoice = apps.get_model('billing', 'Invoice')
+    Payment = apps.get_model('billing', 'Payment')
+    tenant = Invoice.objects.filter(pk=OuterRef('invoice_id')).values('tenant_id')[:1]
+    Payment.objects.filter(tenant__isnull=True).update(tenant_id=Subquery(tenant))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_partitioning'),
+        ('tenants', '0003_tenantusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='tenants.tenant'),
+        ),
+        migrations.RunPython(backfill_tenant, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='tenants.tenant'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['tenant', 'id'], name='payment_tenant_id_idx'),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from eshtarek.rls import TenantRowLevelSecurity
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('billing', '0009_payment_tenant'),
+    ]
+
+    operations = [
+        TenantRowLevelSecurity('invoice'),
+        TenantRowLevelSecurity('payment'),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.utils import timezone
 
+from plans.models import Plan
+from tenants.managers import TenantScopedManager
 from tenants.models import Tenant
 from subscriptions.models import Subscription
 
@@ -12,8 +14,13 @@ class InvoiceStatus(models.TextChoices):
 
 
 class Invoice(models.Model):
-    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="invoices")
-    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name="invoices")
+    # Indexed through invoice_tenant_issued_idx (tenant_id leads)
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="invoices", db_index=False)
+    # Indexed through invoice_sub_period_idx (subscription_id leads)
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name="invoices", db_index=False)
+    # Plan billed, kept when the subscription later changes plan; revenue is reported by it.
+    # Not indexed: only deleting a plan (rare, admin-only) looks invoices up by plan.
+    plan = models.ForeignKey(Plan, on_delete=models.PROTECT, related_name="invoices", null=True, blank=True, db_index=False)
     amount_cents = models.PositiveIntegerField()
     currency = models.CharField(max_length=10, default="USD")
     status = models.CharField(max_length=10, choices=InvoiceStatus.choices, default=InvoiceStatus.DUE)
@@ -24,8 +31,28 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantScopedManager()
+
     class Meta:
         ordering = ["-issued_at"]
+        indexes = [
+            # Keyset pagination on (issued_at, id), per tenant and platform-wide
+            models.Index(fields=["tenant", "-issued_at", "-id"], name="invoice_tenant_issued_idx"),
+            models.Index(fields=["-issued_at", "-id"], name="invoice_issued_idx"),
+            # Periods already invoiced, checked by renewals
+            models.Index(fields=["subscription", "period_start"], name="invoice_sub_period_idx"),
+        ]
+        constraints = [
+            # One invoice per subscription period. Where the table is partitioned, the
+            # index also covers issued_at (billing.partitions), which renewals set to
+            # the period start; renewals also skip invoiced periods.
+            models.UniqueConstraint(fields=["subscription", "period_start"], name="uniq_invoice_subscription_period", condition=models.Q(period_start__isnull=False)),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.plan_id is None and self.subscription_id is not None:
+            self.plan_id = self.subscription.plan_id
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         return f"Invoice {self.id} - {self.tenant.name} - {self.amount_cents/100:.2f} {self.currency} [{self.status}]"
@@ -37,17 +64,58 @@ class PaymentStatus(models.TextChoices):
 
 
 class Payment(models.Model):
-    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="payments")
+    # Indexed through payment_invoice_id_idx (invoice_id leads). No database
+    # constraint where invoices are partitioned (billing.partitions).
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="payments", db_index=False)
+    # The invoice's tenant, copied so tenant scoping and RLS don't join invoices.
+    # Indexed through payment_tenant_id_idx (tenant_id leads)
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="payments", db_index=False)
     amount_cents = models.PositiveIntegerField()
     status = models.CharField(max_length=20, choices=PaymentStatus.choices, default=PaymentStatus.SUCCEEDED)
     provider_ref = models.CharField(max_length=100, blank=True, default="mock_txn")
     idempotency_key = models.CharField(max_length=100, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantScopedManager()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.tenant_id is None and self.invoice_id is not None:
+            self.tenant_id = self.invoice.tenant_id
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return f"Payment {self.id} -> Invoice {self.invoice_id} [{self.status}]"
 
     class Meta:
         constraints = [
+            # Also serves (invoice_id, idempotency_key) lookups
             models.UniqueConstraint(fields=["invoice", "idempotency_key"], name="uniq_invoice_idem_key", condition=models.Q(idempotency_key__isnull=False)),
         ]
+        indexes = [
+            # invoice.payments ordered by -id (latest payment, prefetches)
+            models.Index(fields=["invoice", "-id"], name="payment_invoice_id_idx"),
+            # Tenant-scoped payments in id order (exports)
+            models.Index(fields=["tenant", "id"], name="payment_tenant_id_idx"),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """Provider events as received; (provider, event_id) makes ingestion idempotent."""
+
+    provider = models.CharField(max_length=50, default="mock")
+    event_id = models.CharField(max_length=255)
+    type = models.CharField(max_length=50)
+    # No database constraint where invoices are partitioned (billing.partitions)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="webhook_events")
+    amount_cents = models.PositiveIntegerField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    enqueued_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "event_id"], name="uniq_webhook_provider_event"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.event_id} {self.type} -> Invoice {self.invoice_id}"
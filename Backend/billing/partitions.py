@@ -0,0 +1,191 @@
+"""
+Monthly range partitioning of the invoice table on PostgreSQL.
+
+``billing_invoice`` is partitioned by ``issued_at`` (migration billing 0008;
+other databases keep a plain table and everything here is a no-op). Partition
+``<table>_pYYYYMM`` holds one UTC calendar month; ``<table>_default`` catches
+rows outside every month partition so inserts never fail, and
+``create_partition`` moves such rows into the month partition it creates.
+``manage.py partition_billing`` creates the upcoming months and detaches,
+archives or drops months past retention.
+
+``billing_payment`` is not partitioned: payments are read by ``invoice_id``
+(an invoice's payments, idempotency keys), never by a ``created_at`` range,
+so a month layout would prune nothing and would cost the unique (invoice,
+idempotency_key) constraint.
+
+What partitioning changes for the schema:
+
+- The primary key is (id, partition key). Ids still come from one sequence,
+  so ``id`` stays unique and the ORM keeps using it alone.
+- A unique index must include the partition key, so
+  ``uniq_invoice_subscription_period`` covers (subscription, period_start,
+  issued_at). Renewal invoices are issued at their period start
+  (billing.renewals), so a period renewed twice still collides.
+- A foreign key cannot point at a partitioned table, so Payment and
+  WebhookEvent reference invoices without a database constraint; deletes
+  still cascade through the ORM. ``detach_partitions`` takes an invoice
+  month's payments and webhook events with it (``DEPENDENT_TABLES``), so
+  none are left pointing at invoices that are gone.
+- Queries through the parent use the parent's row-level security policies.
+  Partitions get RLS enabled (and forced) like their parent but no policies,
+  so a role subject to RLS sees nothing when it reads a partition directly.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+from typing import List, NamedTuple, Optional
+
+from django.db import connections, transaction
+
+PARTITIONED_TABLES = {
+    "billing_invoice": "issued_at",
+}
+
+# Rows of other tables referencing a partitioned table: table -> column
+DEPENDENT_TABLES = {
+    "billing_invoice": {"billing_payment": "invoice_id", "billing_webhookevent": "invoice_id"},
+}
+
+_MONTH_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+class Partition(NamedTuple):
+    name: str
+    # First instant of the month held, None for the default partition
+    month: Optional[datetime]
+
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _literal(month: datetime) -> str:
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+    return cursor.fetchone() is not None
+
+
+def partitions(cursor, table: str) -> List[Partition]:
+    """Attached partitions of ``table``, the default partition first, then by month."""
+    cursor.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        [table],
+    )
+    found = []
+    for name, is_default in cursor.fetchall():
+        match = _MONTH_SUFFIX.search(name)
+        if is_default:
+            found.append(Partition(name, None))
+        elif match:
+            found.append(Partition(name, datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)))
+    return sorted(found, key=lambda partition: (partition.month is not None, partition.month))
+
+
+def _secure(cursor, table: str, partition: str) -> None:
+    """Gives ``partition`` the RLS flags of ``table`` (see module docstring)."""
+    qn = cursor.db.ops.quote_name
+    cursor.execute("SELECT relrowsecurity, relforcerowsecurity FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    enabled, forced = cursor.fetchone()
+    if enabled:
+        cursor.execute(f"ALTER TABLE {qn(partition)} ENABLE ROW LEVEL SECURITY")
+    if forced:
+        cursor.execute(f"ALTER TABLE {qn(partition)} FORCE ROW LEVEL SECURITY")
+
+
+def create_partition(cursor, table: str, month: datetime) -> str:
+    """Creates and attaches the partition of ``table`` for ``month``, moving its rows out of the default partition."""
+    qn = cursor.db.ops.quote_name
+    key = PARTITIONED_TABLES[table]
+    name = partition_name(table, month)
+    bounds = f"FROM ({_literal(month)}) TO ({_literal(add_months(month, 1))})"
+    in_month = f"{qn(key)} >= {_literal(month)} AND {qn(key)} < {_literal(add_months(month, 1))}"
+    # Created standalone and attached: ATTACH only takes a SHARE UPDATE
+    # EXCLUSIVE lock on the parent, so reads and writes carry on meanwhile.
+    cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING CONSTRAINTS)")
+    default = f"{table}_default"
+    if any(partition.month is None for partition in partitions(cursor, table)):
+        cursor.execute(f"INSERT INTO {qn(name)} SELECT * FROM {qn(default)} WHERE {in_month}")
+        if cursor.rowcount:
+            cursor.execute(f"DELETE FROM {qn(default)} WHERE {in_month}")
+    cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES {bounds}")
+    _secure(cursor, table, name)
+    return name
+
+
+def ensure_partitions(ahead: int = 3, now: Optional[datetime] = None, using: str = "default") -> List[str]:
+    """Creates the missing partitions from this month to ``ahead`` months ahead; returns their names."""
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return []
+    first = month_start(now or datetime.now(dt_timezone.utc))
+    created = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                continue
+            existing = {partition.month for partition in partitions(cursor, table)}
+            for offset in range(ahead + 1):
+                month = add_months(first, offset)
+                if month not in existing:
+                    created.append(create_partition(cursor, table, month))
+    return created
+
+
+def detach_partitions(
+    before: datetime, archive_schema: str = "", drop: bool = False, using: str = "default"
+) -> List[str]:
+    """
+    Detaches the month partitions ending on or before ``before``; returns their names.
+
+    Detached tables stay in place, or are moved to ``archive_schema``, or are
+    dropped with ``drop``. The rows of ``DEPENDENT_TABLES`` referencing them
+    leave with them: copied to ``<table>_pYYYYMM`` beside the detached
+    partition (unless dropped) and deleted. Their rows leave the ORM; rollups
+    already counted them (a rollup rebuild would not).
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return []
+    qn = connection.ops.quote_name
+    detached = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if archive_schema and not drop:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {qn(archive_schema)}")
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                continue
+            for partition in partitions(cursor, table):
+                if partition.month is None or add_months(partition.month, 1) > before:
+                    continue
+                for dependent, column in DEPENDENT_TABLES.get(table, {}).items():
+                    rows = f"{qn(column)} IN (SELECT id FROM {qn(partition.name)})"
+                    if not drop:
+                        copy = qn(partition_name(dependent, partition.month))
+                        if archive_schema:
+                            copy = f"{qn(archive_schema)}.{copy}"
+                        cursor.execute(f"CREATE TABLE {copy} AS SELECT * FROM {qn(dependent)} WHERE {rows}")
+                    cursor.execute(f"DELETE FROM {qn(dependent)} WHERE {rows}")
+                cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(partition.name)}")
+                if drop:
+                    cursor.execute(f"DROP TABLE {qn(partition.name)}")
+                elif archive_schema:
+                    cursor.execute(f"ALTER TABLE {qn(partition.name)} SET SCHEMA {qn(archive_schema)}")
+                detached.append(partition.name)
+    return detached
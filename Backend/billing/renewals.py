@@ -0,0 +1,129 @@
+"""
+Subscription renewal engine.
+
+``renew_due(until)`` invoices every renewable subscription whose current
+period ends before ``until`` and advances its period, in chunks of
+``chunk_size`` subscriptions walked by primary key. Each chunk is one
+transaction: the subscriptions are locked (``SKIP LOCKED`` on PostgreSQL, so
+concurrent runs split the work), their invoices are inserted with a single
+``bulk_create`` and their periods advanced with a single ``bulk_update``.
+
+Reruns are safe: an advanced subscription is no longer due, and periods
+already invoiced (a rerun that sees a stale period end) are skipped; the
+check runs with the subscriptions locked, so no other run can invoice them
+in between. A subscription several periods behind is invoiced for each
+missed period in one pass. Invoices are issued at their period start, so a
+period invoiced twice despite that still hits
+``uniq_invoice_subscription_period``, which includes ``issued_at`` where
+invoices are partitioned (billing.partitions).
+"""
+import calendar
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from analytics import rollups
+from plans.models import BillingInterval
+from subscriptions.models import Subscription, SubscriptionStatus
+from .models import Invoice, InvoiceStatus
+
+RENEWABLE_STATUSES = (SubscriptionStatus.ACTIVE, SubscriptionStatus.PAST_DUE)
+
+INTERVAL_MONTHS = {
+    BillingInterval.MONTHLY: 1,
+    BillingInterval.YEARLY: 12,
+}
+
+
+class RenewalResult(NamedTuple):
+    subscriptions: int
+    invoices: int
+
+
+def add_months(value: datetime, months: int, anchor_day: int) -> datetime:
+    """``value`` moved by ``months``, on ``anchor_day`` clamped to the month's length."""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    day = min(anchor_day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def next_period(subscription, start: datetime):
+    """(period_start, period_end) of the period beginning at ``start``."""
+    months = INTERVAL_MONTHS[subscription.plan.interval]
+    return start, add_months(start, months, subscription.started_at.day)
+
+
+def due_subscriptions(until: datetime):
+    """Renewable subscriptions whose current period ends before ``until``."""
+    return Subscription.objects.filter(
+        Q(current_period_end__lt=until) | Q(current_period_end__isnull=True, started_at__lt=until),
+        status__in=RENEWABLE_STATUSES,
+        cancel_at_period_end=False,
+    )
+
+
+def renew_due(until: Optional[datetime] = None, chunk_size: int = 1000) -> RenewalResult:
+    until = until or timezone.now()
+    totals = RenewalResult(0, 0)
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            chunk = _lock_chunk(until, last_id, chunk_size)
+            if not chunk:
+                return totals
+            invoices = _renew_chunk(chunk, until)
+        last_id = chunk[-1].pk
+        totals = RenewalResult(totals.subscriptions + len(chunk), totals.invoices + invoices)
+
+
+def _lock_chunk(until, last_id, chunk_size):
+    qs = (
+        due_subscriptions(until)
+        .filter(pk__gt=last_id)
+        .select_related('plan')
+        .only('id', 'tenant_id', 'started_at', 'current_period_end', 'plan__price_cents', 'plan__interval')
+        .order_by('pk')
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        qs = qs.select_for_update(skip_locked=True, of=('self',))
+    return list(qs[:chunk_size])
+
+
+def _renew_chunk(chunk, until) -> int:
+    now = timezone.now()
+    invoices = []
+    for subscription in chunk:
+        start = subscription.current_period_end or subscription.started_at
+        while start < until:
+            period_start, period_end = next_period(subscription, start)
+            invoices.append(Invoice(
+                tenant_id=subscription.tenant_id,
+                subscription_id=subscription.pk,
+                plan_id=subscription.plan_id,
+                amount_cents=subscription.plan.price_cents,
+                currency="USD",
+                status=InvoiceStatus.DUE,
+                period_start=period_start,
+                period_end=period_end,
+                issued_at=period_start,
+            ))
+            start = period_end
+        subscription.current_period_end = start
+        subscription.updated_at = now
+
+    if invoices:
+        invoiced = set(
+            Invoice.objects.filter(
+                subscription_id__in=[s.pk for s in chunk],
+                period_start__gte=min(invoice.period_start for invoice in invoices),
+            ).values_list('subscription_id', 'period_start')
+        )
+        invoices = [invoice for invoice in invoices if (invoice.subscription_id, invoice.period_start) not in invoiced]
+        Invoice.objects.bulk_create(invoices, batch_size=1000)
+        rollups.record_invoices(invoices)
+    Subscription.objects.bulk_update(chunk, ['current_period_end', 'updated_at'])
+    return len(invoices)
@@ -34,6 +34,25 @@ class InvoiceSerializer(serializers.ModelSerializer):
         read_only_fields = ("tenant", "amount_cents", "status", "issued_at", "paid_at", "created_at", "updated_at")
 
 
+class InvoiceListSerializer(InvoiceSerializer):
+    """
+    Compact invoice rows for list views.
+
+    ``fields`` restricts the output to a subset of InvoiceSerializer's fields;
+    without it only ``default_fields`` are rendered. Nested payments appear
+    only when requested.
+    """
+
+    default_fields = ("id", "subscription", "amount_cents", "currency", "status", "issued_at", "paid_at")
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(fields or self.default_fields)
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+
 class InvoiceCreateSerializer(serializers.Serializer):
     subscription = serializers.PrimaryKeyRelatedField(queryset=Subscription.objects.select_related("tenant", "plan"))
 
@@ -43,10 +62,23 @@ class PayInvoiceSerializer(serializers.Serializer):
     simulate = serializers.ChoiceField(choices=["fail", "succeed"], required=False)
 
 
+WEBHOOK_EVENT_TYPES = [
+    "payment_intent.succeeded",
+    "payment_intent.failed",
+]
+
+
 class WebhookSerializer(serializers.Serializer):
-    type = serializers.ChoiceField(choices=[
-        "payment_intent.succeeded",
-        "payment_intent.failed",
-    ])
+    id = serializers.CharField(max_length=255, required=False)
+    type = serializers.ChoiceField(choices=WEBHOOK_EVENT_TYPES)
     invoice = serializers.PrimaryKeyRelatedField(queryset=Invoice.objects.all())
     amount_cents = serializers.IntegerField(min_value=1, required=False)
+
+
+class WebhookBatchEventSerializer(serializers.Serializer):
+    """One event of a batch; invoices are checked for the whole batch at once by the view."""
+
+    id = serializers.CharField(max_length=255)
+    type = serializers.ChoiceField(choices=WEBHOOK_EVENT_TYPES)
+    invoice = serializers.IntegerField(min_value=1)
+    amount_cents = serializers.IntegerField(min_value=1, required=False)
@@ -1,3 +1,913 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone as dt_timezone
+import base64
+import csv
+import json
+import threading
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import UserProfile, UserRole
+from accounts.serializers import TenantTokenObtainPairSerializer
+from eshtarek.tenant_context import apply_tenant_context
+from eshtarek.testing import QueryBudgetMixin, QueryPlanAssertionsMixin, requires_postgres
+from plans.models import Plan
+from subscriptions.models import Subscription, SubscriptionStatus
+from tenants.models import Tenant
+from jobs.worker import Worker
+from .exports import EXPORTS, stream
+from .models import Invoice, InvoiceStatus, Payment, PaymentStatus, WebhookEvent
+from .partitions import ensure_partitions, is_partitioned, partitions
+from .renewals import add_months, renew_due
+from .webhooks import process_events
+from .serializers import InvoiceListSerializer
+
+
+def auth_header(user):
+    token = TenantTokenObtainPairSerializer.get_token(user).access_token
+    return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+
+class InvoiceQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Each endpoint's query count for a caller with a claims-bearing token."""
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.other = Tenant.objects.create(name='Globex')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        other_sub = Subscription.objects.create(tenant=cls.other, plan=plan)
+        for _ in range(3):
+            invoice = Invoice.objects.create(tenant=cls.tenant, subscription=cls.sub, amount_cents=1000)
+            Payment.objects.create(invoice=invoice, amount_cents=1000, status=PaymentStatus.FAILED)
+        cls.invoice = invoice
+        cls.other_invoice = Invoice.objects.create(tenant=cls.other, subscription=other_sub, amount_cents=1000)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        self.member_auth = auth_header(self.member)
+        self.admin_auth = auth_header(self.admin)
+
+    def test_list_scoped_to_tenant(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/billing/', **self.member_auth)
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()['results']
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0]), list(InvoiceListSerializer.default_fields))
+
+    def test_list_sparse_fieldset(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/billing/?fields=id,status', **self.member_auth)
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'status'])
+
+    def test_list_unknown_field(self):
+        response = self.client.get('/api/billing/?fields=id,secret', **self.member_auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_expand_payments(self):
+        # invoices + prefetched payments
+        with self.assertDataQueries(2):
+            response = self.client.get('/api/billing/?expand=payments', **self.member_auth)
+        self.assertEqual(len(response.json()['results'][0]['payments']), 1)
+
+    def test_list_for_platform_admin(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/billing/', **self.admin_auth)
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_retrieve(self):
+        with self.assertDataQueries(2):
+            response = self.client.get(f'/api/billing/{self.invoice.id}/', **self.member_auth)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_tenant_is_invisible(self):
+        response = self.client.get(f'/api/billing/{self.other_invoice.id}/', **self.member_auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_create_for_other_tenant_is_forbidden(self):
+        other_sub = Subscription.objects.get(tenant=self.other)
+        response = self.client.post('/api/billing/', {'subscription': other_sub.id}, **self.member_auth)
+        self.assertEqual(response.status_code, 403)
+
+    def test_payments_scoped_through_invoice(self):
+        from accounts.authentication import Principal
+
+        principal = Principal(user_id=1, tenant_id=str(self.other.id))
+        self.assertFalse(Payment.objects.for_principal(principal).exists())
+
+
+class InvoicePaginationTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        issued = timezone.now()
+        # Pairs share issued_at so the id tie-breaker is exercised
+        Invoice.objects.bulk_create([
+            Invoice(tenant=tenant, subscription=sub, amount_cents=100, issued_at=issued - timedelta(days=i // 2))
+            for i in range(7)
+        ])
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        self.auth = auth_header(self.admin)
+
+    def test_walks_forward_and_back_without_gaps(self):
+        expected = list(Invoice.objects.order_by('-issued_at', '-id').values_list('id', flat=True))
+
+        seen, pages, url = [], [], '/api/billing/?page_size=3'
+        while url:
+            with self.assertDataQueries(1):
+                body = self.client.get(url, **self.auth).json()
+            pages.append(body)
+            seen += [row['id'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.client.get(pages[-1]['previous'], **self.auth).json()
+        self.assertEqual([row['id'] for row in back['results']], expected[3:6])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/billing/?cursor=bogus', **self.auth)
+        self.assertEqual(response.status_code, 404)
+        # Well-formed cursors holding values the columns reject
+        for position in (['notadate', 1], [{'a': 1}, 1], [timezone.now().isoformat(), 'x']):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            with self.subTest(position=position):
+                response = self.client.get(f'/api/billing/?cursor={cursor}', **self.auth)
+                self.assertEqual(response.status_code, 404)
+
+
+class InvoiceFastListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        now = timezone.now()
+        for i in range(5):
+            Invoice.objects.create(
+                tenant=tenant, subscription=sub, amount_cents=1000 + i,
+                issued_at=now - timedelta(days=i), paid_at=now if i % 2 else None,
+            )
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def assertSameResponse(self, url):
+        auth = auth_header(self.admin)
+        with override_settings(FAST_JSON_LISTS=False):
+            expected = self.client.get(url, **auth)
+        with override_settings(FAST_JSON_LISTS=True):
+            actual = self.client.get(url, **auth)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+        return actual
+
+    def test_default_fields(self):
+        self.assertSameResponse('/api/billing/')
+
+    def test_all_scalar_fields_with_cursor(self):
+        fields = ','.join(name for name in InvoiceListSerializer.Meta.fields if name != 'payments')
+        response = self.assertSameResponse(f'/api/billing/?fields={fields}&page_size=2')
+        self.assertSameResponse(response.json()['next'])
+
+    def test_expand_payments_falls_back(self):
+        self.assertSameResponse('/api/billing/?expand=payments')
+
+
+@override_settings(ROOT_URLCONF='eshtarek.async_urls')
+class AsyncInvoiceListTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        tenant = Tenant.objects.create(name='Acme')
+        other = Tenant.objects.create(name='Globex')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        now = timezone.now()
+        for i in range(4):
+            invoice = Invoice.objects.create(
+                tenant=tenant, subscription=sub, amount_cents=1000 + i,
+                issued_at=now - timedelta(days=i), paid_at=now if i % 2 else None,
+            )
+            Payment.objects.create(invoice=invoice, amount_cents=1000, status=PaymentStatus.FAILED)
+        Invoice.objects.create(tenant=other, subscription=Subscription.objects.create(tenant=other, plan=plan),
+                               amount_cents=1000)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        self.member_auth = auth_header(self.member)
+        self.admin_auth = auth_header(self.admin)
+
+    def assertSameAsSync(self, url, auth):
+        actual = self.client.get(url, **auth)
+        with override_settings(ROOT_URLCONF='eshtarek.urls'):
+            expected = self.client.get(url, **auth)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+        return actual
+
+    def test_matches_sync_views(self):
+        for fast in (False, True):
+            with self.subTest(FAST_JSON_LISTS=fast), override_settings(FAST_JSON_LISTS=fast):
+                self.assertSameAsSync('/api/billing/', self.member_auth)
+                self.assertSameAsSync('/api/billing/?expand=payments', self.member_auth)
+                response = self.assertSameAsSync('/api/billing/?page_size=3', self.admin_auth)
+                self.assertSameAsSync(response.json()['next'], self.admin_auth)
+                self.assertSameAsSync('/api/billing/?cursor=bogus', self.admin_auth)
+
+    def test_query_budget(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/billing/', **self.member_auth)
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_anonymous_and_invalid_token(self):
+        self.assertEqual(self.assertSameAsSync('/api/billing/', {}).json()['results'], [])
+        response = self.assertSameAsSync('/api/billing/', {'HTTP_AUTHORIZATION': 'Bearer bogus'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoked_token(self):
+        self.client.post('/api/auth/logout/', {}, content_type='application/json', **self.member_auth)
+        self.assertEqual(self.client.get('/api/billing/', **self.member_auth).status_code, 401)
+
+    async def test_served_by_asgi_handler(self):
+        response = await self.async_client.get(
+            '/api/billing/', headers={'Authorization': self.member_auth['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 4)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class RenewalTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.monthly = Plan.objects.create(name='Monthly', price_cents=1000)
+        cls.yearly = Plan.objects.create(name='Yearly', price_cents=10000, interval='yearly')
+
+    def subscribe(self, plan, started_at, period_end=None, **kwargs):
+        sub = Subscription.objects.create(tenant=Tenant.objects.create(name=f'T{Tenant.objects.count()}'), plan=plan, **kwargs)
+        Subscription.objects.filter(pk=sub.pk).update(started_at=started_at, current_period_end=period_end)
+        return sub
+
+    def periods(self, sub):
+        return list(Invoice.objects.filter(subscription=sub).order_by('period_start').values_list('period_start', 'period_end'))
+
+    def test_add_months_keeps_anchor_day(self):
+        jan = utc(2024, 1, 31, 9)
+        feb = add_months(jan, 1, 31)
+        self.assertEqual(feb, utc(2024, 2, 29, 9))
+        self.assertEqual(add_months(feb, 1, 31), utc(2024, 3, 31, 9))
+        self.assertEqual(add_months(utc(2024, 11, 15), 12, 15), utc(2025, 11, 15))
+
+    def test_renews_due_periods(self):
+        monthly = self.subscribe(self.monthly, utc(2024, 1, 31), period_end=utc(2024, 2, 29))
+        yearly = self.subscribe(self.yearly, utc(2024, 3, 1))
+        later = self.subscribe(self.monthly, utc(2024, 3, 1), period_end=utc(2024, 4, 1))
+
+        result = renew_due(utc(2024, 3, 15))
+
+        self.assertEqual(result, (2, 2))
+        self.assertEqual(self.periods(monthly), [(utc(2024, 2, 29), utc(2024, 3, 31))])
+        self.assertEqual(self.periods(yearly), [(utc(2024, 3, 1), utc(2025, 3, 1))])
+        self.assertEqual(self.periods(later), [])
+        monthly.refresh_from_db()
+        self.assertEqual(monthly.current_period_end, utc(2024, 3, 31))
+        invoice = Invoice.objects.get(subscription=yearly)
+        self.assertEqual((invoice.tenant_id, invoice.amount_cents), (yearly.tenant_id, 10000))
+        self.assertEqual(invoice.issued_at, invoice.period_start)
+
+    def test_catches_up_missed_periods(self):
+        sub = self.subscribe(self.monthly, utc(2024, 1, 10), period_end=utc(2024, 2, 10))
+        self.assertEqual(renew_due(utc(2024, 4, 20)).invoices, 3)
+        self.assertEqual([start.month for start, _ in self.periods(sub)], [2, 3, 4])
+
+    def test_rerun_creates_no_duplicates(self):
+        sub = self.subscribe(self.monthly, utc(2024, 1, 10), period_end=utc(2024, 2, 10))
+        renew_due(utc(2024, 2, 20))
+        self.assertEqual(renew_due(utc(2024, 2, 20)), (0, 0))
+        # A rerun that sees a stale period end (crash recovery) skips the invoiced period
+        Subscription.objects.filter(pk=sub.pk).update(current_period_end=utc(2024, 2, 10))
+        renew_due(utc(2024, 2, 20))
+        self.assertEqual(len(self.periods(sub)), 1)
+
+    def test_skips_inactive_and_cancelling(self):
+        self.subscribe(self.monthly, utc(2024, 1, 1), status=SubscriptionStatus.CANCELED)
+        self.subscribe(self.monthly, utc(2024, 1, 1), cancel_at_period_end=True)
+        self.assertEqual(renew_due(utc(2024, 3, 1)), (0, 0))
+
+    def test_query_count_is_per_chunk(self):
+        for _ in range(20):
+            self.subscribe(self.monthly, utc(2024, 1, 10), period_end=utc(2024, 2, 10))
+        # select chunk, invoiced periods, insert invoices, upsert rollups, update periods, empty final select
+        with self.assertDataQueries(6):
+            result = renew_due(utc(2024, 2, 20), chunk_size=50)
+        self.assertEqual(result, (20, 20))
+        with self.assertDataQueries(11):
+            renew_due(utc(2024, 3, 20), chunk_size=10)
+
+    def test_command(self):
+        self.subscribe(self.monthly, utc(2024, 1, 10), period_end=utc(2024, 2, 10))
+        out = StringIO()
+        call_command('renew_subscriptions', '--until', '2024-02-01T00:00:00Z', '--ahead-hours', '240', stdout=out)
+        self.assertIn('Renewed 1 subscription(s), 1 invoice(s)', out.getvalue())
+
+
+class WebhookIngestTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        cls.invoices = [Invoice.objects.create(tenant=tenant, subscription=sub, amount_cents=1000) for _ in range(3)]
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        self.auth = auth_header(self.admin)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json', **self.auth)
+
+    def events(self, *specs):
+        return [{'id': event_id, 'type': f'payment_intent.{kind}', 'invoice': invoice.pk} for event_id, kind, invoice in specs]
+
+    def test_replayed_event_is_not_applied_twice(self):
+        first = self.post('/api/billing/webhooks/mock/', {'id': 'evt_1', 'type': 'payment_intent.failed', 'invoice': self.invoices[0].pk})
+        replay = self.post('/api/billing/webhooks/mock/', {'id': 'evt_1', 'type': 'payment_intent.failed', 'invoice': self.invoices[0].pk})
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual((first.json()['duplicate'], replay.json()['duplicate']), (False, True))
+        self.assertIsNone(replay.json()['job'])
+        Worker().run(burst=True)
+        self.assertEqual(self.invoices[0].payments.count(), 1)
+
+    def test_batch(self):
+        batch = self.events(
+            ('evt_a', 'failed', self.invoices[0]),
+            ('evt_b', 'succeeded', self.invoices[0]),
+            ('evt_c', 'succeeded', self.invoices[1]),
+            ('evt_b', 'succeeded', self.invoices[0]),
+        )
+        # validation, event insert, select new, job insert, mark enqueued
+        with self.assertDataQueries(5):
+            response = self.post('/api/billing/webhooks/mock/batch/', batch)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['accepted'], 3)
+        self.assertEqual(response.json()['duplicates'], ['evt_b'])
+        self.assertEqual(len(response.json()['jobs']), 1)
+
+        # Incident replay: the whole batch again plus one new event
+        replay = self.post('/api/billing/webhooks/mock/batch/', batch + self.events(('evt_d', 'succeeded', self.invoices[2])))
+        self.assertEqual(replay.json()['accepted'], 1)
+        self.assertEqual(replay.json()['duplicates'], ['evt_a', 'evt_b', 'evt_c', 'evt_b'])
+
+        Worker().run(burst=True)
+        self.assertEqual(WebhookEvent.objects.filter(processed_at__isnull=True).count(), 0)
+        for invoice in self.invoices:
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.status, InvoiceStatus.PAID)
+        self.assertEqual(
+            sorted(self.invoices[0].payments.values_list('status', flat=True)),
+            [PaymentStatus.FAILED, PaymentStatus.SUCCEEDED],
+        )
+        self.assertEqual(Payment.objects.count(), 4)
+
+    def test_batch_validation(self):
+        response = self.post('/api/billing/webhooks/mock/batch/', self.events(('evt_x', 'succeeded', self.invoices[0])) + [
+            {'id': 'evt_y', 'type': 'payment_intent.succeeded', 'invoice': 999999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', response.json()['invoice'][0])
+        self.assertEqual(self.post('/api/billing/webhooks/mock/batch/', []).status_code, 400)
+        with override_settings(WEBHOOK_BATCH_MAX=1):
+            response = self.post('/api/billing/webhooks/mock/batch/', self.events(
+                ('evt_1', 'failed', self.invoices[0]), ('evt_2', 'failed', self.invoices[0]),
+            ))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_other_tenants_invoices_are_rejected(self):
+        outsider = User.objects.create_user('outsider', password='pw123456')
+        UserProfile.objects.create(user=outsider, tenant=Tenant.objects.create(name='Globex'), role=UserRole.TENANT_ADMIN)
+        self.auth = auth_header(outsider)
+        response = self.post('/api/billing/webhooks/mock/batch/', self.events(('evt_x', 'succeeded', self.invoices[0])))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.invoices[0].pk), response.json()['invoice'][0])
+        response = self.post('/api/billing/webhooks/mock/', {'type': 'payment_intent.succeeded', 'invoice': self.invoices[0].pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    # Elsewhere the foreign key keeps an event's invoice from going missing; on
+    # PostgreSQL invoices are partitioned and can leave with a detached month
+    @requires_postgres
+    def test_event_of_missing_invoice_does_not_fail_the_job(self):
+        self.post('/api/billing/webhooks/mock/batch/', self.events(('evt_a', 'succeeded', self.invoices[0])))
+        gone = WebhookEvent.objects.create(event_id='evt_gone', type='payment_intent.succeeded', invoice_id=999999)
+        payload = {'events': sorted(WebhookEvent.objects.values_list('pk', flat=True))}
+        with self.assertLogs('billing.webhooks', 'WARNING'):
+            process_events(payload)
+        self.invoices[0].refresh_from_db()
+        self.assertEqual(self.invoices[0].status, InvoiceStatus.PAID)
+        gone.refresh_from_db()
+        self.assertIsNotNone(gone.processed_at)
+
+    def test_already_processed_events_are_skipped(self):
+        self.post('/api/billing/webhooks/mock/batch/', self.events(('evt_a', 'failed', self.invoices[0])))
+        job_payload = {'events': list(WebhookEvent.objects.values_list('pk', flat=True))}
+        Worker().run(burst=True)
+        process_events(job_payload)
+        self.assertEqual(self.invoices[0].payments.count(), 1)
+
+
+class PayTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        cls.invoice = Invoice.objects.create(tenant=cls.tenant, subscription=sub, amount_cents=1000)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.outsider = User.objects.create_user('outsider', password='pw123456')
+        UserProfile.objects.create(user=cls.outsider, tenant=Tenant.objects.create(name='Globex'), role=UserRole.TENANT_ADMIN)
+
+    def setUp(self):
+        caches['idempotency'].clear()
+        self.url = f'/api/billing/{self.invoice.pk}/pay/'
+
+    def pay(self, key=None, user=None, **data):
+        headers = auth_header(user or self.member)
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        return self.client.post(self.url, data, content_type='application/json', **headers)
+
+    def test_replay_is_served_from_store(self):
+        first = self.pay('key-1')
+        self.assertEqual(first.status_code, 200)
+        with self.assertDataQueries(0):
+            replay = self.pay('key-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+    def test_replay_after_store_loss(self):
+        first = self.pay('key-1')
+        caches['idempotency'].clear()
+        replay = self.pay('key-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertTrue(replay.json()['idempotent'])
+        self.assertEqual(replay.json()['payment'], first.json()['payment'])
+        self.assertEqual(self.invoice.payments.count(), 1)
+
+    def test_second_key_cannot_pay_twice(self):
+        self.assertEqual(self.pay('key-1').status_code, 200)
+        self.assertEqual(self.pay('key-2').status_code, 400)
+        self.assertEqual(self.pay().status_code, 400)
+
+    def test_failed_payment_replay(self):
+        first = self.pay('key-1', simulate='fail')
+        self.assertEqual(first.status_code, 402)
+        replay = self.pay('key-1', simulate='fail')
+        self.assertEqual((replay.status_code, replay.content), (402, first.content))
+        self.assertEqual(self.pay('key-2').status_code, 200)
+
+    def test_create_invoice_retry(self):
+        admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+        headers = dict(auth_header(admin), HTTP_IDEMPOTENCY_KEY='create-1')
+        data = {'subscription': self.invoice.subscription_id}
+        first = self.client.post('/api/billing/', data, content_type='application/json', **headers)
+        replay = self.client.post('/api/billing/', data, content_type='application/json', **headers)
+        self.assertEqual((first.status_code, replay.status_code), (201, 201))
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(Invoice.objects.count(), 2)
+
+    def test_cached_replay_is_tenant_checked(self):
+        self.pay('key-1')
+        self.assertEqual(self.pay('key-1', user=self.outsider).status_code, 404)
+
+
+@requires_postgres
+class PayConcurrencyTests(TransactionTestCase):
+    """Parallel pay requests against one invoice, each on its own connection."""
+
+    workers = 8
+
+    def setUp(self):
+        caches['idempotency'].clear()
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        self.invoice = Invoice.objects.create(tenant=tenant, subscription=sub, amount_cents=1000)
+        self.auths = []
+        for i in range(self.workers):
+            user = User.objects.create_user(f'member{i}', password='pw123456')
+            UserProfile.objects.create(user=user, tenant=tenant, role=UserRole.TENANT_USER)
+            self.auths.append(auth_header(user))
+
+    def fire(self, requests):
+        barrier = threading.Barrier(len(requests))
+        statuses = []
+
+        def request(key, auth):
+            try:
+                barrier.wait()
+                response = Client().post(
+                    f'/api/billing/{self.invoice.pk}/pay/', {}, content_type='application/json',
+                    HTTP_IDEMPOTENCY_KEY=key, **auth,
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request, args=args) for args in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def assertOneSucceededPayment(self):
+        payments = Payment.objects.filter(invoice=self.invoice)
+        self.assertEqual(payments.count(), 1)
+        self.assertEqual(payments.get().status, PaymentStatus.SUCCEEDED)
+
+    def test_same_key_from_one_client(self):
+        # The response store lets one request through; the rest are told it is in progress
+        statuses = self.fire([('retry', self.auths[0])] * self.workers)
+        self.assertEqual(statuses.count(200), 1)
+        self.assertEqual(set(statuses), {200, 409})
+        self.assertOneSucceededPayment()
+
+    def test_same_key_from_several_clients(self):
+        # Not deduplicated by the response store: the row lock makes all but one replay
+        statuses = self.fire([('retry', auth) for auth in self.auths])
+        self.assertEqual(statuses, [200] * self.workers)
+        self.assertOneSucceededPayment()
+
+    def test_different_keys(self):
+        statuses = self.fire([(f'key-{i}', auth) for i, auth in enumerate(self.auths)])
+        self.assertEqual(statuses, [200] + [400] * (self.workers - 1))
+        self.assertOneSucceededPayment()
+
+
+@requires_postgres
+class InvoiceQueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        tenants = Tenant.objects.bulk_create([Tenant(name=f'Tenant {i:03}') for i in range(40)])
+        subs = Subscription.objects.bulk_create([Subscription(tenant=t, plan=plan) for t in tenants])
+        invoices = Invoice.objects.bulk_create([
+            Invoice(tenant=sub.tenant, subscription=sub, amount_cents=1000) for sub in subs for _ in range(25)
+        ])
+        Payment.objects.bulk_create([
+            Payment(invoice=invoice, tenant_id=invoice.tenant_id, amount_cents=1000, idempotency_key=f'key-{invoice.id}')
+            for invoice in invoices
+        ])
+        cls.invoice = invoices[0]
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=tenants[0], role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+        cls.analyze(Tenant, Subscription, Invoice, Payment)
+
+    def test_tenant_list(self):
+        auth = auth_header(self.member)
+        self.assertNoSeqScan(lambda: self.client.get('/api/billing/', **auth))
+
+    def test_tenant_list_next_page(self):
+        auth = auth_header(self.member)
+        next_url = self.client.get('/api/billing/?page_size=5', **auth).json()['next']
+        self.assertNoSeqScan(lambda: self.client.get(next_url, **auth))
+
+    def test_admin_list(self):
+        auth = auth_header(self.admin)
+        self.assertNoSeqScan(lambda: self.client.get('/api/billing/', **auth))
+
+    def test_tenant_list_with_payments(self):
+        auth = auth_header(self.member)
+        self.assertNoSeqScan(lambda: self.client.get('/api/billing/?expand=payments', **auth))
+
+    def test_retrieve(self):
+        auth = auth_header(self.member)
+        self.assertNoSeqScan(lambda: self.client.get(f'/api/billing/{self.invoice.id}/', **auth))
+
+    def test_tenant_export(self):
+        UserProfile.objects.filter(user=self.member).update(role=UserRole.TENANT_ADMIN)
+        auth = auth_header(User.objects.get(pk=self.member.pk))
+        self.assertNoSeqScan(lambda: b''.join(self.client.get('/api/billing/export/invoices.csv', **auth).streaming_content))
+
+    def test_payment_lookups(self):
+        self.assertNoSeqScan(
+            lambda: Payment.objects.filter(invoice=self.invoice, idempotency_key=f'key-{self.invoice.id}').first()
+        )
+        self.assertNoSeqScan(lambda: self.invoice.payments.order_by('-id').first())
+
+
+@requires_postgres
+class PartitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=plan)
+
+    def invoice(self, issued_at=None):
+        return Invoice.objects.create(
+            tenant=self.tenant, subscription=self.sub, amount_cents=1000, issued_at=issued_at or timezone.now(),
+        )
+
+    def partition_of(self, invoice):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM billing_invoice WHERE id = %s', [invoice.pk])
+            return cursor.fetchone()[0]
+
+    def test_tables_are_partitioned(self):
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor, 'billing_invoice'))
+            # Read by invoice, never by month (billing.partitions)
+            self.assertFalse(is_partitioned(cursor, 'billing_payment'))
+        invoice = self.invoice()
+        self.assertEqual(self.partition_of(invoice), f'billing_invoice_p{timezone.now():%Y%m}')
+        Payment.objects.create(invoice=invoice, amount_cents=1000)
+        self.assertEqual(list(invoice.payments.values_list('amount_cents', flat=True)), [1000])
+
+    def test_new_partition_takes_rows_from_default(self):
+        invoice = self.invoice(utc(2001, 5, 10))
+        self.assertEqual(self.partition_of(invoice), 'billing_invoice_default')
+
+        created = ensure_partitions(ahead=0, now=utc(2001, 5, 1))
+
+        self.assertEqual(created, ['billing_invoice_p200105'])
+        self.assertEqual(self.partition_of(invoice), 'billing_invoice_p200105')
+        self.assertEqual(ensure_partitions(ahead=0, now=utc(2001, 5, 1)), [])
+        plan = Invoice.objects.filter(issued_at__gte=utc(2001, 5, 1), issued_at__lt=utc(2001, 6, 1)).explain()
+        self.assertIn('billing_invoice_p200105', plan)
+        self.assertNotIn('billing_invoice_default', plan)
+
+    def test_command_archives_old_months(self):
+        ensure_partitions(ahead=0, now=utc(2001, 5, 1))
+        old, current = self.invoice(utc(2001, 5, 10)), self.invoice()
+        old_payment = Payment.objects.create(invoice=old, amount_cents=1000)
+        Payment.objects.create(invoice=current, amount_cents=1000)
+        WebhookEvent.objects.create(event_id='evt_old', type='payment_intent.succeeded', invoice=old)
+        out = StringIO()
+        call_command('partition_billing', '--retain-months', '12', '--archive-schema', 'billing_archive', stdout=out)
+        self.assertIn('Archived to billing_archive: billing_invoice_p200105', out.getvalue())
+        self.assertEqual(list(Invoice.objects.values_list('pk', flat=True)), [current.pk])
+        # Payments and webhook events leave with their invoices
+        self.assertEqual(list(Payment.objects.values_list('invoice_id', flat=True)), [current.pk])
+        self.assertFalse(WebhookEvent.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM billing_archive.billing_invoice_p200105')
+            self.assertEqual(cursor.fetchall(), [(old.pk,)])
+            cursor.execute('SELECT id FROM billing_archive.billing_payment_p200105')
+            self.assertEqual(cursor.fetchall(), [(old_payment.pk,)])
+            cursor.execute('SELECT event_id FROM billing_archive.billing_webhookevent_p200105')
+            self.assertEqual(cursor.fetchall(), [('evt_old',)])
+            self.assertNotIn('billing_invoice_p200105', [p.name for p in partitions(cursor, 'billing_invoice')])
+
+    def test_dropping_old_months_drops_their_payments(self):
+        ensure_partitions(ahead=0, now=utc(2001, 5, 1))
+        old = self.invoice(utc(2001, 5, 10))
+        Payment.objects.create(invoice=old, amount_cents=1000)
+        with connection.cursor() as cursor:
+            # Check the deferred foreign keys now, or the partition can't be dropped
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        call_command('partition_billing', '--retain-months', '12', '--drop', stdout=StringIO())
+        self.assertFalse(Payment.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('billing_payment_p200105'), to_regclass('billing_invoice_p200105')")
+            self.assertEqual(cursor.fetchone(), (None, None))
+
+    def referencing_invoices(self, cursor):
+        cursor.execute(
+            "SELECT conrelid::regclass::text FROM pg_constraint WHERE confrelid = 'billing_invoice'::regclass ORDER BY 1"
+        )
+        return [table for table, in cursor.fetchall()]
+
+    def period_index(self, cursor):
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'uniq_invoice_subscription_period'")
+        return cursor.fetchone()[0]
+
+    def test_migration_round_trip_keeps_rows_sequence_and_constraints(self):
+        invoice = self.invoice()
+        Payment.objects.create(invoice=invoice, amount_cents=1000)
+        with connection.cursor() as cursor:
+            # Check the deferred foreign keys now, or the tables can't be altered
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('billing')
+
+        executor.migrate([('billing', '0007_invoice_plan')])
+        with connection.cursor() as cursor:
+            self.assertFalse(is_partitioned(cursor, 'billing_invoice'))
+            self.assertEqual(self.referencing_invoices(cursor), ['billing_payment', 'billing_webhookevent'])
+            self.assertIn('(subscription_id, period_start) WHERE', self.period_index(cursor))
+
+        executor.loader.build_graph()
+        executor.migrate(latest)
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor, 'billing_invoice'))
+            self.assertEqual(self.referencing_invoices(cursor), [])
+            self.assertIn('(subscription_id, period_start, issued_at) WHERE', self.period_index(cursor))
+            cursor.execute("SELECT policyname FROM pg_policies WHERE tablename = 'billing_invoice' ORDER BY 1")
+            self.assertEqual(
+                cursor.fetchall(), [('billing_invoice_platform_admin',), ('billing_invoice_tenant_isolation',)],
+            )
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relname LIKE 'billing_invoice_p%%' AND relkind = 'r' AND NOT relrowsecurity"
+            )
+            self.assertEqual(cursor.fetchall(), [])
+        self.assertEqual(Invoice.objects.get().pk, invoice.pk)
+        self.assertEqual(Payment.objects.get().tenant_id, self.tenant.pk)
+        self.assertGreater(self.invoice().pk, invoice.pk)
+
+
+class BillingConstraintTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=plan)
+        cls.invoice = cls.create_invoice()
+
+    @classmethod
+    def create_invoice(cls):
+        # Issued at the period start, as renewals do
+        return Invoice.objects.create(
+            tenant=cls.tenant, subscription=cls.sub, amount_cents=1000,
+            period_start=utc(2024, 1, 10), issued_at=utc(2024, 1, 10),
+        )
+
+    def test_payment_idempotency_keys_are_unique(self):
+        Payment.objects.create(invoice=self.invoice, amount_cents=1000, idempotency_key='k1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Payment.objects.create(invoice=self.invoice, amount_cents=1000, idempotency_key='k1')
+
+    def test_invoice_periods_are_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_invoice()
+
+
+@requires_postgres
+class RowLevelSecurityTests(QueryPlanAssertionsMixin, TestCase):
+    """
+    The billing policies, enforced for the test's transaction: the test role
+    owns the tables, and owners bypass RLS unless it is forced.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.acme, cls.globex = Tenant.objects.bulk_create([Tenant(name='Acme'), Tenant(name='Globex')])
+        for tenant in (cls.acme, cls.globex):
+            sub = Subscription.objects.create(tenant=tenant, plan=plan)
+            for _ in range(3):
+                invoice = Invoice.objects.create(tenant=tenant, subscription=sub, amount_cents=1000)
+                Payment.objects.create(invoice=invoice, amount_cents=1000)
+        cls.sub = sub
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.acme, role=UserRole.TENANT_USER)
+        cls.analyze(Invoice, Payment)
+
+    def enforce(self, tenant_id=None, is_admin=False):
+        with connection.cursor() as cursor:
+            # Check the deferred foreign keys of the seeded rows now, or the tables can't be altered
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for table in ('billing_invoice', 'billing_payment'):
+                cursor.execute(f'ALTER TABLE {table} FORCE ROW LEVEL SECURITY')
+        apply_tenant_context(str(tenant_id) if tenant_id else None, is_admin)
+
+    def test_tenant_sees_own_rows(self):
+        self.enforce(self.acme.pk)
+        self.assertEqual(set(Invoice.objects.values_list('tenant_id', flat=True)), {self.acme.pk})
+        self.assertEqual(set(Payment.objects.values_list('tenant_id', flat=True)), {self.acme.pk})
+
+    def test_admin_sees_all(self):
+        self.enforce(is_admin=True)
+        self.assertEqual(Invoice.objects.count(), 6)
+        self.assertEqual(Payment.objects.count(), 6)
+
+    def test_no_context_sees_nothing(self):
+        self.enforce()
+        self.assertEqual(Invoice.objects.count(), 0)
+
+    def test_writes_are_checked(self):
+        self.enforce(self.acme.pk)
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            Invoice.objects.create(tenant=self.globex, subscription=self.sub, amount_cents=1000)
+
+    def test_tenant_queries_use_indexes(self):
+        auth = auth_header(self.member)
+        self.enforce(self.acme.pk)
+        self.assertNoSeqScan(lambda: self.client.get('/api/billing/?expand=payments', **auth))
+
+
+class ExportTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.other = Tenant.objects.create(name='Globex')
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        for tenant in (cls.tenant, cls.other):
+            sub = Subscription.objects.create(tenant=tenant, plan=plan)
+            for i in range(5):
+                invoice = Invoice.objects.create(
+                    tenant=tenant, subscription=sub, amount_cents=1000 + i, issued_at=start + timedelta(days=4 - i),
+                )
+                Payment.objects.create(invoice=invoice, amount_cents=1000 + i, status=PaymentStatus.FAILED)
+        cls.owner = User.objects.create_user('owner', password='pw123456')
+        UserProfile.objects.create(user=cls.owner, tenant=cls.tenant, role=UserRole.TENANT_ADMIN)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def export(self, user, path, **params):
+        response = self.client.get(f'/api/billing/export/{path}', params, **auth_header(user))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_is_scoped_and_ordered(self):
+        rows = list(csv.DictReader(self.export(self.owner, 'invoices.csv').splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['tenant'] for row in rows}, {str(self.tenant.pk)})
+        self.assertEqual([row['issued_at'] for row in rows], sorted(row['issued_at'] for row in rows))
+        self.assertEqual(rows[0]['issued_at'], '2024-01-01T00:00:00Z')
+        self.assertEqual(rows[0]['paid_at'], '')
+        self.assertEqual(list(rows[0]), [name for name, _ in EXPORTS['invoices'].columns])
+
+    def test_jsonl_for_one_tenant(self):
+        body = self.export(self.admin, 'payments.jsonl', tenant=str(self.other.pk))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['tenant'] for row in rows}, {str(self.other.pk)})
+        self.assertEqual(rows[0]['status'], PaymentStatus.FAILED)
+        self.assertIsNone(rows[0]['idempotency_key'])
+
+    def test_admin_gets_all_tenants(self):
+        self.assertEqual(len(self.export(self.admin, 'invoices.jsonl').splitlines()), 10)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/api/billing/export/invoices.csv', **auth_header(self.member)).status_code, 403)
+        other = self.client.get(
+            '/api/billing/export/invoices.csv', {'tenant': str(self.other.pk)}, **auth_header(self.owner),
+        )
+        self.assertEqual(other.status_code, 403)
+        self.assertEqual(self.client.get('/api/billing/export/invoices.xml', **auth_header(self.owner)).status_code, 404)
+
+    def test_chunks_are_whole_lines(self):
+        expected = self.export(self.admin, 'invoices.csv')
+        with override_settings(EXPORT_CHUNK_SIZE=3, EXPORT_CHUNK_BYTES=200):
+            response = self.client.get('/api/billing/export/invoices.csv', **auth_header(self.admin))
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(chunk.endswith(b'\r\n') for chunk in chunks))
+        self.assertEqual(b''.join(chunks).decode(), expected)
+
+    def test_keyset_batches_without_server_side_cursors(self):
+        spec = EXPORTS['invoices']
+        expected = b''.join(stream(spec, Invoice.objects.all(), 'jsonl'))
+        settings_dict = connection.settings_dict
+        saved = settings_dict.get('DISABLE_SERVER_SIDE_CURSORS', False)
+        settings_dict['DISABLE_SERVER_SIDE_CURSORS'] = True
+        try:
+            # Ten rows in batches of four: three range queries
+            with self.assertDataQueries(3):
+                body = b''.join(stream(spec, Invoice.objects.all(), 'jsonl', chunk_size=4))
+        finally:
+            settings_dict['DISABLE_SERVER_SIDE_CURSORS'] = saved
+        self.assertEqual(body, expected)
+
+    async def test_asgi_streams_asynchronously(self):
+        expected = await sync_to_async(self.export)(self.admin, 'invoices.jsonl')
+        auth = await sync_to_async(auth_header)(self.admin)
+        response = await self.async_client.get(
+            '/api/billing/export/invoices.jsonl', headers={'Authorization': auth['HTTP_AUTHORIZATION']},
+        )
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]).decode(), expected)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_billing', 'payments', '--tenant', str(self.tenant.pk), '--chunk-size', '2', stdout=out)
+        rows = list(csv.DictReader(out.getvalue().splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['tenant'] for row in rows}, {str(self.tenant.pk)})
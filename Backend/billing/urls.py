@@ -1,10 +1,11 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .views import InvoiceViewSet
+from .views import BillingExportView, InvoiceViewSet
 
 router = DefaultRouter()
 router.register(r'', InvoiceViewSet, basename='invoice')
 
 urlpatterns = [
+    re_path(r'^export/(?P<kind>invoices|payments)\.(?P<fmt>csv|jsonl)$', BillingExportView.as_view(), name='billing_export'),
     path('', include(router.urls)),
 ]
@@ -1,23 +1,40 @@
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import viewsets, permissions, status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from accounts.permissions import IsTenantAdminOrReadOnly
+from accounts.authentication import get_principal
+from accounts.permissions import IsTenantAdmin, IsTenantAdminOrReadOnly
+from eshtarek.aio import AsyncListView, streaming_content
+from eshtarek.fastjson import FastListMixin
+from eshtarek.pagination import KeysetPagination
 from .models import Invoice, Payment, InvoiceStatus, PaymentStatus
 from .serializers import (
     InvoiceSerializer,
+    InvoiceListSerializer,
     InvoiceCreateSerializer,
     PayInvoiceSerializer,
     PaymentSerializer,
     WebhookSerializer,
+    WebhookBatchEventSerializer,
 )
+from .exports import CONTENT_TYPES, EXPORTS, stream
+from .webhooks import ingest
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Invoice.objects.select_related("tenant", "subscription", "subscription__plan").prefetch_related("payments")
     serializer_class = InvoiceSerializer
     permission_classes = [IsTenantAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    cursor_ordering = ("-issued_at", "-id")
 
     def get_permissions(self):
         # Allow any authenticated tenant member to create and pay invoices; other writes remain admin-only
@@ -26,36 +43,53 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return [perm() for perm in self.permission_classes]
 
     def get_queryset(self):
-        qs = super().get_queryset()
-        user = self.request.user
-        if getattr(user, 'is_superuser', False):
-            return qs
-        profile = getattr(user, 'profile', None)
-        if profile and getattr(profile, 'role', '') == 'ADMIN':
-            return qs
-        if profile and getattr(profile, 'tenant_id', None):
-            return qs.filter(tenant_id=profile.tenant_id)
-        return qs.none()
+        principal = get_principal(self.request)
+        if self.action != 'list':
+            return super().get_queryset().for_principal(principal)
+        # Load only the requested columns; payments only when they are rendered
+        fields = self.get_list_fields()
+        columns = {name for name in fields if name != 'payments'} | {'id', 'issued_at'}
+        qs = Invoice.objects.for_principal(principal).only(*columns)
+        if 'payments' in fields:
+            qs = qs.prefetch_related('payments')
+        return qs
+
+    def get_list_fields(self):
+        """Fields for list rows from ``?fields=a,b`` and ``?expand=payments``."""
+        if not hasattr(self, '_list_fields'):
+            params = self.request.query_params
+            requested = [name for name in params.get('fields', '').split(',') if name]
+            unknown = sorted(set(requested) - set(InvoiceSerializer.Meta.fields))
+            if unknown:
+                raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}"]})
+            fields = requested or list(InvoiceListSerializer.default_fields)
+            if 'payments' in params.get('expand', '').split(',') and 'payments' not in fields:
+                fields.append('payments')
+            self._list_fields = fields
+        return self._list_fields
 
     def get_serializer_class(self):
         if self.action == 'create':
             return InvoiceCreateSerializer
+        if self.action == 'list':
+            return InvoiceListSerializer
         return InvoiceSerializer
 
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'list':
+            kwargs.setdefault('fields', self.get_list_fields())
+        return super().get_serializer(*args, **kwargs)
+
     def perform_create(self, serializer):
         subscription = serializer.validated_data['subscription']
         # Ownership check for non-admins: invoice can only be created for a subscription in user's tenant
-        user = self.request.user
-        if not getattr(user, 'is_superuser', False):
-            profile = getattr(user, 'profile', None)
-            role = getattr(getattr(profile, 'role', None), 'value', None) or getattr(profile, 'role', None)
-            is_tenant_admin = role in ('ADMIN', 'TENANT_ADMIN')
-            if not is_tenant_admin and (not profile or getattr(profile, 'tenant_id', None) != subscription.tenant_id):
-                raise PermissionDenied("Not allowed for this tenant")
+        if not get_principal(self.request).can_access_tenant(subscription.tenant_id):
+            raise PermissionDenied("Not allowed for this tenant")
         amount = subscription.plan.price_cents
         invoice = Invoice.objects.create(
             tenant=subscription.tenant,
             subscription=subscription,
+            plan=subscription.plan,
             amount_cents=amount,
             currency="USD",
             status=InvoiceStatus.DUE,
@@ -73,96 +107,145 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], url_path='pay', permission_classes=[permissions.IsAuthenticated])
     def pay(self, request, pk=None):
-        invoice = self.get_object()
-        if invoice.status == InvoiceStatus.PAID:
-            return Response({"detail": "Invoice already paid"}, status=status.HTTP_400_BAD_REQUEST)
         pay_ser = PayInvoiceSerializer(data=request.data)
         pay_ser.is_valid(raise_exception=True)
-        amount = pay_ser.validated_data.get('amount_cents') or invoice.amount_cents
-
-        # Idempotency-Key support (Stripe-like)
-        idem_key = request.headers.get('Idempotency-Key') or request.headers.get('idempotency-key')
-        if idem_key:
-            existing = invoice.payments.filter(idempotency_key=idem_key).first()
-            if existing:
-                # Return previous result
-                paid = (invoice.status == InvoiceStatus.PAID)
-                return Response({
-                    "invoice": InvoiceSerializer(invoice).data,
-                    "payment": PaymentSerializer(existing).data,
-                    "idempotent": True,
-                }, status=status.HTTP_200_OK if paid else status.HTTP_202_ACCEPTED)
 
-        simulate = pay_ser.validated_data.get('simulate')
-        if simulate == 'fail':
+        # Idempotency-Key support (Stripe-like). Retries by the same caller are
+        # answered by eshtarek.idempotency; this covers other callers and expired entries.
+        idem_key = request.headers.get('Idempotency-Key')
+        with transaction.atomic():
+            # Concurrent payments of one invoice queue up here, so the key
+            # lookup and the PAID check below see every committed payment
+            invoice = self.get_locked_object()
+            if idem_key:
+                existing = invoice.payments.filter(idempotency_key=idem_key).first()
+                if existing:
+                    return Response({
+                        "invoice": InvoiceSerializer(invoice).data,
+                        "payment": PaymentSerializer(existing).data,
+                        "idempotent": True,
+                    }, status=status.HTTP_200_OK if invoice.status == InvoiceStatus.PAID else status.HTTP_202_ACCEPTED)
+            if invoice.status == InvoiceStatus.PAID:
+                return Response({"detail": "Invoice already paid"}, status=status.HTTP_400_BAD_REQUEST)
+
+            amount = pay_ser.validated_data.get('amount_cents') or invoice.amount_cents
+            failed = pay_ser.validated_data.get('simulate') == 'fail'
             payment = Payment.objects.create(
                 invoice=invoice,
                 amount_cents=amount,
-                status=PaymentStatus.FAILED,
-                provider_ref="mock_txn_failed",
+                status=PaymentStatus.FAILED if failed else PaymentStatus.SUCCEEDED,
+                provider_ref="mock_txn_failed" if failed else "mock_txn",
                 idempotency_key=idem_key,
             )
-            # invoice stays DUE
+            if failed:
+                # invoice stays DUE
+                return Response({
+                    "invoice": InvoiceSerializer(invoice).data,
+                    "payment": PaymentSerializer(payment).data,
+                    "simulated": "fail",
+                }, status=status.HTTP_402_PAYMENT_REQUIRED)
+
+            invoice.status = InvoiceStatus.PAID
+            invoice.paid_at = timezone.now()
+            invoice.save(update_fields=["status", "paid_at", "updated_at"])
             return Response({
                 "invoice": InvoiceSerializer(invoice).data,
                 "payment": PaymentSerializer(payment).data,
-                "simulated": "fail",
-            }, status=status.HTTP_402_PAYMENT_REQUIRED)
+            }, status=status.HTTP_200_OK)
 
-        # Default: succeed
-        payment = Payment.objects.create(
-            invoice=invoice,
-            amount_cents=amount,
-            status=PaymentStatus.SUCCEEDED,
-            provider_ref="mock_txn",
-            idempotency_key=idem_key,
-        )
-        invoice.status = InvoiceStatus.PAID
-        invoice.paid_at = timezone.now()
-        invoice.save(update_fields=["status", "paid_at", "updated_at"])
-        return Response({
-            "invoice": InvoiceSerializer(invoice).data,
-            "payment": PaymentSerializer(payment).data,
-        }, status=status.HTTP_200_OK)
+    def get_locked_object(self):
+        """The URL's invoice, visible to the caller, locked for the rest of the transaction."""
+        queryset = Invoice.objects.for_principal(get_principal(self.request)).select_for_update()
+        invoice = get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, invoice)
+        return invoice
 
     @action(detail=False, methods=['post'], url_path='webhooks/mock', permission_classes=[permissions.IsAuthenticated])
     def webhooks_mock(self, request):
-        """Mock endpoint to simulate provider webhooks."""
+        """Mock endpoint to simulate provider webhooks; events are applied by the job workers."""
         ser = WebhookSerializer(data=request.data)
+        # Only invoices the caller can see, as for pay
+        ser.fields['invoice'].queryset = Invoice.objects.for_principal(get_principal(request))
         ser.is_valid(raise_exception=True)
-        event_type = ser.validated_data['type']
-        invoice = ser.validated_data['invoice']
-        amount = ser.validated_data.get('amount_cents') or invoice.amount_cents
+        event_id = ser.validated_data.get('id') or f"evt_{uuid.uuid4().hex}"
+        result = ingest([{
+            "event_id": event_id,
+            "type": ser.validated_data['type'],
+            "invoice_id": ser.validated_data['invoice'].pk,
+            "amount_cents": ser.validated_data.get('amount_cents'),
+        }])
+        return Response({
+            "event": ser.validated_data['type'],
+            "id": event_id,
+            "duplicate": bool(result.duplicates),
+            "job": result.jobs[0] if result.jobs else None,
+        }, status=status.HTTP_202_ACCEPTED)
 
-        if event_type == 'payment_intent.failed':
-            payment = Payment.objects.create(
-                invoice=invoice,
-                amount_cents=amount,
-                status=PaymentStatus.FAILED,
-                provider_ref="mock_webhook_failed",
-            )
-            return Response({
-                "event": event_type,
-                "invoice": InvoiceSerializer(invoice).data,
-                "payment": PaymentSerializer(payment).data,
-            }, status=status.HTTP_200_OK)
+    @action(detail=False, methods=['post'], url_path='webhooks/mock/batch', permission_classes=[permissions.IsAuthenticated])
+    def webhooks_mock_batch(self, request):
+        """Records a JSON array of events in one request; replays of known event ids are reported, not applied."""
+        limit = getattr(settings, 'WEBHOOK_BATCH_MAX', 1000)
+        if isinstance(request.data, list) and len(request.data) > limit:
+            raise ValidationError({"non_field_errors": [f"At most {limit} events per batch"]})
+        ser = WebhookBatchEventSerializer(data=request.data, many=True, allow_empty=False)
+        ser.is_valid(raise_exception=True)
+        invoice_ids = {event['invoice'] for event in ser.validated_data}
+        visible = Invoice.objects.for_principal(get_principal(request)).filter(pk__in=invoice_ids)
+        missing = invoice_ids - set(visible.values_list('pk', flat=True))
+        if missing:
+            raise ValidationError({"invoice": [f"Unknown invoice(s): {', '.join(map(str, sorted(missing)))}"]})
+        result = ingest([
+            {
+                "event_id": event['id'],
+                "type": event['type'],
+                "invoice_id": event['invoice'],
+                "amount_cents": event.get('amount_cents'),
+            }
+            for event in ser.validated_data
+        ])
+        return Response({
+            "accepted": len(result.accepted),
+            "duplicates": result.duplicates,
+            "jobs": result.jobs,
+        }, status=status.HTTP_202_ACCEPTED)
 
-        # payment_intent.succeeded
-        if invoice.status != InvoiceStatus.PAID:
-            payment = Payment.objects.create(
-                invoice=invoice,
-                amount_cents=amount,
-                status=PaymentStatus.SUCCEEDED,
-                provider_ref="mock_webhook_succeeded",
-            )
-            invoice.status = InvoiceStatus.PAID
-            invoice.paid_at = timezone.now()
-            invoice.save(update_fields=["status", "paid_at", "updated_at"])
-        else:
-            payment = invoice.payments.order_by('-id').first()
 
-        return Response({
-            "event": event_type,
-            "invoice": InvoiceSerializer(invoice).data,
-            "payment": PaymentSerializer(payment).data if payment else None,
-        }, status=status.HTTP_200_OK)
+class AsyncInvoiceListView(AsyncListView):
+    view_class = InvoiceViewSet
+
+
+class BillingExportView(APIView):
+    """
+    Full invoice or payment history as a streamed CSV / JSON Lines download.
+
+    Tenant admins get their tenant's rows; platform admins get every tenant's,
+    or one tenant's with ``?tenant=``.
+    """
+
+    permission_classes = [IsTenantAdmin]
+
+    def perform_content_negotiation(self, request, force=False):
+        # The body is CSV / JSON Lines whatever the Accept header; errors render as JSON
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, kind, fmt):
+        spec = EXPORTS[kind]
+        principal = get_principal(request)
+        queryset = spec.model.objects.for_principal(principal)
+        tenant_id = request.query_params.get("tenant")
+        if tenant_id:
+            try:
+                tenant_id = uuid.UUID(tenant_id)
+            except ValueError:
+                raise ValidationError({"tenant": ["Must be a valid UUID."]})
+            if not principal.can_access_tenant(tenant_id):
+                raise PermissionDenied("Not allowed for this tenant")
+            queryset = queryset.for_tenant(tenant_id)
+        scope = tenant_id or principal.tenant_id or "all"
+
+        response = StreamingHttpResponse(
+            streaming_content(request, stream(spec, queryset, fmt)),
+            content_type=CONTENT_TYPES[fmt],
+        )
+        response["Content-Disposition"] = f'attachment; filename="{kind}-{scope}.{fmt}"'
+        return response
@@ -0,0 +1,112 @@
+"""
+Idempotent webhook ingestion.
+
+``ingest`` records provider events in WebhookEvent with one
+``INSERT ... ON CONFLICT DO NOTHING`` per batch; the (provider, event_id)
+unique index drops replays. Only events recorded by this call are enqueued,
+in jobs of ``WEBHOOK_EVENTS_PER_JOB``. A concurrent ingest of the same event
+blocks on the index until the first commits and then finds it already
+enqueued. ``process_events`` applies each event at most once; events whose
+invoice no longer exists (deleted, or in a detached partition) are marked
+processed without effect, so they cannot fail the rest of their job.
+"""
+import logging
+from typing import List, NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from analytics import rollups
+from jobs.queue import enqueue, handler
+from .models import Invoice, InvoiceStatus, Payment, PaymentStatus, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class IngestResult(NamedTuple):
+    accepted: List[str]
+    duplicates: List[str]
+    jobs: List[int]
+
+
+def ingest(events, provider="mock") -> IngestResult:
+    """Records ``events`` (dicts with event_id, type, invoice_id, amount_cents) and enqueues the new ones."""
+    unique = {}
+    for event in events:
+        unique.setdefault(event["event_id"], event)
+
+    with transaction.atomic():
+        WebhookEvent.objects.bulk_create(
+            [WebhookEvent(provider=provider, **event) for event in unique.values()],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        fresh = list(
+            WebhookEvent.objects.select_for_update()
+            .filter(provider=provider, event_id__in=list(unique), enqueued_at__isnull=True)
+            .order_by("pk")
+            .values_list("pk", "event_id")
+        )
+        per_job = getattr(settings, "WEBHOOK_EVENTS_PER_JOB", 100)
+        pks = [pk for pk, _ in fresh]
+        jobs = [
+            enqueue("billing.webhook_events", {"events": pks[i:i + per_job]}).pk
+            for i in range(0, len(pks), per_job)
+        ]
+        WebhookEvent.objects.filter(pk__in=pks).update(enqueued_at=timezone.now())
+
+    accepted = [event_id for _, event_id in fresh]
+    new, seen, duplicates = set(accepted), set(), []
+    for event in events:
+        # Replays, and repeats of an event within this batch
+        if event["event_id"] not in new or event["event_id"] in seen:
+            duplicates.append(event["event_id"])
+        seen.add(event["event_id"])
+    return IngestResult(accepted, duplicates, jobs)
+
+
+@handler("billing.webhook_events")
+def process_events(payload):
+    """Applies recorded events in arrival order; events already processed are skipped."""
+    events = list(
+        WebhookEvent.objects.select_for_update()
+        .filter(pk__in=payload["events"], processed_at__isnull=True)
+        .order_by("pk")
+    )
+    if not events:
+        return
+    # Lock invoices in primary key order so concurrent jobs cannot deadlock
+    invoices = {
+        invoice.pk: invoice
+        for invoice in Invoice.objects.select_for_update()
+        .filter(pk__in={event.invoice_id for event in events})
+        .order_by("pk")
+    }
+
+    now = timezone.now()
+    payments, paid = [], {}
+    for event in events:
+        invoice = invoices.get(event.invoice_id)
+        if invoice is None:
+            logger.warning("Skipping webhook event %s: invoice %s not found", event.event_id, event.invoice_id)
+            continue
+        amount = event.amount_cents or invoice.amount_cents
+        if event.type == "payment_intent.failed":
+            payments.append(Payment(
+                invoice=invoice, tenant_id=invoice.tenant_id, amount_cents=amount, status=PaymentStatus.FAILED,
+                provider_ref="mock_webhook_failed",
+            ))
+        elif invoice.status != InvoiceStatus.PAID:
+            payments.append(Payment(
+                invoice=invoice, tenant_id=invoice.tenant_id, amount_cents=amount, status=PaymentStatus.SUCCEEDED,
+                provider_ref="mock_webhook_succeeded",
+            ))
+            invoice.status, invoice.paid_at = InvoiceStatus.PAID, now
+            paid[invoice.pk] = invoice
+
+    Payment.objects.bulk_create(payments)
+    rollups.record_payments(payments)
+    for invoice in paid.values():
+        invoice.save(update_fields=["status", "paid_at", "updated_at"])
+    WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=now)
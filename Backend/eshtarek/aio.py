@@ -0,0 +1,172 @@
+"""
+Async read endpoints.
+
+``AsyncReadView`` serves a GET of an existing DRF view (an APIView, or one
+action of a ViewSet) from a coroutine, so under ASGI a slow client or a slow
+query parks a coroutine instead of a worker thread:
+
+1. the caller is resolved with ``aget_principal`` (token denylist through
+   the async cache API, user lookups through ``sync_to_async``);
+2. DRF's own pipeline runs on the wrapped view: authentication (now served
+   from the per-request cache), permission classes, content negotiation and
+   exception handling; all of it is CPU work once the caller is known;
+3. the subclass' ``handle`` coroutine reads the data with the async ORM
+   (``aget``, ``async for``) and returns a DRF ``Response``;
+4. JSON is rendered in place; other renderers (the browsable API may query
+   the database for its forms) render in the request's database thread.
+
+``AsyncListView`` implements ``handle`` for the list action of the existing
+viewsets, reusing their ``get_queryset``, serializers, pagination and
+FastListMixin path. ``read_async`` routes GET/HEAD of a URL to such a view
+and every other method to the regular sync view.
+
+The views opt out of ``ATOMIC_REQUESTS`` (Django refuses it for async views);
+reads need no transaction. ``eshtarek.async_urls`` mounts them in front of
+the regular API when ``ASYNC_READ_VIEWS`` is enabled.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from accounts.authentication import aget_principal
+from .fastjson import FastListMixin
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class AsyncReadView:
+    view_class = None
+    # ViewSet action served, e.g. 'list'; None for APIViews
+    action = None
+    # Attributes the router would give the view
+    view_initkwargs = {}
+
+    def __init__(self, **initkwargs):
+        for key, value in initkwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            return await cls(**initkwargs).dispatch(request, *args, **kwargs)
+
+        view.view_class = cls
+        return csrf_exempt(transaction.non_atomic_requests(view))
+
+    def get_view(self):
+        view = self.view_class(**self.view_initkwargs)
+        if self.action is not None:
+            view.action_map = {'get': self.action, 'head': self.action}
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        await aget_principal(request)
+        view = self.get_view()
+        view.args, view.kwargs = args, kwargs
+        drf_request = view.initialize_request(request, *args, **kwargs)
+        view.request = drf_request
+        view.headers = view.default_response_headers
+        try:
+            if request.method not in READ_METHODS:
+                view.http_method_not_allowed(drf_request)
+            view.initial(drf_request, *args, **kwargs)
+            response = await self.handle(view, drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        response = view.finalize_response(drf_request, response, *args, **kwargs)
+        return await render(response)
+
+    async def handle(self, view, request, *args, **kwargs):
+        raise NotImplementedError
+
+
+async def render(response):
+    """Renders a DRF Response into a plain HttpResponse."""
+    if isinstance(getattr(response, 'accepted_renderer', None), JSONRenderer):
+        response.render()
+    else:
+        await sync_to_async(response.render)()
+    rendered = HttpResponse(response.content, status=response.status_code)
+    for name, value in response.items():
+        rendered[name] = value
+    return rendered
+
+
+_EXHAUSTED = object()
+
+
+def streaming_content(request, iterator):
+    """
+    ``iterator`` as the content of a StreamingHttpResponse for ``request``.
+
+    Under ASGI Django would collect a sync iterator into a list before sending
+    it; there it is advanced chunk by chunk in the request's database thread
+    instead, so it still streams and any open cursor stays on its connection.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return _aiterate(iterator)
+    return iterator
+
+
+async def _aiterate(iterator):
+    advance = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await advance(iterator, _EXHAUSTED)) is not _EXHAUSTED:
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+class AsyncListView(AsyncReadView):
+    """The ``list`` action of ``view_class`` with the page fetched through the async ORM."""
+
+    action = 'list'
+    view_initkwargs = {'basename': None, 'detail': False, 'suffix': 'List'}
+
+    async def handle(self, view, request, *args, **kwargs):
+        source = view.fast_list_source(request) if isinstance(view, FastListMixin) else None
+        if source is not None:
+            queryset, row_serializer = source
+            rows = await self.fetch(view, queryset, request)
+            return view.fast_list_response(row_serializer.rows(rows), view.paginator is not None)
+
+        rows = await self.fetch(view, view.filter_queryset(view.get_queryset()), request)
+        data = view.get_serializer(rows, many=True).data
+        if view.paginator is not None:
+            return view.get_paginated_response(data)
+        return Response(data)
+
+    @staticmethod
+    async def fetch(view, queryset, request):
+        paginator = view.paginator
+        if paginator is None:
+            return [row async for row in queryset]
+        if hasattr(paginator, 'apaginate_queryset'):
+            return await paginator.apaginate_queryset(queryset, request, view=view)
+        return await sync_to_async(paginator.paginate_queryset)(queryset, request, view=view)
+
+
+def _atomic_requests(view):
+    """``view`` wrapped in the transactions ATOMIC_REQUESTS would give it."""
+    non_atomic = getattr(view, '_non_atomic_requests', set())
+    for alias, settings_dict in connections.settings.items():
+        if settings_dict.get('ATOMIC_REQUESTS') and alias not in non_atomic:
+            view = transaction.atomic(using=alias)(view)
+    return view
+
+
+def read_async(async_view, sync_view):
+    """One URL served by ``async_view`` for GET/HEAD and by ``sync_view`` otherwise."""
+    run_sync = sync_to_async(_atomic_requests(sync_view))
+
+    async def view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await async_view(request, *args, **kwargs)
+        return await run_sync(request, *args, **kwargs)
+
+    return csrf_exempt(transaction.non_atomic_requests(view))
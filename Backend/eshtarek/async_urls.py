@@ -0,0 +1,32 @@
+"""
+URL configuration with the async read endpoints (ASYNC_READ_VIEWS=True).
+
+GET/HEAD of the routes below are served by the coroutine views of
+``eshtarek.aio``; other methods on them, and every other URL, go to the
+regular views of ``eshtarek.urls``.
+"""
+from django.urls import path
+
+from accounts.views import AsyncMeView
+from billing.views import AsyncInvoiceListView, InvoiceViewSet
+from plans.views import AsyncPlanListView, PlanViewSet
+from subscriptions.views import AsyncSubscriptionListView, SubscriptionViewSet
+from .aio import read_async
+from .urls import urlpatterns as sync_urlpatterns
+
+
+def _list_route(async_view_class, viewset, basename):
+    initkwargs = {'basename': basename, 'detail': False, 'suffix': 'List'}
+    return read_async(
+        async_view_class.as_view(view_initkwargs=initkwargs),
+        viewset.as_view({'get': 'list', 'post': 'create'}, **initkwargs),
+    )
+
+
+urlpatterns = [
+    path('api/accounts/me/', AsyncMeView.as_view(), name='me'),
+    path('api/plans/', _list_route(AsyncPlanListView, PlanViewSet, 'plan'), name='plan-list'),
+    path('api/subscriptions/', _list_route(AsyncSubscriptionListView, SubscriptionViewSet, 'subscription'),
+         name='subscription-list'),
+    path('api/billing/', _list_route(AsyncInvoiceListView, InvoiceViewSet, 'invoice'), name='invoice-list'),
+] + sync_urlpatterns
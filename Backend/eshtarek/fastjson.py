@@ -0,0 +1,230 @@
+"""
+Opt-in high-throughput list rendering.
+
+``FastListMixin.list`` fetches rows with ``.values()`` and turns them into
+response dicts with one precomputed converter per column, skipping
+ModelSerializer's per-field dispatch, then encodes the whole page at once
+(with ``orjson`` when installed). The output is byte-for-byte what
+``JSONRenderer`` produces for the regular serializer: payloads orjson would
+encode differently (floats, which it writes as ``1e16`` where ``json`` writes
+``1e+16``) or rejects (integers beyond 64 bits, non-string keys) go through
+``json`` instead. Serializers with fields
+the fast path cannot reproduce (nested serializers, method fields, dotted
+sources, custom formats) transparently fall back to the regular path.
+
+Enabled with ``FAST_JSON_LISTS = True``; only used when the client negotiated
+compact JSON.
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import UUIDField
+from django.utils import timezone
+from rest_framework import relations, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class RawJSON:
+    """Already-encoded JSON body, passed through by FastJSONRenderer."""
+
+    __slots__ = ('content',)
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that emits RawJSON bodies untouched."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, RawJSON):
+            return data.content
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+def _has_float(data) -> bool:
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            return True
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def _orjson_dumps(data):
+    """orjson's encoding of ``data`` when it matches ``json``'s, else None."""
+    if orjson is None or _has_float(data):
+        return None
+    try:
+        return orjson.dumps(data)
+    except orjson.JSONEncodeError:
+        return None
+
+
+def dumps(data) -> bytes:
+    """Encodes JSON-native data exactly like JSONRenderer in compact, strict, unicode mode."""
+    content = _orjson_dumps(data)
+    if content is None:
+        content = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class Unsupported(Exception):
+    """The serializer has a field the fast path cannot reproduce."""
+
+
+def _plain(value):
+    return value
+
+
+def _uuid(value):
+    return str(value)
+
+
+# Serializer fields whose to_representation is the identity for values()
+# output of the matching model column.
+_PLAIN_FIELDS = (
+    serializers.CharField, serializers.ChoiceField, serializers.IntegerField,
+    serializers.BooleanField,
+)
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != 'iso-8601':
+        raise Unsupported(field)
+    use_tz = settings.USE_TZ
+
+    def convert(value):
+        if use_tz:
+            value = value.astimezone(timezone.get_current_timezone())
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _column_for(model, field):
+    """Returns (values() key, converter) for one serializer field."""
+    if field.source == '*' or '.' in field.source:
+        raise Unsupported(field)
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise Unsupported(field)
+    if not model_field.concrete or model_field.many_to_many:
+        raise Unsupported(field)
+    key = model_field.attname
+
+    if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+        target = model_field.target_field
+        return key, _uuid if isinstance(target, UUIDField) else _plain
+    if isinstance(field, serializers.UUIDField) and field.uuid_format == 'hex_verbose':
+        return key, _uuid
+    if isinstance(field, serializers.DateTimeField):
+        return key, _datetime_converter(field)
+    if isinstance(field, serializers.JSONField) and not field.binary:
+        return key, _plain
+    if isinstance(field, _PLAIN_FIELDS):
+        return key, _plain
+    raise Unsupported(field)
+
+
+class ValuesRowSerializer:
+    """Builds response rows from ``.values()`` dicts for a ModelSerializer's readable fields."""
+
+    def __init__(self, serializer):
+        model = serializer.Meta.model
+        columns = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            key, convert = _column_for(model, field)
+            columns.append((name, key, None if convert is _plain else convert))
+        self.columns = tuple(columns)
+        self.value_keys = tuple(key for _, key, _ in columns)
+
+    def rows(self, values):
+        columns = self.columns
+        out = []
+        for row in values:
+            item = {}
+            for name, key, convert in columns:
+                value = row[key]
+                item[name] = value if convert is None or value is None else convert(value)
+            out.append(item)
+        return out
+
+
+_row_serializers = {}
+
+
+def row_serializer_for(serializer):
+    """ValuesRowSerializer for a serializer instance, or None when unsupported; cached per field set."""
+    cache_key = (type(serializer), tuple(serializer.fields))
+    try:
+        return _row_serializers[cache_key]
+    except KeyError:
+        pass
+    try:
+        row_serializer = ValuesRowSerializer(serializer)
+    except Unsupported:
+        row_serializer = None
+    _row_serializers[cache_key] = row_serializer
+    return row_serializer
+
+
+def accepts_compact_json(request) -> bool:
+    """True when the negotiated response is FastJSONRenderer's compact, strict, unicode output."""
+    if not (api_settings.COMPACT_JSON and api_settings.UNICODE_JSON and api_settings.STRICT_JSON):
+        return False
+    renderer = getattr(request, 'accepted_renderer', None)
+    if not isinstance(renderer, FastJSONRenderer):
+        return False
+    return renderer.get_indent(request.accepted_media_type, {}) is None
+
+
+class FastListMixin:
+    """ViewSet mixin serving ``list`` through ValuesRowSerializer when enabled."""
+
+    def use_fast_list(self, request):
+        return getattr(settings, 'FAST_JSON_LISTS', False) and accepts_compact_json(request)
+
+    def fast_list_source(self, request):
+        """(``.values()`` queryset, row serializer) for the fast path, or None to use the serializer."""
+        if not self.use_fast_list(request):
+            return None
+        row_serializer = row_serializer_for(self.get_serializer())
+        if row_serializer is None:
+            return None
+        keys = set(row_serializer.value_keys)
+        keys.update(name.lstrip('-') for name in getattr(self, 'cursor_ordering', ()))
+        return self.filter_queryset(self.get_queryset()).values(*keys), row_serializer
+
+    def fast_list_response(self, rows, paginated):
+        if paginated:
+            return Response(RawJSON(dumps(self.get_paginated_response(rows).data)))
+        return Response(RawJSON(dumps(rows)))
+
+    def list(self, request, *args, **kwargs):
+        source = self.fast_list_source(request)
+        if source is None:
+            return super().list(request, *args, **kwargs)
+        queryset, row_serializer = source
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.fast_list_response(row_serializer.rows(page), True)
+        return self.fast_list_response(row_serializer.rows(queryset), False)
@@ -0,0 +1,69 @@
+"""
+Shared cache entries that a read racing a write cannot leave stale.
+
+Deleting a cached value when a write commits leaves a race: a reader misses
+the cache and loads the old rows, the writer commits and deletes the key,
+then the reader stores the old rows, which are served until they expire.
+
+Here a value is stored as ``(generation, value)`` beside a generation key,
+and writers replace the generation (``bump``) rather than delete the value:
+immediately, for reads later in their own transaction, and again on commit.
+``lookup`` reads the value and the generation in one round trip and only
+returns a value stored under the current generation. A reader stores what it
+loaded under the generation it read before loading, so rows read before a
+commit end up under a generation the commit has replaced. Generations are
+random tokens, so one recreated after an eviction never matches an old value.
+"""
+import uuid
+from typing import Any, Iterable, Tuple
+
+from django.core.cache import cache
+
+# ``lookup`` result when no current value is cached
+MISSING = object()
+
+
+def _new_generation() -> str:
+    return uuid.uuid4().hex
+
+
+def _current(found: dict, key: str, generation) -> Any:
+    entry = found.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    return MISSING
+
+
+def lookup(key: str, generation_key: str) -> Tuple[str, Any]:
+    """(current generation, the value of ``key`` stored under it or MISSING)."""
+    found = cache.get_many([key, generation_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        # First use, or evicted; a concurrent first use may win the add
+        cache.add(generation_key, _new_generation(), timeout=None)
+        return cache.get(generation_key), MISSING
+    return generation, _current(found, key, generation)
+
+
+async def alookup(key: str, generation_key: str) -> Tuple[str, Any]:
+    """``lookup`` through the async cache API."""
+    found = await cache.aget_many([key, generation_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        await cache.aadd(generation_key, _new_generation(), timeout=None)
+        return await cache.aget(generation_key), MISSING
+    return generation, _current(found, key, generation)
+
+
+def store(key: str, generation: str, value, timeout) -> None:
+    """Caches ``value``, loaded after ``generation`` was read by ``lookup``."""
+    cache.set(key, (generation, value), timeout=timeout)
+
+
+async def astore(key: str, generation: str, value, timeout) -> None:
+    await cache.aset(key, (generation, value), timeout=timeout)
+
+
+def bump(generation_keys: Iterable[str]) -> None:
+    """Makes every value cached under ``generation_keys`` stale."""
+    cache.set_many({key: _new_generation() for key in generation_keys}, timeout=None)
@@ -0,0 +1,144 @@
+"""
+Idempotency-Key handling for every mutating endpoint.
+
+The first response to an authenticated POST/PUT/PATCH/DELETE carrying an
+``Idempotency-Key`` header is stored (status, headers, body) per
+(principal, method, path, key) in the ``idempotency`` cache for
+``IDEMPOTENCY_TTL`` seconds. Retries get the stored response back, marked
+``Idempotent-Replayed: true``, without running authentication, the view or
+any query. Eviction is the cache's own: entry culling for the in-process
+cache, or the server's maxmemory policy for Redis.
+
+- Reusing a key for a different request body answers 422.
+- A retry that arrives while the first request is still running answers 409.
+- 5xx responses are not stored, so the client can retry them.
+
+Under ASGI the store is used through the cache's async API.
+"""
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+from accounts.authentication import aget_principal, get_principal
+
+HEADER = 'Idempotency-Key'
+REPLAY_HEADER = 'Idempotent-Replayed'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Per-request headers that must not be replayed
+SKIP_HEADERS = {'set-cookie', 'date', 'vary'}
+
+
+def _store():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+
+def cache_key(principal, request, key):
+    scope = '\n'.join((str(principal.user_id), request.method, request.path, key))
+    return 'idem:' + hashlib.sha256(scope.encode()).hexdigest()
+
+
+class IdempotencyMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = request.headers.get(HEADER)
+        if not key or request.method not in UNSAFE_METHODS:
+            return self.get_response(request)
+        principal = get_principal(request)
+        if not principal.is_authenticated:
+            return self.get_response(request)
+
+        store = _store()
+        record_key = cache_key(principal, request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        record = store.get(record_key)
+        if record is not None:
+            return self.replay(record, fingerprint)
+
+        lock_key = record_key + ':lock'
+        if not store.add(lock_key, 1, timeout=self.lock_timeout()):
+            return self.in_progress()
+        try:
+            response = self.get_response(request)
+            if self.storable(response):
+                store.set(record_key, self.record(response, fingerprint), timeout=self.ttl())
+        finally:
+            store.delete(lock_key)
+        return response
+
+    async def __acall__(self, request):
+        key = request.headers.get(HEADER)
+        if not key or request.method not in UNSAFE_METHODS:
+            return await self.get_response(request)
+        principal = await aget_principal(request)
+        if not principal.is_authenticated:
+            return await self.get_response(request)
+
+        store = _store()
+        record_key = cache_key(principal, request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        record = await store.aget(record_key)
+        if record is not None:
+            return self.replay(record, fingerprint)
+
+        lock_key = record_key + ':lock'
+        if not await store.aadd(lock_key, 1, timeout=self.lock_timeout()):
+            return self.in_progress()
+        try:
+            response = await self.get_response(request)
+            if self.storable(response):
+                await store.aset(record_key, self.record(response, fingerprint), timeout=self.ttl())
+        finally:
+            await store.adelete(lock_key)
+        return response
+
+    @staticmethod
+    def lock_timeout():
+        return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'IDEMPOTENCY_TTL', 86400)
+
+    @staticmethod
+    def in_progress():
+        return JsonResponse({'detail': 'A request with this Idempotency-Key is still in progress.'}, status=409)
+
+    @staticmethod
+    def record(response, fingerprint):
+        return {
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'headers': [(name, value) for name, value in response.items() if name.lower() not in SKIP_HEADERS],
+            'body': response.content,
+        }
+
+    @staticmethod
+    def storable(response):
+        if response.status_code >= 500 or response.streaming:
+            return False
+        return len(response.content) <= getattr(settings, 'IDEMPOTENCY_MAX_BODY', 256 * 1024)
+
+    @staticmethod
+    def replay(record, fingerprint):
+        if record['fingerprint'] != fingerprint:
+            return JsonResponse(
+                {'detail': 'Idempotency-Key was already used with a different request.'}, status=422,
+            )
+        response = HttpResponse(record['body'], status=record['status'])
+        for name, value in record['headers']:
+            response[name] = value
+        response[REPLAY_HEADER] = 'true'
+        return response
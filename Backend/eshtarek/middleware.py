@@ -1,13 +1,15 @@
+import logging
 from typing import Optional
+
+from asgiref.sync import sync_to_async
 from django.db import connection
+from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
-from django.contrib.auth.models import AnonymousUser
 
-try:
-    from accounts.models import UserRole  # type: ignore
-except Exception:  # pragma: no cover
-    class UserRole:
-        ADMIN = "ADMIN"
+from accounts.authentication import aget_principal, get_principal
+from .tenant_context import apply_tenant_context, discard_connection
+
+logger = logging.getLogger(__name__)
 
 
 class TenantContextMiddleware(MiddlewareMixin):
@@ -16,42 +18,52 @@ class TenantContextMiddleware(MiddlewareMixin):
       - app.tenant_id: UUID of the authenticated user's tenant
       - app.admin: 'true' when platform admin; 'false' otherwise
 
+    Both values are applied in one statement and skipped entirely when the
+    connection already carries them. With DB_POOL=pgbouncer they are set at
+    the start of each of the request's transactions instead (see
+    eshtarek.tenant_context).
+
     Works only on PostgreSQL. On other DBs, does nothing.
-    """
 
-    @staticmethod
-    def _set_pg_setting(key: str, value: Optional[str]) -> None:
-        try:
-            with connection.cursor() as cursor:
-                if value is None:
-                    cursor.execute("SELECT set_config(%s, '', true)", [key])
-                else:
-                    cursor.execute("SELECT set_config(%s, %s, true)", [key, value])
-        except Exception:
-            # Non-Postgres or connection not ready; ignore silently.
-            pass
+    Fails closed: when the context cannot be applied, the connection (which
+    may still carry the previous request's context) is closed and the
+    request answers 503 without reaching the view.
+
+    Under ASGI the caller is resolved without blocking the event loop and the
+    settings are written from the request's database thread, the one its
+    async ORM queries run in.
+    """
 
     def process_request(self, request):
-        user = getattr(request, 'user', AnonymousUser())
+        # Decodes the bearer token here (cached for DRF's authenticator) so the
+        # context reflects API callers, not just session users.
+        principal = get_principal(request)
+        tenant_id_val: Optional[str] = principal.tenant_id
+        is_admin = principal.is_platform_admin
 
-        tenant_id_val: Optional[str] = None
-        is_admin = False
+        # Set or clear per-request PG settings
+        try:
+            apply_tenant_context(tenant_id_val, is_admin)
+        except Exception:
+            logger.exception('Could not apply the tenant context; closing the connection')
+            return self.unavailable()
+        return None
 
-        if getattr(user, 'is_authenticated', False):
-            profile = getattr(user, 'profile', None)
-            if profile and getattr(profile, 'tenant_id', None):
-                tenant_id_val = str(profile.tenant_id)
-            # Platform admin detection: role ADMIN or Django superuser
+    async def __acall__(self, request):
+        principal = await aget_principal(request)
+        if connection.vendor == 'postgresql':
             try:
-                if profile and getattr(profile, 'role', None) == getattr(UserRole, 'ADMIN', 'ADMIN'):
-                    is_admin = True
+                await sync_to_async(apply_tenant_context)(principal.tenant_id, principal.is_platform_admin)
             except Exception:
-                pass
-            if getattr(user, 'is_superuser', False):
-                is_admin = True
-
-        # Set or clear per-request PG settings
-        self._set_pg_setting('app.tenant_id', tenant_id_val)
-        self._set_pg_setting('app.admin', 'true' if is_admin else 'false')
+                logger.exception('Could not apply the tenant context; closing the connection')
+                # From the request's database thread, which owns the connection
+                return await sync_to_async(self.unavailable)()
+        return await self.get_response(request)
 
-        return None
+    @staticmethod
+    def unavailable():
+        try:
+            discard_connection()
+        except Exception:
+            logger.exception('Could not close the connection')
+        return JsonResponse({'detail': 'Database unavailable, please retry.'}, status=503)
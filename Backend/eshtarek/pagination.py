@@ -0,0 +1,162 @@
+import base64
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from uuid import UUID
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a composite, unique ordering.
+
+    The view declares ``cursor_ordering``, e.g. ``('-issued_at', '-id')``; the
+    last field must be unique. The cursor is the position of the page edge and
+    the next page is fetched with a range predicate on those columns, so it is
+    served by the matching composite index at any depth instead of an OFFSET
+    scan. Responses look like DRF's CursorPagination:
+    ``{"next": url, "previous": url, "results": [...]}``.
+    """
+
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, reverse, position = self._page_queryset(queryset, request, view)
+        return self._page(list(queryset), reverse, position)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` fetching the page through the async ORM."""
+        queryset, reverse, position = self._page_queryset(queryset, request, view)
+        return self._page([row async for row in queryset], reverse, position)
+
+    def _page_queryset(self, queryset, request, view):
+        self.request = request
+        self.ordering = tuple(view.cursor_ordering)
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self._reversed(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            # The cursor's values are only checked against the columns here
+            try:
+                queryset = queryset.filter(self._seek(ordering, position))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1], reverse, position
+
+    def _page(self, rows, reverse, position):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = payload['p'], bool(payload.get('r'))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('ascii'))
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def _position(self, item):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = item[name] if isinstance(item, dict) else getattr(item, name)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, UUID):
+                value = str(value)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def _seek(ordering, position):
+        """
+        Rows strictly after ``position`` in ``ordering``.
+
+        Expands the row comparison into OR-ed prefixes and ANDs it with a range
+        bound on the leading column so the planner can start an index scan there.
+        """
+        bounds = []
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            bounds.append((name, 'lt' if field.startswith('-') else 'gt', value))
+
+        after = Q()
+        for i, (name, op, value) in enumerate(bounds):
+            prefix = Q(**{bounds[j][0]: bounds[j][2] for j in range(i)})
+            after |= prefix & Q(**{f'{name}__{op}': value})
+
+        lead_name, lead_op, lead_value = bounds[0]
+        return Q(**{f'{lead_name}__{lead_op}e': lead_value}) & after
@@ -0,0 +1,194 @@
+"""
+Row-level security for tenant-owned tables (PostgreSQL only).
+
+Every tenant-owned table gets the same two permissive policies, generated by
+``policy_statements`` and installed by the ``TenantRowLevelSecurity``
+migration operation:
+
+- ``<table>_tenant_isolation``: the rows of the connection's tenant,
+  ``tenant_id = (SELECT NULLIF(current_setting('app.tenant_id', true), '')::uuid)``.
+  The sub-select is an InitPlan, evaluated once per statement rather than
+  once per row, and the column is compared with its result as with a
+  query parameter. NULLIF makes an unset or empty tenant (anonymous
+  requests, see eshtarek.tenant_context) match nothing instead of failing
+  the uuid cast.
+- ``<table>_platform_admin``: every row when ``app.admin`` is ``'true'``,
+  also evaluated once per statement.
+
+PostgreSQL ORs permissive policies into one filter, ``tenant_id = $1 OR
+$2``. Application queries carry their own ``tenant_id = ...``
+(TenantScopedQuerySet), and the planner uses that as the index condition.
+The policy then costs one comparison per row against values computed once.
+The previous form, ``current_setting(...) = 'true' OR tenant_id =
+current_setting(...)::uuid``, called current_setting and cast the setting
+for every row it checked. ``python -m benchmarks.rls`` measures both.
+
+Both apply to reads (USING) and writes (WITH CHECK). Tables that identify
+users (accounts_userprofile) also get ``<table>_own_identity``, read-only:
+the rows of ``app.user_id``, set by ``tenant_context.user_identity`` while a
+caller's own profile is looked up, before their tenant is known (login,
+token refresh, database-backed authentication). Partitions of a
+partitioned table get RLS enabled too, so they cannot be read around the
+parent's policies (billing.partitions does the same for partitions it
+creates).
+
+Policies bind roles other than the table owner. Run the application as a
+role that does not own the tables (and lacks BYPASSRLS) for them to apply,
+as docker-compose does; migrations and maintenance commands keep running as
+the owner. ``ensure_app_role`` (``manage.py ensure_app_role``, run by the
+owner after migrating) creates such a role when missing and grants it the
+data privileges on the owner's tables, present and future. Under such a role every query needs a
+defined context: anonymous registration acts as the tenant it registers
+into (accounts.views.RegisterView), and identity lookups use
+``user_identity``. ``eshtarek.testing.NonOwnerRoleMixin`` runs tests that way.
+"""
+from typing import List, Optional
+
+from django.db import migrations
+
+TENANT_PREDICATE = "{column} = (SELECT NULLIF(current_setting('app.tenant_id', true), '')::uuid)"
+ADMIN_PREDICATE = "(SELECT current_setting('app.admin', true)) = 'true'"
+IDENTITY_PREDICATE = "{column} = (SELECT NULLIF(current_setting('app.user_id', true), '')::bigint)"
+
+
+def _partitions(cursor, table: str) -> List[str]:
+    cursor.execute(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s)", [table],
+    )
+    return [name for name, in cursor.fetchall()]
+
+
+def policy_statements(table: str, column: str, quote_name, identity_column: Optional[str] = None) -> List[str]:
+    """
+    The SQL enabling RLS on ``table`` with the tenant and platform admin
+    policies, and the own identity policy on ``identity_column`` if given.
+    """
+    qn = quote_name
+    tenant = TENANT_PREDICATE.format(column=qn(column))
+    statements = [
+        f"ALTER TABLE {qn(table)} ENABLE ROW LEVEL SECURITY",
+        f"CREATE POLICY {qn(table + '_tenant_isolation')} ON {qn(table)} USING ({tenant}) WITH CHECK ({tenant})",
+        f"CREATE POLICY {qn(table + '_platform_admin')} ON {qn(table)} "
+        f"USING ({ADMIN_PREDICATE}) WITH CHECK ({ADMIN_PREDICATE})",
+    ]
+    if identity_column:
+        identity = IDENTITY_PREDICATE.format(column=qn(identity_column))
+        statements.append(
+            f"CREATE POLICY {qn(table + '_own_identity')} ON {qn(table)} FOR SELECT USING ({identity})"
+        )
+    return statements
+
+
+def drop_policies(cursor, table: str) -> None:
+    """Drops every policy on ``table``, generated or not."""
+    qn = cursor.db.ops.quote_name
+    cursor.execute(
+        "SELECT policyname FROM pg_policies WHERE schemaname = current_schema() AND tablename = %s", [table],
+    )
+    for name, in cursor.fetchall():
+        cursor.execute(f"DROP POLICY {qn(name)} ON {qn(table)}")
+
+
+def enable_tenant_rls(cursor, table: str, column: str = "tenant_id", identity_column: Optional[str] = None) -> None:
+    """Replaces the policies of ``table`` with the generated ones."""
+    qn = cursor.db.ops.quote_name
+    drop_policies(cursor, table)
+    for sql in policy_statements(table, column, qn, identity_column):
+        cursor.execute(sql)
+    for partition in _partitions(cursor, table):
+        cursor.execute(f"ALTER TABLE {partition} ENABLE ROW LEVEL SECURITY")
+
+
+def disable_tenant_rls(cursor, table: str) -> None:
+    qn = cursor.db.ops.quote_name
+    drop_policies(cursor, table)
+    cursor.execute(f"ALTER TABLE {qn(table)} DISABLE ROW LEVEL SECURITY")
+    for partition in _partitions(cursor, table):
+        cursor.execute(f"ALTER TABLE {partition} DISABLE ROW LEVEL SECURITY")
+
+
+def ensure_app_role(cursor, role: str, password: str = "") -> bool:
+    """
+    Creates ``role`` (login, ``password``, no BYPASSRLS) unless it exists,
+    then grants it read and write access to the current schema's tables and
+    sequences, including those the current user creates later. Returns
+    whether the role was created. Raises ValueError for a role the policies
+    would not apply to.
+    """
+    qn = cursor.db.ops.quote_name
+    cursor.execute("SELECT current_database(), current_schema(), current_user")
+    database, schema, owner = cursor.fetchone()
+    if role == owner:
+        raise ValueError(f"{role} owns the tables; RLS policies do not apply to it")
+    cursor.execute("SELECT rolsuper OR rolbypassrls FROM pg_roles WHERE rolname = %s", [role])
+    row = cursor.fetchone()
+    if row and row[0]:
+        raise ValueError(f"{role} bypasses RLS")
+    if row is None:
+        cursor.execute(
+            f"CREATE ROLE {qn(role)} LOGIN PASSWORD %s NOSUPERUSER NOCREATEDB NOCREATEROLE NOBYPASSRLS",
+            [password or None],
+        )
+    role, schema = qn(role), qn(schema)
+    cursor.execute(f"GRANT CONNECT ON DATABASE {qn(database)} TO {role}")
+    cursor.execute(f"GRANT USAGE ON SCHEMA {schema} TO {role}")
+    cursor.execute(f"GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA {schema} TO {role}")
+    cursor.execute(f"GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA {schema} TO {role}")
+    # Tables and sequences migrations and partition_billing create later
+    cursor.execute(
+        f"ALTER DEFAULT PRIVILEGES FOR ROLE {qn(owner)} IN SCHEMA {schema} "
+        f"GRANT SELECT, INSERT, UPDATE, DELETE ON TABLES TO {role}"
+    )
+    cursor.execute(
+        f"ALTER DEFAULT PRIVILEGES FOR ROLE {qn(owner)} IN SCHEMA {schema} GRANT USAGE, SELECT ON SEQUENCES TO {role}"
+    )
+    return row is None
+
+
+class TenantRowLevelSecurity(migrations.operations.base.Operation):
+    """
+    Migration operation installing the tenant policies on a model's table,
+    by the column of its ``tenant`` field. Reversing it drops the policies
+    and disables RLS. No-op on other databases.
+    """
+
+    reversible = True
+    reduces_to_sql = False
+
+    def __init__(self, model_name: str, field_name: str = "tenant"):
+        self.model_name = model_name
+        self.field_name = field_name
+
+    def deconstruct(self):
+        kwargs = {"model_name": self.model_name}
+        if self.field_name != "tenant":
+            kwargs["field_name"] = self.field_name
+        return self.__class__.__qualname__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _table(self, app_label, state):
+        model = state.apps.get_model(app_label, self.model_name)
+        return model._meta.db_table, model._meta.get_field(self.field_name).column
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        table, column = self._table(app_label, to_state)
+        with schema_editor.connection.cursor() as cursor:
+            enable_tenant_rls(cursor, table, column)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        table, _ = self._table(app_label, from_state)
+        with schema_editor.connection.cursor() as cursor:
+            disable_tenant_rls(cursor, table)
+
+    def describe(self):
+        return f"Tenant row-level security on {self.model_name}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"{self.model_name.lower()}_rls"
@@ -0,0 +1,117 @@
+"""
+Process and thread sizing for the production server (see gunicorn.conf.py).
+
+``SERVER_MODE`` picks the interface:
+
+- ``wsgi`` (default): gthread workers. Each worker serves ``threads`` requests
+  at once; threads overlap database and cache waits, while extra processes
+  give CPU-bound work (password hashing, JSON rendering) more cores.
+  Defaults: ``2 * cpus + 1`` workers with 4 threads each.
+- ``asgi``: uvicorn workers running ``eshtarek.asgi``, one event loop per core
+  (the async read views of ``ASYNC_READ_VIEWS`` pay off here). ``threads``
+  caps the concurrent requests of a worker (gunicorn's ``worker_connections``);
+  the ORM work of each runs in a thread of its own. Defaults: ``cpus``
+  workers of 25 requests each.
+
+``cpus`` honours the container's CPU quota (cgroup ``cpu.max``) and CPU
+affinity, not just the host's core count. ``WEB_CONCURRENCY`` and
+``WEB_THREADS`` override the computed values.
+
+Each request in flight holds its own database connection, so a container
+can open up to ``workers * threads`` of them; keep that times the number of
+replicas under Postgres' ``max_connections``.
+
+The JWT denylist and the Idempotency-Key records live in the cache, so they
+must be shared by every worker process: ``check_shared_cache`` refuses to
+start more than one worker without ``REDIS_URL``.
+
+Kept free of Django imports: gunicorn reads it before loading the app.
+"""
+import math
+import os
+from typing import NamedTuple, Optional
+
+from decouple import config
+
+WSGI, ASGI = 'wsgi', 'asgi'
+
+APPS = {
+    WSGI: 'eshtarek.wsgi:application',
+    ASGI: 'eshtarek.asgi:application',
+}
+
+WORKER_CLASSES = {
+    WSGI: 'gthread',
+    ASGI: 'uvicorn_worker.UvicornWorker',
+}
+
+CGROUP_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+
+
+class Sizing(NamedTuple):
+    mode: str
+    cpus: int
+    workers: int
+    threads: int
+
+    @property
+    def max_db_connections(self) -> int:
+        return self.workers * self.threads
+
+
+def cgroup_cpu_limit(path: str = CGROUP_CPU_MAX) -> Optional[float]:
+    """CPUs allowed by the cgroup v2 quota (``docker --cpus``), or None when unlimited."""
+    try:
+        with open(path) as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == 'max':
+        return None
+    return int(quota) / int(period)
+
+
+def cpu_count() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+
+def mode() -> str:
+    value = config('SERVER_MODE', default=WSGI).lower()
+    if value not in APPS:
+        raise ValueError(f'SERVER_MODE must be one of {", ".join(APPS)}, not {value!r}')
+    return value
+
+
+def size(server_mode: str, cpus: int) -> Sizing:
+    if server_mode == ASGI:
+        workers, threads = cpus, 25
+    else:
+        workers, threads = 2 * cpus + 1, 4
+    return Sizing(
+        mode=server_mode,
+        cpus=cpus,
+        workers=config('WEB_CONCURRENCY', cast=int, default=workers),
+        threads=config('WEB_THREADS', cast=int, default=threads),
+    )
+
+
+def check_shared_cache(sizing: Sizing, redis_url: Optional[str] = None) -> None:
+    """
+    Raises RuntimeError for more than one worker with the per-process cache:
+    a logout or an Idempotency-Key record seen by one worker would be
+    unknown to the others.
+    """
+    if redis_url is None:
+        redis_url = config('REDIS_URL', default='')
+    if sizing.workers > 1 and not redis_url:
+        raise RuntimeError(
+            f'{sizing.workers} workers need a shared cache for the JWT denylist and idempotency '
+            f'records: set REDIS_URL, or WEB_CONCURRENCY=1.'
+        )
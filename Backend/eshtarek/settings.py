@@ -10,9 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import importlib.util
 from pathlib import Path
 from datetime import timedelta
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +53,8 @@ INSTALLED_APPS = [
     'subscriptions',
     'accounts',
     'billing',
+    'jobs',
+    'analytics',
 ]
 
 MIDDLEWARE = [
@@ -61,11 +65,14 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'eshtarek.middleware.TenantContextMiddleware',
+    'eshtarek.idempotency.IdempotencyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'eshtarek.urls'
+# Serve the main read endpoints from async views (run under an ASGI server)
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', cast=bool, default=False)
+ROOT_URLCONF = 'eshtarek.async_urls' if ASYNC_READ_VIEWS else 'eshtarek.urls'
 
 TEMPLATES = [
     {
@@ -93,6 +100,24 @@ DB_USER = config('DB_USER', default='')
 DB_PASSWORD = config('DB_PASSWORD', default='')
 DB_HOST = config('DB_HOST', default='localhost')
 DB_PORT = config('DB_PORT', default='5432')
+# Persistent connections, checked before reuse. Under ASGI (SERVER_MODE=asgi,
+# see eshtarek.server) requests do not reuse threads, so connections are
+# closed per request there unless DB_CONN_MAX_AGE says otherwise.
+SERVER_MODE = config('SERVER_MODE', default='wsgi')
+# Connection pooling (see eshtarek.tenant_context for the RLS context):
+#   ''          persistent connection per thread (DB_CONN_MAX_AGE)
+#   'psycopg'   Django's psycopg pool per process (needs psycopg[pool])
+#   'pgbouncer' PgBouncer in transaction mode between Django and Postgres
+DB_POOL = config('DB_POOL', default='')
+if DB_POOL not in ('', 'psycopg', 'pgbouncer'):
+    raise ImproperlyConfigured("DB_POOL must be empty, 'psycopg' or 'pgbouncer'")
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', cast=int, default=2)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', cast=int, default=10)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', cast=float, default=10.0)
+DB_CONN_MAX_AGE = config(
+    'DB_CONN_MAX_AGE', cast=int, default=0 if SERVER_MODE == 'asgi' or DB_POOL == 'psycopg' else 60,
+)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', cast=bool, default=True)
 
 if DB_NAME:
     DATABASES = {
@@ -104,8 +129,23 @@ if DB_NAME:
             'HOST': DB_HOST,
             'PORT': DB_PORT,
             'ATOMIC_REQUESTS': True,
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
         }
     }
+    if DB_POOL == 'psycopg':
+        from eshtarek.tenant_context import reset_pooled_connection
+
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+            # Connections go back to the pool without a tenant context
+            'reset': reset_pooled_connection,
+        }}
+    elif DB_POOL == 'pgbouncer':
+        # Named cursors cannot outlive a transaction behind PgBouncer
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
 else:
     # Fallback to SQLite for local dev if Postgres env is not provided
     DATABASES = {
@@ -117,9 +157,45 @@ else:
     }
 
 
+# Non-owner role the application connects as under RLS, created and granted
+# by manage.py ensure_app_role (run by the owner, after migrate)
+DB_APP_ROLE = config('DB_APP_ROLE', default='eshtarek_app')
+DB_APP_PASSWORD = config('DB_APP_PASSWORD', default='')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
+# Password hashing (accounts.hashers). PASSWORD_HASHER picks the algorithm for
+# new hashes; the others stay listed so existing hashes verify. A password whose
+# hash used another algorithm or cost is rehashed at its next successful login.
+# The default costs are Django's, so existing hashes are only rehashed when a
+# cost is changed here.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', cast=int, default=1_000_000)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', cast=int, default=2 ** 14)
+PASSWORD_SCRYPT_BLOCK_SIZE = config('PASSWORD_SCRYPT_BLOCK_SIZE', cast=int, default=8)
+# 0 keeps the parallelism of Django's scrypt hasher (the version installed)
+PASSWORD_SCRYPT_PARALLELISM = config('PASSWORD_SCRYPT_PARALLELISM', cast=int, default=0)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', cast=int, default=2)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', cast=int, default=102400)  # KiB
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', cast=int, default=8)
+
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'accounts.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'accounts.hashers.ScryptPasswordHasher',
+    'argon2': 'accounts.hashers.Argon2PasswordHasher',
+}
+if PASSWORD_HASHER not in _PASSWORD_HASHERS:
+    raise ImproperlyConfigured(f"PASSWORD_HASHER must be one of {', '.join(_PASSWORD_HASHERS)}")
+if PASSWORD_HASHER == 'argon2' and importlib.util.find_spec('argon2') is None:
+    raise ImproperlyConfigured("PASSWORD_HASHER=argon2 needs the argon2-cffi package")
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -161,18 +237,121 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework & JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.TenantJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'eshtarek.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# Serve list endpoints from .values() rows encoded in one pass (see eshtarek.fastjson)
+FAST_JSON_LISTS = config('FAST_JSON_LISTS', cast=bool, default=False)
+
+# Public plan catalog (plans.catalog): browser/CDN max-age and per-process reuse window, in seconds
+PLAN_CATALOG_MAX_AGE = config('PLAN_CATALOG_MAX_AGE', cast=int, default=60)
+PLAN_CATALOG_LOCAL_TTL = config('PLAN_CATALOG_LOCAL_TTL', cast=int, default=5)
+
+# Plan entitlements per tenant (subscriptions.entitlements): per-process reuse window in seconds
+ENTITLEMENTS_LOCAL_TTL = config('ENTITLEMENTS_LOCAL_TTL', cast=int, default=5)
+
+# Background job queue (jobs app): retries back off from JOBS_BACKOFF_SECONDS, doubling up to the max
+JOBS_MAX_ATTEMPTS = config('JOBS_MAX_ATTEMPTS', cast=int, default=5)
+JOBS_BACKOFF_SECONDS = config('JOBS_BACKOFF_SECONDS', cast=int, default=2)
+JOBS_BACKOFF_MAX_SECONDS = config('JOBS_BACKOFF_MAX_SECONDS', cast=int, default=300)
+JOBS_LOCK_TIMEOUT = config('JOBS_LOCK_TIMEOUT', cast=int, default=300)
+JOBS_POLL_INTERVAL = config('JOBS_POLL_INTERVAL', cast=float, default=1.0)
+JOBS_METRICS_INTERVAL = config('JOBS_METRICS_INTERVAL', cast=int, default=60)
+# Worker processes started by manage.py run_jobs (--concurrency)
+JOBS_CONCURRENCY = config('JOBS_CONCURRENCY', cast=int, default=1)
+
+# Webhook ingestion (billing.webhooks): events per batch request and per processing job
+WEBHOOK_BATCH_MAX = config('WEBHOOK_BATCH_MAX', cast=int, default=1000)
+WEBHOOK_EVENTS_PER_JOB = config('WEBHOOK_EVENTS_PER_JOB', cast=int, default=100)
+
+# Bulk user provisioning (accounts.provisioning): rows per API request, and
+# password hashing processes (0 = one per core) once a batch has POOL_MIN rows
+BULK_PROVISION_MAX_ROWS = config('BULK_PROVISION_MAX_ROWS', cast=int, default=5000)
+BULK_PROVISION_WORKERS = config('BULK_PROVISION_WORKERS', cast=int, default=0)
+BULK_PROVISION_POOL_MIN = config('BULK_PROVISION_POOL_MIN', cast=int, default=64)
+
+# Streaming exports (billing.exports): rows fetched per cursor round-trip, and
+# approximate size of each chunk sent to the client
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', cast=int, default=2000)
+EXPORT_CHUNK_BYTES = config('EXPORT_CHUNK_BYTES', cast=int, default=64 * 1024)
+
+# Monthly partitions of billing_invoice on PostgreSQL
+# (manage.py partition_billing): months created ahead of the current one, and
+# months kept attached before it (0 = all); detached months, with their
+# payments and webhook events, are moved to PARTITION_ARCHIVE_SCHEMA when set,
+# otherwise left in place
+PARTITION_MONTHS_AHEAD = config('PARTITION_MONTHS_AHEAD', cast=int, default=3)
+PARTITION_RETAIN_MONTHS = config('PARTITION_RETAIN_MONTHS', cast=int, default=0)
+PARTITION_ARCHIVE_SCHEMA = config('PARTITION_ARCHIVE_SCHEMA', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'jobs': {'handlers': ['console'], 'level': config('JOBS_LOG_LEVEL', default='INFO')},
+    },
 }
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', cast=int, default=60)),
+    # Access tokens are short-lived: they carry tenant/role claims and are
+    # revoked through the denylist in accounts.denylist.
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', cast=int, default=5)),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=config('JWT_REFRESH_DAYS', cast=int, default=7)),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'accounts.serializers.TenantTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.serializers.TenantTokenRefreshSerializer',
+    'TOKEN_USER_CLASS': 'accounts.authentication.TenantTokenUser',
 }
 
+# Serve requests from token claims without loading User/UserProfile
+JWT_STATELESS_USER = config('JWT_STATELESS_USER', cast=bool, default=True)
+
+# Cache (JWT denylist, Idempotency-Key records and other shared state). Required
+# with several worker processes, which would otherwise each keep their own copy
+# (gunicorn.conf.py refuses to start them without it).
+REDIS_URL = config('REDIS_URL', default='')
+
+# Stored Idempotency-Key responses (eshtarek.idempotency) live in their own
+# cache so they are evicted independently: least recently used keys first
+# under Redis maxmemory-policy allkeys-lru, culling past MAX_ENTRIES in memory.
+IDEMPOTENCY_CACHE = 'idempotency'
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', cast=int, default=86400)
+IDEMPOTENCY_MAX_ENTRIES = config('IDEMPOTENCY_MAX_ENTRIES', cast=int, default=10000)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        IDEMPOTENCY_CACHE: {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'idem',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        IDEMPOTENCY_CACHE: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'idempotency',
+            'OPTIONS': {'MAX_ENTRIES': IDEMPOTENCY_MAX_ENTRIES},
+        },
+    }
+
 # CORS
 CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', cast=Csv(), default='http://localhost:3000')
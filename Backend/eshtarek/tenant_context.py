@@ -0,0 +1,201 @@
+"""
+The RLS tenant context (app.tenant_id, app.admin) of database connections.
+
+How long a value lives depends on ``DB_POOL``:
+
+- ``''`` (persistent connections) and ``'psycopg'`` (Django's psycopg pool):
+  values are written at session level and remembered per DB-API connection,
+  so a connection that already carries the caller's values is not written
+  again, whichever thread or request it was last used by. Pooled connections
+  are cleared by ``reset_pooled_connection`` when they go back to the pool.
+- ``'pgbouncer'`` (PgBouncer in transaction mode): consecutive transactions
+  may run on different server connections, so a session value would leak to
+  whichever client gets that server connection next. Values are therefore
+  only ever set transaction-locally: ``apply_tenant_context`` records the
+  context on the Django connection and ``TransactionContext`` sets it at the
+  start of every transaction, giving a statement outside ``atomic`` a
+  transaction of its own.
+
+Either way every request applies its caller's context before its first query
+(TenantContextMiddleware), and a context can only outlive its request on a
+connection that nobody else uses.
+
+The caller's tenant is read from their own profile, so that read cannot wait
+for the context: ``user_identity`` sets app.user_id transaction-locally
+around it, which the ``accounts_userprofile_own_identity`` policy admits.
+"""
+import weakref
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+
+# (app.tenant_id, app.admin) as written to Postgres
+TenantContext = Tuple[str, str]
+
+# A fresh session has neither setting; current_setting(..., true) then yields
+# NULL, which the RLS policies treat exactly like an empty tenant / non-admin.
+EMPTY_CONTEXT: TenantContext = ('', 'false')
+
+_SET_CONTEXT_SQL = (
+    "SELECT set_config('app.tenant_id', %s, {local}), "
+    "set_config('app.admin', %s, {local})"
+)
+
+# Session-level context per DB-API connection, as last written by this process
+_session_contexts = weakref.WeakKeyDictionary()
+
+# PQtransactionStatus of a connection with no open transaction (psycopg 2 and 3)
+_IDLE = 0
+
+
+def build_context(tenant_id: Optional[str], is_admin: bool) -> TenantContext:
+    return (tenant_id or '', 'true' if is_admin else 'false')
+
+
+def per_transaction() -> bool:
+    """True when the context may only be set transaction-locally (DB_POOL=pgbouncer)."""
+    return getattr(settings, 'DB_POOL', '') == 'pgbouncer'
+
+
+def _in_transaction(raw) -> bool:
+    return raw is not None and raw.info.transaction_status != _IDLE
+
+
+def _execute(cursor, context: TenantContext, local: bool) -> None:
+    cursor.execute(_SET_CONTEXT_SQL.format(local='true' if local else 'false'), list(context))
+
+
+def apply_tenant_context(tenant_id: Optional[str], is_admin: bool, connection=None) -> bool:
+    """
+    Sets app.tenant_id and app.admin for RLS in a single round-trip.
+
+    Outside a transaction the values are written at session level, unless
+    the connection already carries them. Inside an atomic block they are set
+    transaction-locally and not remembered, since a rollback would revert
+    them. With DB_POOL=pgbouncer they are always transaction-local and, outside
+    a transaction, sent with the next one (see TransactionContext).
+
+    Returns True when a statement was sent to the database.
+    """
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return False
+
+    context = build_context(tenant_id, is_admin)
+    if per_transaction():
+        connection._tenant_context_target = context
+        if not _in_transaction(connection.connection):
+            return False
+        with connection.cursor() as cursor:
+            _execute(cursor, context, local=True)
+        return True
+
+    connection.ensure_connection()
+    raw = connection.connection
+
+    if connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            _execute(cursor, context, local=True)
+        return True
+
+    if _session_contexts.get(raw, EMPTY_CONTEXT) == context:
+        return False
+
+    with connection.cursor() as cursor:
+        _execute(cursor, context, local=False)
+    _session_contexts[raw] = context
+    return True
+
+
+@contextmanager
+def user_identity(user_id, connection=None):
+    """
+    Runs the enclosed queries in an atomic block with app.user_id set to
+    ``user_id``, so they see that user's own profile whatever the tenant
+    context. The value is local to the block: committing ends it, a rollback
+    reverts it, and leaving a nested block clears it. No-op on other
+    databases or without a user.
+    """
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql' or user_id is None:
+        yield
+        return
+    nested = connection.in_atomic_block
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('app.user_id', %s, true)", [str(user_id)])
+        yield
+        if nested:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('app.user_id', '', true)")
+
+
+def forget_tenant_context(connection=None) -> None:
+    """Drops the remembered context, e.g. after the session was reset externally."""
+    connection = connection or default_connection
+    if connection.connection is not None:
+        _session_contexts.pop(connection.connection, None)
+    connection._tenant_context_target = None
+
+
+def discard_connection(connection=None) -> None:
+    """
+    Closes a connection whose context could not be applied. Its session may
+    still carry the previous caller's context, so it must serve no further
+    query: the DB-API connection is closed first, so a pool discards it
+    rather than taking it back.
+    """
+    connection = connection or default_connection
+    raw = connection.connection
+    forget_tenant_context(connection)
+    try:
+        if raw is not None:
+            raw.close()
+    finally:
+        connection.close()
+
+
+def reset_pooled_connection(raw) -> None:
+    """
+    ``reset`` callback of the psycopg pool (DB_POOL=psycopg): clears the
+    context of a connection returned to the pool, so none is handed out
+    carrying the previous user's tenant.
+    """
+    if _session_contexts.get(raw, EMPTY_CONTEXT) == EMPTY_CONTEXT:
+        return
+    with raw.cursor() as cursor:
+        _execute(cursor, EMPTY_CONTEXT, local=False)
+    if not raw.autocommit:
+        raw.commit()
+    _session_contexts[raw] = EMPTY_CONTEXT
+
+
+class TransactionContext:
+    """
+    Execute wrapper for DB_POOL=pgbouncer that opens every transaction with
+    the connection's tenant context, set transaction-locally. Connections
+    with no context recorded (migrations, shell) are left alone.
+    """
+
+    def __call__(self, execute, sql, params, many, context):
+        connection = context['connection']
+        target = getattr(connection, '_tenant_context_target', None)
+        if target is None or _in_transaction(connection.connection):
+            return execute(sql, params, many, context)
+        if not connection.get_autocommit():
+            # atomic block whose transaction this statement begins
+            _execute(context['cursor'].cursor, target, local=True)
+            return execute(sql, params, many, context)
+        with transaction.atomic(using=connection.alias):
+            _execute(context['cursor'].cursor, target, local=True)
+            return execute(sql, params, many, context)
+
+
+def install_transaction_context(sender, connection, **kwargs) -> None:
+    """connection_created receiver adding TransactionContext when DB_POOL=pgbouncer."""
+    if connection.vendor != 'postgresql' or not per_transaction():
+        return
+    if not any(isinstance(wrapper, TransactionContext) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(TransactionContext())
@@ -0,0 +1,119 @@
+"""Shared helpers for the apps' test suites."""
+import json
+import os
+import re
+import unittest
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+requires_postgres = unittest.skipUnless(
+    connection.vendor == 'postgresql', 'Query plans are only checked on PostgreSQL',
+)
+
+
+# Statements that are not data access: transaction control from ATOMIC_REQUESTS
+# and the RLS context, both backend dependent.
+_OVERHEAD_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', "SELECT SET_CONFIG('APP.")
+
+
+# Server-side cursors (QuerySet.iterator on PostgreSQL) log their query as a DECLARE
+_DECLARE_CURSOR = re.compile(r'^\s*DECLARE\s.*?\sCURSOR\s(?:WITH(?:OUT)?\s+HOLD\s)?\s*FOR\s', re.IGNORECASE | re.DOTALL)
+
+
+def data_queries(captured):
+    return [
+        q['sql'] for q in captured
+        if not q['sql'].lstrip().upper().startswith(_OVERHEAD_PREFIXES)
+    ]
+
+
+class QueryBudgetMixin:
+    """``assertNumQueries`` that counts only data queries, on any backend."""
+
+    @contextmanager
+    def assertDataQueries(self, num):
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        queries = data_queries(ctx.captured_queries)
+        self.assertEqual(
+            len(queries), num,
+            '%d data queries executed, %d expected\n%s' % (len(queries), num, '\n'.join(queries)),
+        )
+
+
+def _seq_scans(plan, found):
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', ()):
+        _seq_scans(child, found)
+    return found
+
+
+class QueryPlanAssertionsMixin:
+    """
+    Runs EXPLAIN on every query an endpoint issues and fails on sequential scans.
+
+    Sequential scans are disabled for the check, so the planner only falls back
+    to one when no index can serve the access path. A small seeded table then
+    fails for the same reason a large production table would be slow. Call
+    ``analyze()`` after seeding so the statistics are current.
+    """
+
+    @staticmethod
+    def analyze(*models):
+        with connection.cursor() as cursor:
+            for model in models:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def assertNoSeqScan(self, call):
+        with CaptureQueriesContext(connection) as ctx:
+            result = call()
+
+        queries = [_DECLARE_CURSOR.sub('', sql, count=1) for sql in data_queries(ctx.captured_queries)]
+        queries = [sql for sql in queries if sql.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(queries, 'Endpoint ran no table queries')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            try:
+                for sql in queries:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    scanned = _seq_scans(plan[0]['Plan'], [])
+                    self.assertFalse(scanned, f'Sequential scan on {scanned} for:\n{sql}')
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        return result
+
+
+class NonOwnerRoleMixin:
+    """
+    Runs each test as a role that neither owns the tables nor bypasses RLS,
+    as the application runs in production, so the tenant policies apply to
+    every query. The role (``DB_APP_ROLE``, default ``eshtarek_app``) must
+    exist and the test database user must be a member of it; the test is
+    skipped otherwise. Privileges are granted and the role assumed inside the
+    test's transaction, and both end with it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        role = os.environ.get('DB_APP_ROLE', 'eshtarek_app')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_has_role(current_user, oid, 'MEMBER') AND NOT rolbypassrls AND NOT rolsuper "
+                "FROM pg_roles WHERE rolname = %s",
+                [role],
+            )
+            row = cursor.fetchone()
+            if not (row and row[0]):
+                self.skipTest(f'Needs a non-owner role {role!r} the test user can SET ROLE to (DB_APP_ROLE)')
+            cursor.execute('SELECT current_schema()')
+            schema = connection.ops.quote_name(cursor.fetchone()[0])
+            role = connection.ops.quote_name(role)
+            cursor.execute(f'GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA {schema} TO {role}')
+            cursor.execute(f'GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA {schema} TO {role}')
+            cursor.execute(f'SET LOCAL ROLE {role}')
@@ -21,6 +21,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
 )
+from accounts.views import LogoutView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,6 +30,7 @@ urlpatterns = [
     path('api/auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/auth/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
+    path('api/auth/logout/', LogoutView.as_view(), name='token_logout'),
 
     # App APIs
     path('api/accounts/', include('accounts.urls')),
@@ -37,4 +39,6 @@ urlpatterns = [
     path('api/plans/', include('plans.urls')),
     path('api/subscriptions/', include('subscriptions.urls')),
     path('api/billing/', include('billing.urls')),
+    path('api/jobs/', include('jobs.urls')),
+    path('api/analytics/', include('analytics.urls')),
 ]
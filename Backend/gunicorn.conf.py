@@ -0,0 +1,38 @@
+"""
+gunicorn settings for production: ``gunicorn -c gunicorn.conf.py``.
+
+Worker class, workers and threads come from eshtarek.server (``SERVER_MODE``,
+``WEB_CONCURRENCY``, ``WEB_THREADS``); several workers require ``REDIS_URL``. Migrations are not run here; run
+``python manage.py migrate`` once per release (the ``migrate`` service in
+docker-compose.yml).
+"""
+import os
+
+from eshtarek import server
+
+_sizing = server.size(server.mode(), server.cpu_count())
+server.check_shared_cache(_sizing)
+
+wsgi_app = server.APPS[_sizing.mode]
+worker_class = server.WORKER_CLASSES[_sizing.mode]
+workers = _sizing.workers
+if _sizing.mode == server.WSGI:
+    threads = _sizing.threads
+else:
+    worker_connections = _sizing.threads
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+# Slow clients and long queries get 30s; recycle workers to cap leaks
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
+
+
+def on_starting(arbiter):
+    arbiter.log.info(
+        'SERVER_MODE=%s: %d CPUs, %d workers x %d, up to %d database connections',
+        _sizing.mode, _sizing.cpus, _sizing.workers, _sizing.threads, _sizing.max_db_connections,
+    )
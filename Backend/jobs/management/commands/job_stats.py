@@ -0,0 +1,15 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from jobs.metrics import queue_stats
+
+
+class Command(BaseCommand):
+    help = "Print queue depth, lag and throughput per queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, default=60, help="Throughput window in seconds")
+
+    def handle(self, *args, window, **options):
+        self.stdout.write(json.dumps(queue_stats(window), indent=2, sort_keys=True))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.worker import run_pool
+
+
+class Command(BaseCommand):
+    help = "Run queue workers that drain the jobs table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", default="default")
+        parser.add_argument(
+            "--concurrency", type=int, default=getattr(settings, "JOBS_CONCURRENCY", 1), help="Worker processes",
+        )
+        parser.add_argument("--batch-size", type=int, default=10, help="Jobs claimed per round-trip")
+        parser.add_argument("--poll-interval", type=float, default=None, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is drained")
+
+    def handle(self, *args, queue, concurrency, batch_size, poll_interval, burst, **options):
+        stats = run_pool(
+            concurrency=concurrency, burst=burst,
+            queue=queue, batch_size=batch_size, poll_interval=poll_interval,
+        )
+        if stats is not None:
+            self.stdout.write(f"{stats.as_dict()}")
@@ -0,0 +1,50 @@
+"""Queue depth, lag and throughput, read from the jobs table."""
+from datetime import timedelta
+
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import Job, JobStatus
+
+
+def queue_stats(window_seconds: int = 60) -> dict:
+    """
+    Per-queue metrics. ``lag_seconds`` is the age of the oldest ready job;
+    throughput counts jobs finished within the last ``window_seconds``.
+    Finished jobs are only read through the ``finished_at`` index.
+    """
+    now = timezone.now()
+    since = now - timedelta(seconds=window_seconds)
+    stats = {}
+
+    pending = (
+        Job.objects.filter(status__in=[JobStatus.QUEUED, JobStatus.RUNNING])
+        .values('queue')
+        .annotate(
+            queued=Count('id', filter=Q(status=JobStatus.QUEUED)),
+            ready=Count('id', filter=Q(status=JobStatus.QUEUED, run_at__lte=now)),
+            running=Count('id', filter=Q(status=JobStatus.RUNNING)),
+            oldest_ready=Min('run_at', filter=Q(status=JobStatus.QUEUED, run_at__lte=now)),
+        )
+    )
+    for row in pending:
+        oldest = row.pop('oldest_ready')
+        stats[row.pop('queue')] = dict(row, lag_seconds=round((now - oldest).total_seconds(), 3) if oldest else 0)
+
+    finished = (
+        Job.objects.filter(finished_at__gte=since)
+        .values('queue')
+        .annotate(
+            done=Count('id', filter=Q(status=JobStatus.DONE)),
+            failed=Count('id', filter=Q(status=JobStatus.FAILED)),
+        )
+    )
+    for row in finished:
+        queue = stats.setdefault(row.pop('queue'), {'queued': 0, 'ready': 0, 'running': 0, 'lag_seconds': 0})
+        queue.update(row, jobs_per_second=round(row['done'] / window_seconds, 3))
+
+    for queue in stats.values():
+        queue.setdefault('done', 0)
+        queue.setdefault('failed', 0)
+        queue.setdefault('jobs_per_second', 0.0)
+    return stats
@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils import timezone
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "queued", "Queued"
+    RUNNING = "running", "Running"
+    DONE = "done", "Done"
+    FAILED = "failed", "Failed"
+
+
+class Job(models.Model):
+    queue = models.CharField(max_length=50, default="default")
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Claim query: ready jobs of a queue in run_at order
+            models.Index(fields=["queue", "run_at", "id"], name="job_ready_idx", condition=models.Q(status="queued")),
+            # Reclaiming jobs of crashed workers
+            models.Index(fields=["queue", "locked_at"], name="job_running_idx", condition=models.Q(status="running")),
+            # Throughput metrics over recently finished jobs
+            models.Index(fields=["finished_at"], name="job_finished_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Job {self.id} {self.name} [{self.status}]"
@@ -0,0 +1,54 @@
+"""
+Database-backed job queue.
+
+Handlers are registered by name with ``@handler('app.job_name')`` and enqueued
+with ``enqueue(name, payload)``. The job row is written in the caller's
+transaction, so a job exists exactly when the work that produced it commits.
+Workers (jobs.worker) claim ready jobs with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` and retry failures with exponential backoff.
+
+Handler modules must be imported at startup; apps do that from
+``AppConfig.ready``.
+"""
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Job
+
+_handlers: Dict[str, Callable[[dict], None]] = {}
+
+
+def handler(name: str):
+    """Registers the decorated function as the handler for jobs called ``name``."""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def get_handler(name: str) -> Callable[[dict], None]:
+    return _handlers[name]
+
+
+def enqueue(name: str, payload: dict, *, queue: str = 'default', delay: Optional[timedelta] = None,
+            max_attempts: Optional[int] = None) -> Job:
+    if name not in _handlers:
+        raise KeyError(f'No job handler registered for {name!r}')
+    run_at = timezone.now() + delay if delay else timezone.now()
+    return Job.objects.create(
+        queue=queue,
+        name=name,
+        payload=payload,
+        run_at=run_at,
+        max_attempts=max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', 5),
+    )
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retry number ``attempts``: base * 2**(attempts - 1), capped."""
+    base = getattr(settings, 'JOBS_BACKOFF_SECONDS', 2)
+    cap = getattr(settings, 'JOBS_BACKOFF_MAX_SECONDS', 300)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
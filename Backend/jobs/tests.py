@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.serializers import TenantTokenObtainPairSerializer
+from eshtarek.testing import QueryBudgetMixin
+from billing.models import Invoice, InvoiceStatus, PaymentStatus
+from plans.models import Plan
+from subscriptions.models import Subscription
+from tenants.models import Tenant
+from .metrics import queue_stats
+from .models import Job, JobStatus
+from .queue import backoff, enqueue, handler
+from .worker import Worker
+
+calls = []
+
+
+@handler('tests.record')
+def record(payload):
+    if payload.get('fail'):
+        raise RuntimeError('boom')
+    calls.append(payload['n'])
+
+
+class WorkerTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker(batch_size=2)
+
+    def test_drains_queue_in_batches(self):
+        for n in range(5):
+            enqueue('tests.record', {'n': n})
+        # reclaim (2) + 3 claims of select and update (6) + one update per job (5) + empty claim (1)
+        with self.assertDataQueries(14):
+            stats = self.worker.run(burst=True)
+        self.assertEqual(calls, [0, 1, 2, 3, 4])
+        self.assertEqual(stats.processed, 5)
+        self.assertFalse(Job.objects.exclude(status=JobStatus.DONE).exists())
+
+    def test_unknown_handler(self):
+        with self.assertRaises(KeyError):
+            enqueue('tests.missing', {})
+
+    @override_settings(JOBS_BACKOFF_SECONDS=2, JOBS_BACKOFF_MAX_SECONDS=5)
+    def test_backoff(self):
+        self.assertEqual([backoff(n).total_seconds() for n in (1, 2, 3, 4)], [2, 4, 5, 5])
+
+    def test_retries_with_backoff_then_fails(self):
+        job = enqueue('tests.record', {'fail': True}, max_attempts=2)
+        self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        # Not ready until the backoff elapses
+        self.assertEqual(self.worker.run_once(), 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.FAILED, 2))
+        self.assertEqual(self.worker.stats.failed, 1)
+
+    def test_reclaims_jobs_of_dead_workers(self):
+        job = enqueue('tests.record', {'n': 1})
+        self.worker.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.worker.reclaim_stale(), 1)
+        self.worker.run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.DONE, 2))
+
+    def test_queue_stats(self):
+        enqueue('tests.record', {'n': 1})
+        enqueue('tests.record', {'n': 2}, delay=timedelta(minutes=5))
+        Job.objects.filter(name='tests.record', payload__n=1).update(run_at=timezone.now() - timedelta(seconds=30))
+        stats = queue_stats()['default']
+        self.assertEqual((stats['queued'], stats['ready'], stats['running']), (2, 1, 0))
+        self.assertGreaterEqual(stats['lag_seconds'], 30)
+        self.worker.run(burst=True)
+        stats = queue_stats()['default']
+        self.assertEqual((stats['ready'], stats['done'], stats['lag_seconds']), (0, 1, 0))
+
+
+class WebhookQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000)
+        tenant = Tenant.objects.create(name='Acme')
+        sub = Subscription.objects.create(tenant=tenant, plan=plan)
+        cls.invoice = Invoice.objects.create(tenant=tenant, subscription=sub, amount_cents=1000)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        token = TenantTokenObtainPairSerializer.get_token(self.admin).access_token
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def post_event(self, event_type):
+        return self.client.post(
+            '/api/billing/webhooks/mock/', {'type': event_type, 'invoice': self.invoice.pk},
+            content_type='application/json', **self.auth,
+        )
+
+    def test_webhook_is_accepted_then_applied_by_worker(self):
+        response = self.post_event('payment_intent.succeeded')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get(pk=response.json()['job']).status, JobStatus.QUEUED)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, InvoiceStatus.DUE)
+
+        # A redelivered event is a no-op once the invoice is paid
+        self.post_event('payment_intent.succeeded')
+        Worker().run(burst=True)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, InvoiceStatus.PAID)
+        self.assertEqual(list(self.invoice.payments.values_list('status', flat=True)), [PaymentStatus.SUCCEEDED])
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.post_event('payment_intent.failed')
+        response = self.client.get('/api/jobs/stats/', **self.auth)
+        self.assertEqual(response.json()['default']['queued'], 1)
+        self.assertEqual(self.client.get('/api/jobs/stats/').status_code, 401)
@@ -0,0 +1,16 @@
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.permissions import IsPlatformAdmin
+from .metrics import queue_stats
+
+
+class JobStatsView(APIView):
+    permission_classes = [IsPlatformAdmin]
+
+    def get(self, request):
+        try:
+            window = max(1, int(request.query_params.get("window", 60)))
+        except ValueError:
+            window = 60
+        return Response(queue_stats(window))
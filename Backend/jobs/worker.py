@@ -0,0 +1,185 @@
+"""
+Queue workers.
+
+``Worker.run_once`` claims up to ``batch_size`` ready jobs in one short
+transaction (``FOR UPDATE SKIP LOCKED`` on PostgreSQL, so concurrent workers
+never claim the same row), marks them running and then runs each handler in
+its own transaction. A failing job is re-queued with exponential backoff until
+it reaches ``max_attempts`` and is marked failed.
+
+Delivery is at-least-once: jobs left running by a crashed worker are
+re-queued after ``JOBS_LOCK_TIMEOUT`` seconds, so handlers must be idempotent.
+
+``run_pool`` runs ``concurrency`` workers as separate processes, each with its
+own database connection.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from eshtarek.tenant_context import apply_tenant_context
+from .models import Job, JobStatus
+from .queue import backoff, get_handler
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStats:
+    """Per-worker throughput counters, logged every ``JOBS_METRICS_INTERVAL`` seconds."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'jobs_per_second': round(self.rate, 2),
+            'avg_job_ms': round(1000 * self.busy_seconds / self.processed, 2) if self.processed else None,
+        }
+
+
+class Worker:
+    def __init__(self, queue='default', batch_size=10, poll_interval=None, lock_timeout=None):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(settings, 'JOBS_POLL_INTERVAL', 1.0)
+        self.lock_timeout = lock_timeout if lock_timeout is not None else getattr(settings, 'JOBS_LOCK_TIMEOUT', 300)
+        self.stats = WorkerStats()
+        self.stopping = False
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            qs = Job.objects.filter(queue=self.queue, status=JobStatus.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                qs = qs.select_for_update(skip_locked=True)
+            jobs = list(qs[:self.batch_size])
+            if jobs:
+                Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                    status=JobStatus.RUNNING, locked_at=now, attempts=F('attempts') + 1,
+                )
+        for job in jobs:
+            job.status, job.locked_at, job.attempts = JobStatus.RUNNING, now, job.attempts + 1
+        return jobs
+
+    def reclaim_stale(self) -> int:
+        """Re-queues jobs whose worker died mid-run (failed once out of attempts)."""
+        now = timezone.now()
+        stale = Job.objects.filter(
+            queue=self.queue, status=JobStatus.RUNNING, locked_at__lt=now - timedelta(seconds=self.lock_timeout),
+        )
+        exhausted = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=JobStatus.FAILED, finished_at=now, last_error='Worker lock expired',
+        )
+        return exhausted + stale.update(status=JobStatus.QUEUED, run_at=now, locked_at=None)
+
+    def run_job(self, job):
+        started = time.monotonic()
+        try:
+            with transaction.atomic():
+                get_handler(job.name)(job.payload)
+        except Exception:
+            self._failed(job, traceback.format_exc(limit=5))
+        else:
+            Job.objects.filter(pk=job.pk).update(status=JobStatus.DONE, finished_at=timezone.now(), last_error='')
+            job.status = JobStatus.DONE
+        self.stats.processed += 1
+        self.stats.busy_seconds += time.monotonic() - started
+
+    def _failed(self, job, error):
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            job.status = JobStatus.FAILED
+            Job.objects.filter(pk=job.pk).update(status=JobStatus.FAILED, finished_at=now, last_error=error)
+            self.stats.failed += 1
+            logger.error('Job %s (%s) failed after %d attempts', job.pk, job.name, job.attempts)
+        else:
+            job.status = JobStatus.QUEUED
+            Job.objects.filter(pk=job.pk).update(
+                status=JobStatus.QUEUED, run_at=now + backoff(job.attempts), locked_at=None, last_error=error,
+            )
+            self.stats.retried += 1
+
+    def run_once(self) -> int:
+        if not connection.in_atomic_block:
+            close_old_connections()
+        # Workers act for every tenant; the context is cached on the connection
+        apply_tenant_context(None, True)
+        jobs = self.claim()
+        for job in jobs:
+            self.run_job(job)
+        return len(jobs)
+
+    def run(self, burst=False):
+        """Processes jobs until stopped; with ``burst`` returns once the queue is drained."""
+        metrics_interval = getattr(settings, 'JOBS_METRICS_INTERVAL', 60)
+        next_report = time.monotonic() + metrics_interval
+        self.reclaim_stale()
+        while not self.stopping:
+            if not self.run_once():
+                if burst:
+                    break
+                self.reclaim_stale()
+                time.sleep(self.poll_interval)
+            if time.monotonic() >= next_report:
+                logger.info('Worker %s on %r: %s', os.getpid(), self.queue, self.stats.as_dict())
+                next_report = time.monotonic() + metrics_interval
+        return self.stats
+
+
+def _pool_main(options, burst):
+    import django
+    django.setup()
+    worker = Worker(**options)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stats = worker.run(burst=burst)
+    logger.info('Worker %s exiting: %s', os.getpid(), stats.as_dict())
+
+
+def run_pool(concurrency=1, burst=False, **options):
+    """Runs ``concurrency`` workers; a single worker runs in this process."""
+    if concurrency <= 1:
+        worker = Worker(**options)
+        signal.signal(signal.SIGTERM, worker.stop)
+        return worker.run(burst=burst)
+
+    # Children must not inherit this process's connections
+    connections.close_all()
+    processes = [
+        multiprocessing.Process(target=_pool_main, args=(options, burst), daemon=False)
+        for _ in range(concurrency)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -0,0 +1,113 @@
+"""
+Cached public plan catalog.
+
+The rendered ``GET /api/plans/`` body is kept in two tiers: the shared cache
+(so every worker reuses one rendering) and a per-process copy that is trusted
+for ``PLAN_CATALOG_LOCAL_TTL`` seconds before the shared entry is consulted
+again. The entry carries a strong ETag derived from the body bytes.
+
+``invalidate()`` runs on Plan save/delete (see plans.signals). It drops the
+local copy and bumps the shared entry's generation immediately and again on
+commit (eshtarek.generations), so a request that rendered the old rows while
+the write committed cannot cache them. Other processes drop their local copy
+within the local TTL. ``QuerySet.update()`` bypasses signals: call
+``invalidate()`` after it.
+"""
+import hashlib
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+
+from eshtarek import generations
+from eshtarek.fastjson import FastJSONRenderer
+from .models import Plan
+from .serializers import PlanSerializer
+
+CACHE_KEY = 'plans:catalog:v2'
+GENERATION_KEY = 'plans:catalog:generation'
+
+
+class CatalogEntry(NamedTuple):
+    body: bytes
+    etag: str
+
+
+_local = {'entry': None, 'expires': 0.0}
+
+
+def _local_ttl() -> float:
+    return getattr(settings, 'PLAN_CATALOG_LOCAL_TTL', 5)
+
+
+def queryset():
+    return Plan.objects.filter(active=True).order_by('price_cents')
+
+
+def _render(plans) -> CatalogEntry:
+    body = FastJSONRenderer().render(PlanSerializer(plans, many=True).data)
+    return CatalogEntry(body, '"%s"' % hashlib.sha256(body).hexdigest()[:32])
+
+
+def build() -> CatalogEntry:
+    return _render(queryset())
+
+
+async def abuild() -> CatalogEntry:
+    return _render([plan async for plan in queryset()])
+
+
+def _local_entry():
+    entry = _local['entry']
+    return entry if entry is not None and time.monotonic() < _local['expires'] else None
+
+
+def _keep_local(entry):
+    _local['entry'], _local['expires'] = entry, time.monotonic() + _local_ttl()
+
+
+def _timeout():
+    return getattr(settings, 'PLAN_CATALOG_TIMEOUT', 3600)
+
+
+def get() -> CatalogEntry:
+    """Returns the catalog, rendering it only when neither tier has it."""
+    entry = _local_entry()
+    if entry is not None:
+        return entry
+
+    generation, cached = generations.lookup(CACHE_KEY, GENERATION_KEY)
+    if cached is generations.MISSING:
+        entry = build()
+        generations.store(CACHE_KEY, generation, tuple(entry), _timeout())
+    else:
+        entry = CatalogEntry(*cached)
+    _keep_local(entry)
+    return entry
+
+
+async def aget() -> CatalogEntry:
+    """``get`` through the async cache API and ORM."""
+    entry = _local_entry()
+    if entry is not None:
+        return entry
+
+    generation, cached = await generations.alookup(CACHE_KEY, GENERATION_KEY)
+    if cached is generations.MISSING:
+        entry = await abuild()
+        await generations.astore(CACHE_KEY, generation, tuple(entry), _timeout())
+    else:
+        entry = CatalogEntry(*cached)
+    _keep_local(entry)
+    return entry
+
+
+def _clear():
+    generations.bump([GENERATION_KEY])
+    _local['entry'], _local['expires'] = None, 0.0
+
+
+def invalidate():
+    _clear()
+    transaction.on_commit(_clear)
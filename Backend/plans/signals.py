@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog
+from .models import Plan
+
+
+@receiver([post_save, post_delete], sender=Plan, dispatch_uid='plans.invalidate_catalog')
+def invalidate_catalog(sender, **kwargs):
+    catalog.invalidate()
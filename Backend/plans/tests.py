@@ -1,3 +1,135 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from eshtarek.fastjson import dumps
+from eshtarek.testing import QueryBudgetMixin
+from . import catalog
+from .models import Plan
+from .serializers import PlanSerializer
+
+
+class PlanQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        Plan.objects.create(name='Pro', price_cents=5000, max_users=50)
+        Plan.objects.create(name='Legacy', price_cents=500, active=False)
+
+    def setUp(self):
+        catalog.invalidate()
+
+    def test_public_list(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/plans/')
+        self.assertEqual([plan['name'] for plan in response.json()], ['Basic', 'Pro'])
+
+
+class PlanCatalogTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Plan.objects.create(
+            name='Überplan', description='Line\u2028separated \u2603', price_cents=1999,
+            features={'seats': 10, 'sso': True, 'note': 'ünïcode\u2029', 'tiers': [1.5, None]},
+        )
+        cls.basic = Plan.objects.create(name='Basic', price_cents=1000)
+
+    def setUp(self):
+        catalog.invalidate()
+
+    def test_body_matches_serializer_output(self):
+        response = self.client.get('/api/plans/')
+        expected = JSONRenderer().render(PlanSerializer(catalog.queryset(), many=True).data)
+        self.assertEqual(response.content, expected)
+        self.assertIn(b'\\u2028', response.content)
+
+    def test_warm_catalog_touches_no_database(self):
+        self.client.get('/api/plans/')
+        with self.assertDataQueries(0):
+            response = self.client.get('/api/plans/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_revalidation(self):
+        etag = self.client.get('/api/plans/')['ETag']
+        with self.assertDataQueries(0):
+            response = self.client.get('/api/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/plans/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_save_and_delete_invalidate(self):
+        etag = self.client.get('/api/plans/')['ETag']
+        self.basic.price_cents = 1500
+        self.basic.save()
+        response = self.client.get('/api/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"price_cents":1500', response.content)
+
+        self.basic.delete()
+        self.assertEqual([plan['name'] for plan in self.client.get('/api/plans/').json()], ['Überplan'])
+
+    def test_fill_racing_a_write_is_not_kept(self):
+        stale = catalog.build()
+
+        def racing_build():
+            # The plan changes and commits while this request renders the old rows
+            with self.captureOnCommitCallbacks(execute=True):
+                self.basic.price_cents = 1500
+                self.basic.save()
+            return stale
+
+        with mock.patch.object(catalog, 'build', racing_build):
+            self.assertEqual(catalog.get(), stale)
+        # Another process, or this one once its local copy expired
+        catalog._local['entry'] = None
+        self.assertIn(b'"price_cents":1500', catalog.get().body)
+
+    def test_browsable_api_uses_regular_path(self):
+        response = self.client.get('/api/plans/', HTTP_ACCEPT='text/html')
+        self.assertContains(response, 'Basic')
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(ROOT_URLCONF='eshtarek.async_urls')
+class AsyncPlanCatalogTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Plan.objects.create(name='Basic', price_cents=1000, features={'sso': False})
+        Plan.objects.create(name='Pro', price_cents=5000, features={'sso': True})
+
+    def setUp(self):
+        catalog.invalidate()
+
+    def test_matches_sync_view(self):
+        actual = self.client.get('/api/plans/')
+        with override_settings(ROOT_URLCONF='eshtarek.urls'):
+            expected = self.client.get('/api/plans/')
+        self.assertEqual(actual.content, expected.content)
+        self.assertEqual(actual['ETag'], expected['ETag'])
+        self.assertEqual(actual['Cache-Control'], expected['Cache-Control'])
+
+    def test_cold_and_warm_catalog(self):
+        with self.assertDataQueries(1):
+            etag = self.client.get('/api/plans/')['ETag']
+        with self.assertDataQueries(0):
+            response = self.client.get('/api/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_browsable_api(self):
+        response = self.client.get('/api/plans/', HTTP_ACCEPT='text/html')
+        self.assertContains(response, 'Basic')
+
+
+class FastDumpsTests(TestCase):
+    def test_matches_renderer_for_float_and_bigint_features(self):
+        plan = Plan.objects.create(name='Metered', price_cents=1000, features={
+            'rate': 1e16, 'tiny': 1e-7, 'ratio': 0.1, 'quota': 2 ** 70, 'floor': -(2 ** 64), 'seats': 10,
+        })
+        data = PlanSerializer(Plan.objects.get(pk=plan.pk)).data
+        self.assertEqual(dumps(data), JSONRenderer().render(data))
+        self.assertEqual(dumps([{'quota': 2 ** 64}]), JSONRenderer().render([{'quota': 2 ** 64}]))
+        self.assertEqual(dumps({1: 'x'}), JSONRenderer().render({1: 'x'}))
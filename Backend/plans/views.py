@@ -1,4 +1,13 @@
-from rest_framework import viewsets, permissions
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import viewsets, permissions, status
+from rest_framework.response import Response
+
+from accounts.authentication import get_principal
+from eshtarek.aio import AsyncListView
+from eshtarek.fastjson import RawJSON, accepts_compact_json
+from . import catalog
 from .models import Plan
 from .serializers import PlanSerializer
 
@@ -7,17 +16,12 @@ class IsPlatformAdminOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True
-        user = request.user
-        if not getattr(user, 'is_authenticated', False):
-            return False
-        if getattr(user, 'is_superuser', False):
-            return True
-        profile = getattr(user, 'profile', None)
-        return bool(profile and getattr(profile, 'role', '') == 'ADMIN')
+        principal = get_principal(request)
+        return principal.is_authenticated and principal.is_platform_admin
 
 
 class PlanViewSet(viewsets.ModelViewSet):
-    queryset = Plan.objects.filter(active=True).order_by('price_cents')
+    queryset = catalog.queryset()
     serializer_class = PlanSerializer
 
     # Allow read for any authenticated user; write restricted to platform admin
@@ -26,4 +30,31 @@ class PlanViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]  # public read
         return [IsPlatformAdminOrReadOnly()]
 
+    def list(self, request, *args, **kwargs):
+        # Public catalog: served from plans.catalog and revalidated by ETag
+        if not accepts_compact_json(request):
+            return super().list(request, *args, **kwargs)
+        return catalog_response(request, catalog.get())
+
+
+def catalog_response(request, entry):
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if entry.etag in if_none_match or '*' in if_none_match:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(RawJSON(entry.body))
+    response['ETag'] = entry.etag
+    response['Cache-Control'] = 'public, max-age=%d' % getattr(settings, 'PLAN_CATALOG_MAX_AGE', 60)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class AsyncPlanListView(AsyncListView):
+    view_class = PlanViewSet
+
+    async def handle(self, view, request, *args, **kwargs):
+        if not accepts_compact_json(request):
+            return await super().handle(view, request, *args, **kwargs)
+        return catalog_response(request, await catalog.aget())
+
 # Create your views here.
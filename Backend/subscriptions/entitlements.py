@@ -0,0 +1,156 @@
+"""
+Plan entitlements per tenant, compiled once and cached.
+
+``compile_plan`` turns a plan's untyped ``features`` JSON into an immutable
+Entitlements: features set to ``true`` become a frozenset of flags, other
+scalar values (``"support": "email"``, ``"seats": 10``) a read-only mapping,
+and ``features["limits"]`` plus ``Plan.max_users`` (as ``users``) a
+read-only mapping of positive integer limits, with the same meaning as in
+tenants.quotas (missing, null or zero: unlimited). Lists, nested objects and
+``false`` are left out. Every check is then one set or dict lookup.
+
+``for_tenant(tenant_id)`` returns the entitlements of the tenant's active
+subscription's plan (``NONE`` without one), kept in two tiers like
+plans.catalog: the shared cache holds the plan's raw fields per tenant, so
+only the first check after a change reads the database, and each process
+keeps the compiled object for ``ENTITLEMENTS_LOCAL_TTL`` seconds, so a warm
+check touches neither the database nor the cache.
+
+``invalidate(tenant_id)`` runs on Subscription save/delete, which covers
+change-plan and change-status, and ``invalidate_plan(plan_id)`` on Plan
+save/delete (see subscriptions.signals). Both drop the local copies and bump
+the tenants' shared generations immediately and again on commit
+(eshtarek.generations), so a check that read the old plan while the write
+committed cannot cache it. Other processes drop their local copy within the
+local TTL. ``QuerySet.update()`` bypasses signals: call ``invalidate()``
+after it.
+"""
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, FrozenSet, Mapping, NamedTuple, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db import transaction
+
+from eshtarek import generations
+from tenants.quotas import USERS
+from .models import Subscription, SubscriptionStatus
+
+CACHE_KEY = 'entitlements:v2:{}'
+GENERATION_KEY = 'entitlements:generation:{}'
+
+Scalar = Union[str, int, float]
+
+# (plan_id, max_users, features) as stored in the shared cache
+RawPlan = Tuple[Optional[int], int, Any]
+
+
+class Entitlements(NamedTuple):
+    plan_id: Optional[int]
+    flags: FrozenSet[str]
+    values: Mapping[str, Scalar]
+    limits: Mapping[str, int]
+
+    def has(self, feature: str) -> bool:
+        return feature in self.flags
+
+    def value(self, name: str, default: Optional[Scalar] = None) -> Optional[Scalar]:
+        return self.values.get(name, default)
+
+    def limit(self, metric: str) -> Optional[int]:
+        """The limit for ``metric``; None when unlimited."""
+        return self.limits.get(metric)
+
+
+NO_PLAN: RawPlan = (None, 0, {})
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def compile_plan(plan_id: Optional[int], max_users: int, features) -> Entitlements:
+    features = features if isinstance(features, dict) else {}
+    flags = frozenset(name for name, value in features.items() if value is True)
+    values = {
+        name: value for name, value in features.items()
+        if isinstance(value, (str, float)) or _is_int(value)
+    }
+    raw_limits = features.get('limits')
+    limits = {
+        metric: value for metric, value in (raw_limits if isinstance(raw_limits, dict) else {}).items()
+        if _is_int(value) and value > 0
+    }
+    if max_users:
+        limits[USERS] = max_users
+    return Entitlements(plan_id, flags, MappingProxyType(values), MappingProxyType(limits))
+
+
+NONE = compile_plan(*NO_PLAN)
+
+# tenant id -> (entitlements, expiry on the monotonic clock); read without
+# the lock, changed under it, so threads evicting at once don't collide
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _local_ttl() -> float:
+    return getattr(settings, 'ENTITLEMENTS_LOCAL_TTL', 5)
+
+
+def _local_max() -> int:
+    return getattr(settings, 'ENTITLEMENTS_LOCAL_MAX_ENTRIES', 10000)
+
+
+def _timeout():
+    return getattr(settings, 'ENTITLEMENTS_TIMEOUT', 3600)
+
+
+def load(tenant_id) -> RawPlan:
+    row = (
+        Subscription.objects.filter(tenant_id=tenant_id, status=SubscriptionStatus.ACTIVE)
+        .values_list('plan_id', 'plan__max_users', 'plan__features')
+        .first()
+    )
+    return tuple(row) if row is not None else NO_PLAN
+
+
+def for_tenant(tenant_id) -> Entitlements:
+    """``tenant_id``'s entitlements, reading the database only when neither tier has them."""
+    key = str(tenant_id)
+    entry = _local.get(key)
+    if entry is not None and time.monotonic() < entry[1]:
+        return entry[0]
+
+    generation, raw = generations.lookup(CACHE_KEY.format(key), GENERATION_KEY.format(key))
+    if raw is generations.MISSING:
+        raw = load(key)
+        generations.store(CACHE_KEY.format(key), generation, raw, _timeout())
+    entitlements = compile_plan(*raw)
+    with _local_lock:
+        if key not in _local and len(_local) >= _local_max():
+            # Oldest first, by insertion order
+            _local.pop(next(iter(_local)), None)
+        _local[key] = (entitlements, time.monotonic() + _local_ttl())
+    return entitlements
+
+
+def _clear(tenant_ids):
+    keys = [str(tenant_id) for tenant_id in tenant_ids]
+    generations.bump([GENERATION_KEY.format(key) for key in keys])
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+def invalidate(tenant_id):
+    _clear([tenant_id])
+    transaction.on_commit(lambda: _clear([tenant_id]))
+
+
+def invalidate_plan(plan_id):
+    """Invalidates every tenant subscribed to ``plan_id``, whatever the status."""
+    tenant_ids = set(Subscription.objects.filter(plan_id=plan_id).values_list('tenant_id', flat=True))
+    _clear(tenant_ids)
+    transaction.on_commit(lambda: _clear(tenant_ids))
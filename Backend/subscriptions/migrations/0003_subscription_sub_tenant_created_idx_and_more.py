@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0001_initial'),
+        ('subscriptions', '0002_rls'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['tenant', '-created_at', '-id'], name='sub_tenant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['-created_at', '-id'], name='sub_created_idx'),
+        ),
+    ]
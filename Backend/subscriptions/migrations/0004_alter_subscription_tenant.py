@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0003_subscription_sub_tenant_created_idx_and_more'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscription',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='tenants.tenant'),
+        ),
+    ]
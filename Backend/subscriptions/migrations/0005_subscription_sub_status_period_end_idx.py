@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0001_initial'),
+        ('subscriptions', '0004_alter_subscription_tenant'),
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'current_period_end'], name='sub_status_period_end_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from importlib import import_module
+
+from django.db import migrations
+
+from eshtarek.rls import TenantRowLevelSecurity
+
+
+def restore_legacy_policies(apps, schema_editor):
+    import_module('subscriptions.migrations.0002_rls').enable_rls_subscriptions(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subscriptions', '0005_subscription_sub_status_period_end_idx'),
+    ]
+
+    operations = [
+        # Replaces the policies of 0002_rls; reversing restores them
+        migrations.RunPython(migrations.RunPython.noop, restore_legacy_policies),
+        TenantRowLevelSecurity('subscription'),
+    ]
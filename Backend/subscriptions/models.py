@@ -1,4 +1,5 @@
 from django.db import models
+from tenants.managers import TenantScopedManager
 from tenants.models import Tenant
 from plans.models import Plan
 
@@ -12,7 +13,8 @@ class SubscriptionStatus(models.TextChoices):
 
 
 class Subscription(models.Model):
-    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="subscriptions")
+    # Indexed through the (tenant, status) unique index and sub_tenant_created_idx
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="subscriptions", db_index=False)
     plan = models.ForeignKey(Plan, on_delete=models.PROTECT, related_name="subscriptions")
     status = models.CharField(max_length=20, choices=SubscriptionStatus.choices, default=SubscriptionStatus.ACTIVE)
     started_at = models.DateTimeField(auto_now_add=True)
@@ -21,9 +23,18 @@ class Subscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantScopedManager()
+
     class Meta:
         ordering = ["-created_at"]
         unique_together = ("tenant", "status")
+        indexes = [
+            # Keyset pagination on (created_at, id), per tenant and platform-wide
+            models.Index(fields=["tenant", "-created_at", "-id"], name="sub_tenant_created_idx"),
+            models.Index(fields=["-created_at", "-id"], name="sub_created_idx"),
+            # Renewal selection (billing.renewals.due_subscriptions)
+            models.Index(fields=["status", "current_period_end"], name="sub_status_period_end_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.tenant.name}: {self.plan.name} [{self.status}]"
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from plans.models import Plan
+from . import entitlements
+from .models import Subscription
+
+
+@receiver([post_save, post_delete], sender=Subscription, dispatch_uid='subscriptions.invalidate_entitlements')
+def invalidate_entitlements(sender, instance, **kwargs):
+    entitlements.invalidate(instance.tenant_id)
+
+
+# Subscriptions protect their plan from deletion, so only saves matter
+@receiver(post_save, sender=Plan, dispatch_uid='subscriptions.invalidate_plan_entitlements')
+def invalidate_plan_entitlements(sender, instance, **kwargs):
+    entitlements.invalidate_plan(instance.pk)
@@ -1,3 +1,383 @@
-from django.test import TestCase
+import threading
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from accounts.authentication import Principal
+from accounts.models import UserProfile, UserRole
+from accounts.permissions import HasEntitlement
+from accounts.serializers import TenantTokenObtainPairSerializer
+from eshtarek import server
+from eshtarek.idempotency import cache_key
+from eshtarek.testing import QueryBudgetMixin, QueryPlanAssertionsMixin, requires_postgres
+from plans.models import Plan
+from tenants.models import Tenant
+from . import entitlements
+from .models import Subscription, SubscriptionStatus
+
+
+def auth_header(user):
+    token = TenantTokenObtainPairSerializer.get_token(user).access_token
+    return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+
+class SubscriptionQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Each endpoint's query count for a caller with a claims-bearing token."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.basic = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        cls.pro = Plan.objects.create(name='Pro', price_cents=5000, max_users=50)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.other = Tenant.objects.create(name='Globex')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=cls.basic)
+        Subscription.objects.create(tenant=cls.other, plan=cls.basic)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        # Minted outside the budgets: token issuance is not part of the request
+        self.member_auth = auth_header(self.member)
+        self.admin_auth = auth_header(self.admin)
+
+    def test_list_scoped_to_tenant(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/subscriptions/', **self.member_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.sub.id])
+
+    def test_list_for_platform_admin(self):
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/subscriptions/', **self.admin_auth)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_retrieve(self):
+        with self.assertDataQueries(1):
+            response = self.client.get(f'/api/subscriptions/{self.sub.id}/', **self.member_auth)
+        self.assertEqual(response.status_code, 200)
+
+    def test_change_plan(self):
+        # subscription, plan validation, update
+        with self.assertDataQueries(3):
+            response = self.client.post(
+                f'/api/subscriptions/{self.sub.id}/change-plan/', {'plan': self.pro.id},
+                **self.member_auth,
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_tenant_is_invisible(self):
+        other_sub = Subscription.objects.get(tenant=self.other)
+        response = self.client.get(f'/api/subscriptions/{other_sub.id}/', **self.member_auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_for_principal_without_tenant_is_empty(self):
+        from accounts.authentication import ANONYMOUS
+
+        self.assertFalse(Subscription.objects.for_principal(ANONYMOUS).exists())
+
+
+@requires_postgres
+class SubscriptionQueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        tenants = Tenant.objects.bulk_create([Tenant(name=f'Tenant {i:03}') for i in range(200)])
+        Subscription.objects.bulk_create(
+            [Subscription(tenant=t, plan=plan) for t in tenants]
+            + [Subscription(tenant=t, plan=plan, status=SubscriptionStatus.CANCELED) for t in tenants]
+        )
+        cls.tenant = tenants[0]
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+        cls.analyze(Tenant, Plan, Subscription)
+
+    def test_tenant_list(self):
+        auth = auth_header(self.member)
+        self.assertNoSeqScan(lambda: self.client.get('/api/subscriptions/', **auth))
+
+    def test_admin_list(self):
+        auth = auth_header(self.admin)
+        self.assertNoSeqScan(lambda: self.client.get('/api/subscriptions/', **auth))
+
+    def test_active_subscription_lookup(self):
+        self.assertNoSeqScan(
+            lambda: Subscription.objects.filter(tenant=self.tenant, status=SubscriptionStatus.ACTIVE).first()
+        )
+
+
+class SubscriptionFastListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        for status in (SubscriptionStatus.ACTIVE, SubscriptionStatus.CANCELED, SubscriptionStatus.TRIALING):
+            Subscription.objects.create(tenant=cls.tenant, plan=plan, status=status)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def test_fast_path_is_byte_compatible(self):
+        auth = auth_header(self.admin)
+        for query in ('', '?page_size=2'):
+            with override_settings(FAST_JSON_LISTS=False):
+                expected = self.client.get(f'/api/subscriptions/{query}', **auth).content
+            with override_settings(FAST_JSON_LISTS=True):
+                actual = self.client.get(f'/api/subscriptions/{query}', **auth).content
+            self.assertEqual(actual, expected)
+
+
+@override_settings(ROOT_URLCONF='eshtarek.async_urls')
+class AsyncSubscriptionListTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        cls.tenant = Tenant.objects.create(name='Acme')
+        for status in (SubscriptionStatus.CANCELED, SubscriptionStatus.TRIALING):
+            Subscription.objects.create(tenant=cls.tenant, plan=cls.plan, status=status)
+        Subscription.objects.create(tenant=Tenant.objects.create(name='Globex'), plan=cls.plan)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_USER)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def test_matches_sync_views(self):
+        for user in (self.member, self.admin):
+            auth = auth_header(user)
+            for fast in (False, True):
+                for query in ('', '?page_size=2'):
+                    with override_settings(FAST_JSON_LISTS=fast):
+                        actual = self.client.get(f'/api/subscriptions/{query}', **auth)
+                        with override_settings(ROOT_URLCONF='eshtarek.urls'):
+                            expected = self.client.get(f'/api/subscriptions/{query}', **auth)
+                    self.assertEqual(actual.status_code, 200)
+                    self.assertEqual(actual.content, expected.content)
+
+    def test_query_budget(self):
+        auth = auth_header(self.member)
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/subscriptions/', **auth)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_other_methods_use_sync_view(self):
+        response = self.client.post(
+            '/api/subscriptions/',
+            {'plan': self.plan.id, 'tenant': str(self.tenant.id), 'status': SubscriptionStatus.ACTIVE},
+            content_type='application/json',
+            **auth_header(self.member),
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Subscription.objects.filter(tenant=self.tenant).count(), 3)
+
+    def test_method_not_allowed(self):
+        # Only list and create are routed for the collection
+        response = self.client.delete('/api/subscriptions/', **auth_header(self.admin))
+        self.assertEqual(response.status_code, 405)
+
+
+class IdempotencyTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.basic = Plan.objects.create(name='Basic', price_cents=1000, max_users=5)
+        cls.pro = Plan.objects.create(name='Pro', price_cents=5000, max_users=50)
+        tenant = Tenant.objects.create(name='Acme')
+        cls.sub = Subscription.objects.create(tenant=tenant, plan=cls.basic)
+        cls.admin = User.objects.create_user('owner', password='pw123456')
+        UserProfile.objects.create(user=cls.admin, tenant=tenant, role=UserRole.TENANT_ADMIN)
+        cls.other = User.objects.create_user('coadmin', password='pw123456')
+        UserProfile.objects.create(user=cls.other, tenant=tenant, role=UserRole.TENANT_ADMIN)
+
+    def setUp(self):
+        caches['idempotency'].clear()
+        self.url = f'/api/subscriptions/{self.sub.pk}/change-plan/'
+
+    def change_plan(self, plan, key='k1', user=None):
+        return self.client.post(
+            self.url, {'plan': plan.pk}, content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key, **auth_header(user or self.admin),
+        )
+
+    def test_retry_is_replayed_without_running_the_view(self):
+        first = self.change_plan(self.pro)
+        Subscription.objects.filter(pk=self.sub.pk).update(plan=self.basic)
+        with self.assertDataQueries(0):
+            replay = self.change_plan(self.pro)
+        self.assertEqual((replay.status_code, replay.content), (first.status_code, first.content))
+        self.assertEqual(replay['Content-Type'], first['Content-Type'])
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.plan, self.basic)
+
+    def test_key_reused_for_another_request(self):
+        self.change_plan(self.pro)
+        self.assertEqual(self.change_plan(self.basic).status_code, 422)
+
+    def test_keys_are_scoped_per_principal_and_route(self):
+        self.change_plan(self.pro)
+        self.assertNotIn('Idempotent-Replayed', self.change_plan(self.pro, user=self.other))
+        response = self.client.post(
+            '/api/subscriptions/', {'plan': self.pro.pk}, content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY='k1', **auth_header(self.admin),
+        )
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_in_flight_request(self):
+        request = SimpleNamespace(method='POST', path=self.url)
+        caches['idempotency'].add(cache_key(Principal.from_user(self.admin), request, 'busy') + ':lock', 1)
+        self.assertEqual(self.change_plan(self.pro, key='busy').status_code, 409)
+
+    def test_requests_without_key_are_untouched(self):
+        for _ in range(2):
+            response = self.client.post(
+                self.url, {'plan': self.pro.pk}, content_type='application/json', **auth_header(self.admin),
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_several_workers_need_a_shared_store(self):
+        sizing = server.Sizing(mode=server.WSGI, cpus=2, workers=5, threads=4)
+        with self.assertRaisesMessage(RuntimeError, 'REDIS_URL'):
+            server.check_shared_cache(sizing, redis_url='')
+        server.check_shared_cache(sizing, redis_url='redis://cache:6379/0')
+        server.check_shared_cache(sizing._replace(workers=1), redis_url='')
+
+
+class EntitlementTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.basic = Plan.objects.create(
+            name='Basic', price_cents=1000, max_users=5,
+            features={'support': 'email', 'seats': 10, 'sso': False, 'tiers': [1, 2], 'limits': {'projects': 3}},
+        )
+        cls.pro = Plan.objects.create(
+            name='Pro', price_cents=5000, max_users=50,
+            features={'api_export': True, 'sso': True, 'limits': {'projects': 0}},
+        )
+        cls.tenant = Tenant.objects.create(name='Acme')
+        cls.sub = Subscription.objects.create(tenant=cls.tenant, plan=cls.basic)
+        cls.member = User.objects.create_user('member', password='pw123456')
+        UserProfile.objects.create(user=cls.member, tenant=cls.tenant, role=UserRole.TENANT_ADMIN)
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def setUp(self):
+        entitlements._local.clear()
+        cache.clear()
+        self.member_auth = auth_header(self.member)
+
+    def test_compiled_plan(self):
+        granted = entitlements.compile_plan(self.basic.pk, 5, self.basic.features)
+        self.assertEqual(granted.flags, frozenset())
+        self.assertEqual(dict(granted.values), {'support': 'email', 'seats': 10})
+        self.assertEqual(dict(granted.limits), {'projects': 3, 'users': 5})
+        self.assertIsNone(granted.limit('storage'))
+        with self.assertRaises(TypeError):
+            granted.values['support'] = 'phone'
+
+        granted = entitlements.compile_plan(self.pro.pk, 0, self.pro.features)
+        self.assertTrue(granted.has('api_export'))
+        self.assertFalse(granted.has('support'))
+        self.assertEqual(dict(granted.limits), {})
+
+    def test_cached_per_tenant(self):
+        with self.assertDataQueries(1):
+            self.assertEqual(entitlements.for_tenant(self.tenant.pk).value('support'), 'email')
+        with self.assertDataQueries(0):
+            self.assertEqual(entitlements.for_tenant(self.tenant.pk).plan_id, self.basic.pk)
+        # Another process: the shared tier still answers without the database
+        entitlements._local.clear()
+        with self.assertDataQueries(0):
+            self.assertEqual(entitlements.for_tenant(self.tenant.pk).limit('users'), 5)
+
+    def test_tenant_without_active_subscription(self):
+        other = Tenant.objects.create(name='Globex')
+        self.assertIs(entitlements.for_tenant(other.pk).plan_id, None)
+        self.assertEqual(entitlements.for_tenant(other.pk), entitlements.NONE)
+
+    def test_change_plan_and_status_invalidate(self):
+        self.assertFalse(entitlements.for_tenant(self.tenant.pk).has('api_export'))
+        self.client.post(f'/api/subscriptions/{self.sub.id}/change-plan/', {'plan': self.pro.id}, **self.member_auth)
+        self.assertTrue(entitlements.for_tenant(self.tenant.pk).has('api_export'))
+
+        self.client.post(
+            f'/api/subscriptions/{self.sub.id}/change-status/', {'status': SubscriptionStatus.CANCELED},
+            **self.member_auth,
+        )
+        self.assertEqual(entitlements.for_tenant(self.tenant.pk), entitlements.NONE)
+
+    def test_plan_change_invalidates_its_tenants(self):
+        self.assertFalse(entitlements.for_tenant(self.tenant.pk).has('sso'))
+        self.basic.features = {'sso': True}
+        self.basic.save()
+        self.assertTrue(entitlements.for_tenant(self.tenant.pk).has('sso'))
+
+    def test_fill_racing_a_plan_change_is_not_kept(self):
+        stale = entitlements.load(self.tenant.pk)
+
+        def racing_load(tenant_id):
+            # The plan changes and commits while this check reads the old one
+            with self.captureOnCommitCallbacks(execute=True):
+                self.sub.plan = self.pro
+                self.sub.save()
+            return stale
+
+        with mock.patch.object(entitlements, 'load', racing_load):
+            self.assertFalse(entitlements.for_tenant(self.tenant.pk).has('api_export'))
+        # Another process, or this one once its local copy expired
+        entitlements._local.clear()
+        self.assertTrue(entitlements.for_tenant(self.tenant.pk).has('api_export'))
+
+    @override_settings(ENTITLEMENTS_LOCAL_MAX_ENTRIES=2)
+    def test_concurrent_local_evictions(self):
+        tenant_ids = [self.tenant.pk] + [Tenant.objects.create(name=f'T{i}').pk for i in range(5)]
+        for tenant_id in tenant_ids:
+            entitlements.for_tenant(tenant_id)
+        errors = []
+
+        def check():
+            try:
+                for _ in range(200):
+                    for tenant_id in tenant_ids:
+                        entitlements.for_tenant(tenant_id)
+            except Exception as exc:
+                errors.append(exc)
+
+        # The shared tier is warm, so the threads need no database
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(entitlements._local), 2)
+
+    def test_permission(self):
+        class ExportView(APIView):
+            permission_classes = [HasEntitlement]
+            required_entitlements = ('api_export',)
+
+            def get(self, request):
+                return Response({'ok': True})
+
+        factory = APIRequestFactory()
+
+        def get(**auth):
+            # In a transaction of its own, as with ATOMIC_REQUESTS: DRF marks it for rollback on errors
+            with transaction.atomic():
+                return ExportView.as_view()(factory.get('/', **auth))
+
+        self.assertEqual(get().status_code, 401)
+        response = get(**self.member_auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(str(response.data['detail']), HasEntitlement.message)
+        self.assertEqual(get(**auth_header(self.admin)).status_code, 200)
+
+        self.sub.plan = self.pro
+        self.sub.save()
+        self.assertEqual(get(**self.member_auth).status_code, 200)
+        with self.assertDataQueries(0):
+            self.assertEqual(get(**self.member_auth).status_code, 200)
@@ -10,25 +10,25 @@ from .serializers import (
     SubscriptionChangePlanSerializer,
     SubscriptionChangeStatusSerializer,
 )
+from accounts.authentication import get_principal
 from accounts.permissions import IsTenantAdminOrReadOnly, IsPlatformAdmin
+from eshtarek.aio import AsyncListView
+from eshtarek.fastjson import FastListMixin
+from eshtarek.pagination import KeysetPagination
 
 # Create your views here.
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = SubscriptionSerializer
     permission_classes = [IsTenantAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
-        qs = Subscription.objects.select_related('tenant', 'plan').all()
-        user = self.request.user
-        if getattr(user, 'is_superuser', False):
-            return qs
-        profile = getattr(user, 'profile', None)
-        if profile and getattr(profile, 'role', '') == 'ADMIN':
-            return qs
-        if profile and getattr(profile, 'tenant_id', None):
-            return qs.filter(tenant_id=profile.tenant_id)
-        return qs.none()
+        return (
+            Subscription.objects.for_principal(get_principal(self.request))
+            .select_related('tenant', 'plan')
+        )
 
     def get_permissions(self):
         # Allow any authenticated tenant member to create a subscription or change plan
@@ -46,20 +46,17 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         return SubscriptionSerializer
 
     def perform_create(self, serializer):
-        user = self.request.user
-        profile = getattr(user, 'profile', None)
+        principal = get_principal(self.request)
         # Determine tenant: non-admin users can only create for their own tenant
-        is_platform_admin = getattr(user, 'is_superuser', False)
-        role = getattr(getattr(profile, 'role', None), 'value', None) or getattr(profile, 'role', None)
-        is_tenant_admin = role in ('ADMIN', 'TENANT_ADMIN')
-        if is_platform_admin or is_tenant_admin:
-            tenant = serializer.validated_data.get('tenant') or getattr(profile, 'tenant', None)
+        tenant = serializer.validated_data.pop('tenant', None)
+        if tenant is not None and principal.can_access_tenant(tenant.pk):
+            tenant_id = tenant.pk
         else:
-            tenant = getattr(profile, 'tenant', None)
-        if tenant is None:
+            tenant_id = principal.tenant_id
+        if tenant_id is None:
             raise serializers.ValidationError({'tenant': ['Tenant is required']})
         # enforce one active subscription per tenant
-        if Subscription.objects.filter(tenant=tenant, status=SubscriptionStatus.ACTIVE).exists():
+        if Subscription.objects.filter(tenant_id=tenant_id, status=SubscriptionStatus.ACTIVE).exists():
             raise serializers.ValidationError({
                 'tenant': ['This tenant already has an active subscription.']
             })
@@ -67,7 +64,7 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         status_value = serializer.validated_data.get('status', SubscriptionStatus.ACTIVE)
         from django.db import IntegrityError
         try:
-            serializer.save(tenant=tenant, status=status_value)
+            serializer.save(tenant_id=tenant_id, status=status_value)
         except IntegrityError:
             raise serializers.ValidationError({
                 'non_field_errors': ['A subscription with this tenant and status already exists.']
@@ -77,13 +74,8 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
     def change_plan(self, request, pk=None):
         sub = self.get_object()
         # Ownership check: non-admin users can only change plan for their own tenant's subscription
-        user = request.user
-        if not getattr(user, 'is_superuser', False):
-            profile = getattr(user, 'profile', None)
-            role = getattr(getattr(profile, 'role', None), 'value', None) or getattr(profile, 'role', None)
-            is_tenant_admin = role in ('ADMIN', 'TENANT_ADMIN')
-            if not is_tenant_admin and (not profile or getattr(profile, 'tenant_id', None) != sub.tenant_id):
-                return Response({'detail': 'Not allowed for this tenant'}, status=status.HTTP_403_FORBIDDEN)
+        if not get_principal(request).can_access_tenant(sub.tenant_id):
+            return Response({'detail': 'Not allowed for this tenant'}, status=status.HTTP_403_FORBIDDEN)
         serializer = SubscriptionChangePlanSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         sub.plan = serializer.validated_data['plan']
@@ -98,3 +90,7 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         sub.status = serializer.validated_data['status']
         sub.save(update_fields=['status', 'updated_at'])
         return Response(SubscriptionSerializer(sub).data, status=status.HTTP_200_OK)
+
+
+class AsyncSubscriptionListView(AsyncListView):
+    view_class = SubscriptionViewSet
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Tenant
+from .models import Tenant, TenantUsage
 
 
 @admin.register(Tenant)
@@ -8,4 +8,12 @@ class TenantAdmin(admin.ModelAdmin):
     list_filter = ("active",)
     search_fields = ("name", "id")
 
+
+@admin.register(TenantUsage)
+class TenantUsageAdmin(admin.ModelAdmin):
+    list_display = ("tenant", "metric", "value", "updated_at")
+    list_filter = ("metric",)
+    search_fields = ("tenant__name",)
+    readonly_fields = ("value", "updated_at")
+
 # Register your models here.
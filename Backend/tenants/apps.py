@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class TenantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tenants'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from eshtarek.tenant_context import install_transaction_context
+
+        connection_created.connect(install_transaction_context, dispatch_uid='tenant_transaction_context')
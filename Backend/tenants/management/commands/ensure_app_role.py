@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from eshtarek.rls import ensure_app_role
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the non-owner role the application connects as (unless it exists) and grant it access "
+        "to the tables, so the RLS policies apply to it. Run as the table owner, after migrate. PostgreSQL only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--role", default=getattr(settings, "DB_APP_ROLE", "eshtarek_app"))
+        parser.add_argument(
+            "--password", default=getattr(settings, "DB_APP_PASSWORD", ""),
+            help="Login password, used only when the role is created",
+        )
+
+    def handle(self, *args, role, password, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write("Row-level security is only used on PostgreSQL; nothing to do.")
+            return
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                created = ensure_app_role(cursor, role, password)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        except DatabaseError as exc:
+            raise CommandError(f"Cannot set up role {role} (creating it needs CREATEROLE): {exc}")
+        action = "Created" if created else "Updated grants of"
+        self.stdout.write(self.style.SUCCESS(f"{action} role {role}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tenants.quotas import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-tenant usage counters from the metered tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("metrics", nargs="*", help=f"Metrics to rebuild (default: all of {', '.join(COUNTERS)})")
+        parser.add_argument("--tenant", action="append", dest="tenants", help="Only this tenant id (repeatable)")
+
+    def handle(self, *args, metrics=(), tenants=None, **options):
+        unknown = set(metrics) - set(COUNTERS)
+        if unknown:
+            raise CommandError(f"Unknown metric(s): {', '.join(sorted(unknown))}")
+        for metric in metrics or COUNTERS:
+            written = recount(metric, tenants)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} {metric} counter(s)"))
@@ -0,0 +1,27 @@
+from django.db import models
+
+
+class TenantScopedQuerySet(models.QuerySet):
+    """
+    QuerySet for tenant-owned rows.
+
+    ``for_principal`` applies the same visibility rule everywhere: platform
+    admins see every row, tenant members see their tenant's rows (as a plain
+    equality on the indexed tenant column), everyone else sees nothing.
+    Models reaching their tenant through a relation override ``tenant_field``.
+    """
+
+    tenant_field = 'tenant_id'
+
+    def for_tenant(self, tenant_id):
+        return self.filter(**{self.tenant_field: tenant_id})
+
+    def for_principal(self, principal):
+        if principal.is_platform_admin:
+            return self
+        if principal.tenant_id:
+            return self.for_tenant(principal.tenant_id)
+        return self.none()
+
+
+TenantScopedManager = models.Manager.from_queryset(TenantScopedQuerySet, 'TenantScopedManager')
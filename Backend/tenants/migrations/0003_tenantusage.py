@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_users(apps, schema_editor):
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    TenantUsage = apps.get_model('tenants', 'TenantUsage')
+    counts = UserProfile.objects.values('tenant_id').annotate(n=Count('id')).order_by()
+    TenantUsage.objects.bulk_create(
+        [TenantUsage(tenant_id=row['tenant_id'], metric='users', value=row['n']) for row in counts],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0002_tenant_tenant_name_id_idx'),
+        ('accounts', '0002_rls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='tenants.tenant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'metric'), name='uniq_tenant_usage_metric')],
+            },
+        ),
+        migrations.RunPython(count_users, migrations.RunPython.noop),
+    ]
@@ -15,8 +15,30 @@ class Tenant(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # Keyset pagination on (name, id)
+            models.Index(fields=["name", "id"], name="tenant_name_id_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
+
+class TenantUsage(models.Model):
+    """Running usage counter per tenant and metric (see tenants.quotas)."""
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="usage", db_index=False)
+    metric = models.CharField(max_length=50)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Also the lookup index: counters are only read by (tenant, metric)
+            models.UniqueConstraint(fields=["tenant", "metric"], name="uniq_tenant_usage_metric"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.tenant_id} {self.metric}={self.value}"
+
 # Create your models here.
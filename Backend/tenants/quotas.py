@@ -0,0 +1,144 @@
+"""
+Per-tenant usage metering and plan quotas.
+
+Usage lives in TenantUsage, one counter row per (tenant, metric), so checking
+a quota reads one row instead of counting the tenant's rows. Counters only
+move with atomic ``value = value + n`` updates inside the transaction that
+creates or deletes the metered rows, so they commit or roll back with them.
+
+``check`` locks the tenant's counter row with ``SELECT ... FOR UPDATE`` until
+the caller's transaction ends. Concurrent requests for the same tenant queue
+on that row and each sees the count left by the previous one, so a plan limit
+cannot be overshot by a burst of requests.
+
+Limits come from the tenant's active plan: ``users`` from ``Plan.max_users``
+and any other metric from ``Plan.features["limits"][metric]``. A missing,
+null or zero limit means unlimited.
+
+``recount`` rebuilds a counter from the metered table, e.g. after rows were
+changed with raw SQL (``manage.py recount_usage``).
+"""
+from typing import Dict, Optional
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+
+from accounts.models import UserProfile
+from subscriptions.models import Subscription, SubscriptionStatus
+from .models import Tenant, TenantUsage
+
+USERS = "users"
+
+MESSAGES = {
+    USERS: "Max users limit reached for the tenant's current plan",
+}
+
+
+class QuotaExceeded(PermissionDenied):
+    def __init__(self, metric: str, limit: int, used: int):
+        self.metric, self.limit, self.used = metric, limit, used
+        super().__init__(MESSAGES.get(metric, f"{metric} limit reached for the tenant's current plan"))
+
+
+def active_plan(tenant_id):
+    sub = (
+        Subscription.objects.filter(tenant_id=tenant_id, status=SubscriptionStatus.ACTIVE)
+        .select_related("plan")
+        .first()
+    )
+    return sub.plan if sub else None
+
+
+def with_user_limit(tenants):
+    """``tenants`` annotated with ``max_users`` of their active plan (None without one)."""
+    active = Subscription.objects.filter(tenant=OuterRef("pk"), status=SubscriptionStatus.ACTIVE)
+    return tenants.annotate(max_users=Subquery(active.values("plan__max_users")[:1]))
+
+
+def _locked_counter(tenant_id, metric: str) -> TenantUsage:
+    counters = TenantUsage.objects.select_for_update().filter(tenant_id=tenant_id, metric=metric)
+    counter = counters.first()
+    if counter is None:
+        # First use of this metric; a concurrent first insert makes this a no-op
+        TenantUsage.objects.bulk_create([TenantUsage(tenant_id=tenant_id, metric=metric)], ignore_conflicts=True)
+        counter = counters.get()
+    return counter
+
+
+def check(tenant_id, metric: str, amount: int = 1, limit: Optional[int] = None) -> int:
+    """
+    Raises QuotaExceeded unless ``amount`` more units of ``metric`` fit in
+    ``limit``, and returns the current usage. Must run inside the transaction
+    that then records the usage; the counter stays locked until it ends.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise transaction.TransactionManagementError("Quota checks must run inside a transaction.")
+    used = _locked_counter(tenant_id, metric).value
+    if limit is not None and used + amount > limit:
+        raise QuotaExceeded(metric, limit, used)
+    return used
+
+
+def increment(tenant_id, metric: str, amount: int = 1) -> None:
+    """Adds ``amount`` (negative to release) to the counter, creating it on first use."""
+    counter = TenantUsage.objects.filter(tenant_id=tenant_id, metric=metric)
+    if not counter.update(value=F("value") + amount, updated_at=timezone.now()):
+        TenantUsage.objects.bulk_create([TenantUsage(tenant_id=tenant_id, metric=metric)], ignore_conflicts=True)
+        counter.update(value=F("value") + amount, updated_at=timezone.now())
+
+
+def consume(tenant_id, metric: str, amount: int = 1, plan=None) -> int:
+    """Checks the quota against ``plan`` (default: the active plan) and records the usage."""
+    # Imported here: subscriptions.entitlements imports this module
+    from subscriptions.entitlements import NONE, compile_plan
+
+    if plan is None:
+        plan = active_plan(tenant_id)
+    granted = compile_plan(plan.pk, plan.max_users, plan.features) if plan is not None else NONE
+    used = check(tenant_id, metric, amount, granted.limit(metric))
+    increment(tenant_id, metric, amount)
+    return used + amount
+
+
+def usage(tenant_id) -> Dict[str, int]:
+    return dict(TenantUsage.objects.filter(tenant_id=tenant_id).values_list("metric", "value"))
+
+
+# Metric name -> (tenant_id -> count) from the metered table
+def _count_users(tenant_ids):
+    qs = UserProfile.objects.values("tenant_id").annotate(n=Count("id"))
+    if tenant_ids is not None:
+        qs = qs.filter(tenant_id__in=tenant_ids)
+    return {row["tenant_id"]: row["n"] for row in qs}
+
+
+COUNTERS = {
+    USERS: _count_users,
+}
+
+
+def recount(metric: str, tenant_ids=None) -> int:
+    """Rewrites ``metric``'s counters from the metered table; returns the number of counters written."""
+    tenants = Tenant.objects.all() if tenant_ids is None else Tenant.objects.filter(pk__in=tenant_ids)
+    with transaction.atomic():
+        # Hold off quota checks on existing counters while counting
+        existing = TenantUsage.objects.select_for_update().filter(metric=metric)
+        if tenant_ids is not None:
+            existing = existing.filter(tenant_id__in=tenant_ids)
+        list(existing.values_list("pk", flat=True))
+        counts = COUNTERS[metric](tenant_ids)
+        now = timezone.now()
+        rows = [
+            TenantUsage(tenant_id=pk, metric=metric, value=counts.get(pk, 0), updated_at=now)
+            for pk in tenants.values_list("pk", flat=True)
+        ]
+        TenantUsage.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["tenant", "metric"],
+            update_fields=["value", "updated_at"],
+        )
+    return len(rows)
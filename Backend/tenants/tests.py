@@ -1,3 +1,243 @@
-from django.test import TestCase
+import queue
+import threading
+import unittest
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.http import JsonResponse
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+
+from accounts.models import UserProfile, UserRole
+from accounts.serializers import TenantTokenObtainPairSerializer
+from eshtarek.tenant_context import reset_pooled_connection
+from eshtarek.testing import QueryBudgetMixin, requires_postgres
+from .models import Tenant
+
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+_CONTEXT_SQL = "SELECT current_setting('app.tenant_id', true), current_setting('app.admin', true), pg_backend_pid()"
+
+
+def _context(cursor):
+    cursor.execute(_CONTEXT_SQL)
+    tenant_id, admin, pid = cursor.fetchone()
+    return {'tenant_id': tenant_id or '', 'admin': admin or 'false', 'pid': pid}
+
+
+def context_probe(request):
+    with connection.cursor() as cursor:
+        return JsonResponse(_context(cursor))
+
+
+urlpatterns = [
+    path('probe/', context_probe),
+    path('probe/autocommit/', transaction.non_atomic_requests(context_probe)),
+]
+
+
+@requires_postgres
+class TenantPolicyTests(TestCase):
+    def test_every_tenant_owned_table_has_policies(self):
+        tables = {
+            model._meta.db_table for model in apps.get_models()
+            if any(field.many_to_one and field.related_model is Tenant for field in model._meta.fields)
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tablename, policyname FROM pg_policies WHERE schemaname = current_schema()"
+            )
+            policies = set(cursor.fetchall())
+            cursor.execute("SELECT relname FROM pg_class WHERE relrowsecurity")
+            protected = {name for name, in cursor.fetchall()}
+        self.assertIn('billing_payment', tables)
+        for table in tables:
+            self.assertIn(table, protected)
+            self.assertIn((table, f'{table}_tenant_isolation'), policies)
+            self.assertIn((table, f'{table}_platform_admin'), policies)
+
+
+@requires_postgres
+class AppRoleTests(TestCase):
+    def privilege(self, cursor, table):
+        cursor.execute("SELECT has_table_privilege('eshtarek_app', %s, 'INSERT')", [table])
+        return cursor.fetchone()[0]
+
+    def test_grants_existing_role_on_present_and_future_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_roles WHERE rolname = %s', ['eshtarek_app'])
+            if cursor.fetchone() is None:
+                self.skipTest('Needs the eshtarek_app role')
+            cursor.execute('REVOKE ALL ON ALL TABLES IN SCHEMA public FROM eshtarek_app')
+            self.assertFalse(self.privilege(cursor, 'billing_invoice'))
+            out = StringIO()
+            call_command('ensure_app_role', role='eshtarek_app', stdout=out)
+            self.assertIn('Updated grants of role eshtarek_app', out.getvalue())
+            self.assertTrue(self.privilege(cursor, 'billing_invoice'))
+            cursor.execute('CREATE TABLE app_role_probe (id int)')
+            self.assertTrue(self.privilege(cursor, 'app_role_probe'))
+
+    def test_refuses_the_owner(self):
+        with self.assertRaisesMessage(CommandError, 'owns the tables'):
+            call_command('ensure_app_role', role=connection.settings_dict['USER'], stdout=StringIO())
+
+
+class TenantQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tenant.objects.create(name='Acme')
+        Tenant.objects.create(name='Globex')
+        cls.admin = User.objects.create_user('admin', password='pw123456', is_superuser=True)
+
+    def test_admin_list(self):
+        token = TenantTokenObtainPairSerializer.get_token(self.admin).access_token
+        with self.assertDataQueries(1):
+            response = self.client.get('/api/tenants/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class RequestThread(threading.Thread):
+    """Sends requests from its own thread, i.e. its own Django connection, one at a time."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.requests, self.responses = queue.Queue(), queue.Queue()
+        self.start()
+
+    def run(self):
+        client = Client()
+        while (request := self.requests.get()) is not None:
+            url, extra = request
+            try:
+                self.responses.put(client.get(url, **extra).json())
+            except Exception as exc:
+                self.responses.put(exc)
+            finally:
+                # What request_finished does with CONN_MAX_AGE=0: back to the pool
+                connection.close()
+
+    def get(self, url, **extra):
+        self.requests.put((url, extra))
+        response = self.responses.get(timeout=30)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def stop(self):
+        self.requests.put(None)
+        self.join()
+
+
+@requires_postgres
+@override_settings(ROOT_URLCONF='tenants.tests')
+class TenantContextFailureTests(TransactionTestCase):
+    """A request whose context cannot be applied must not run with the previous caller's."""
+
+    def test_fails_closed(self):
+        tenant = Tenant.objects.create(name='Acme')
+        user = User.objects.create_user('acme', password='pw123456')
+        UserProfile.objects.create(user=user, tenant=tenant, role=UserRole.TENANT_USER)
+        token = TenantTokenObtainPairSerializer.get_token(user).access_token
+        first = self.client.get('/probe/autocommit/', HTTP_AUTHORIZATION=f'Bearer {token}').json()
+        self.assertEqual(first['tenant_id'], str(tenant.id))
+
+        failure = OperationalError('server closed the connection unexpectedly')
+        with mock.patch('eshtarek.middleware.apply_tenant_context', side_effect=failure):
+            with self.assertLogs('eshtarek.middleware', 'ERROR'):
+                response = self.client.get('/probe/autocommit/')
+        self.assertEqual(response.status_code, 503)
+        self.assertIsNone(connection.connection)
+
+        seen = self.client.get('/probe/autocommit/').json()
+        self.assertNotEqual(seen['pid'], first['pid'])
+        self.assertEqual((seen['tenant_id'], seen['admin']), ('', 'false'))
+
+
+@requires_postgres
+@unittest.skipIf(psycopg_pool is None, 'Needs psycopg[pool]')
+@override_settings(ROOT_URLCONF='tenants.tests')
+class PooledTenantContextTests(TransactionTestCase):
+    """Requests of different tenants interleaved on a single pooled connection."""
+
+    def setUp(self):
+        self.acme = Tenant.objects.create(name='Acme')
+        self.globex = Tenant.objects.create(name='Globex')
+        self.auth = {}
+        for name, tenant in (('acme', self.acme), ('globex', self.globex)):
+            user = User.objects.create_user(name, password='pw123456')
+            UserProfile.objects.create(user=user, tenant=tenant, role=UserRole.TENANT_USER)
+            self.auth[name] = self.bearer(user)
+        self.auth['admin'] = self.bearer(User.objects.create_user('admin', password='pw123456', is_superuser=True))
+
+    @staticmethod
+    def bearer(user):
+        token = TenantTokenObtainPairSerializer.get_token(user).access_token
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def use_pool(self, **options):
+        """Points the default connection at a one-connection psycopg pool."""
+        settings_dict = connection.settings_dict
+        saved = settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE']
+        connection.close()
+        connection.close_pool()
+        settings_dict['OPTIONS'] = {**saved[0], 'pool': {'min_size': 1, 'max_size': 1, **options}}
+        settings_dict['CONN_MAX_AGE'] = 0
+        threads = [RequestThread(), RequestThread()]
+
+        def restore():
+            for thread in threads:
+                thread.stop()
+            connection.close()
+            connection.close_pool()
+            settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'] = saved
+
+        self.addCleanup(restore)
+        return threads
+
+    def idle_context(self):
+        """The session-level context of the pooled connection between requests."""
+        raw = connection.pool.getconn()
+        try:
+            with raw.cursor() as cursor:
+                return _context(cursor)
+        finally:
+            connection.pool.putconn(raw)
+
+    def interleave(self, urls, **pool_options):
+        first, second = self.use_pool(**pool_options)
+        expected = {
+            'acme': (str(self.acme.id), 'false'),
+            'globex': (str(self.globex.id), 'false'),
+            'admin': ('', 'true'),
+            'anonymous': ('', 'false'),
+        }
+        sequence = [
+            (first, 'acme'), (second, 'globex'), (first, 'acme'), (second, 'anonymous'),
+            (first, 'globex'), (second, 'acme'), (first, 'admin'), (second, 'acme'), (first, 'anonymous'),
+        ]
+        pids = set()
+        for url in urls:
+            for thread, caller in sequence:
+                seen = thread.get(url, **self.auth.get(caller, {}))
+                self.assertEqual((seen['tenant_id'], seen['admin']), expected[caller], (url, caller))
+                pids.add(seen['pid'])
+                idle = self.idle_context()
+                self.assertEqual((idle['tenant_id'], idle['admin']), ('', 'false'))
+                pids.add(idle['pid'])
+        self.assertEqual(len(pids), 1)
+
+    @override_settings(DB_POOL='psycopg')
+    def test_psycopg_pool(self):
+        self.interleave(['/probe/'], reset=reset_pooled_connection)
+
+    @override_settings(DB_POOL='pgbouncer')
+    def test_transaction_pooling(self):
+        # No reset: only transaction-local settings may ever reach the connection
+        self.interleave(['/probe/', '/probe/autocommit/'])
@@ -3,11 +3,14 @@ from rest_framework.permissions import IsAuthenticated
 from .models import Tenant
 from .serializers import TenantSerializer
 from accounts.permissions import IsPlatformAdmin
+from eshtarek.pagination import KeysetPagination
 
 
 class TenantViewSet(viewsets.ModelViewSet):
     queryset = Tenant.objects.all().order_by('name')
     serializer_class = TenantSerializer
     permission_classes = [IsAuthenticated & IsPlatformAdmin]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('name', 'id')
 
 # Create your views here.
@@ -1,5 +1,5 @@
 import axios from 'axios'
-import { getAccessToken, logout } from '../auth/auth'
+import { getAccessToken, getRefreshToken, setTokens, logout } from '../auth/auth'
 
 const api = axios.create({
   baseURL: import.meta.env.VITE_API_BASE || '/api',
@@ -11,15 +11,61 @@ api.interceptors.request.use((config) => {
   return config
 })
 
-// Global response interceptor for 401 -> auto-logout
+// Access tokens are short-lived: refresh once on 401, then auto-logout
+let refreshing = null
+
+const refreshAccess = async () => {
+  const refresh = getRefreshToken()
+  if (!refresh) throw new Error('No refresh token')
+  const res = await axios.post(`${api.defaults.baseURL}/auth/token/refresh/`, { refresh })
+  setTokens(res.data.access, res.data.refresh || refresh)
+  return res.data.access
+}
+
 api.interceptors.response.use(
   (r) => r,
-  (error) => {
-    if (error?.response?.status === 401) {
+  async (error) => {
+    const original = error?.config
+    if (error?.response?.status === 401 && original && !original._retried) {
+      original._retried = true
+      try {
+        refreshing = refreshing || refreshAccess()
+        const access = await refreshing
+        original.headers.Authorization = `Bearer ${access}`
+        return api(original)
+      } catch (e) {
+        logout()
+      } finally {
+        refreshing = null
+      }
+    } else if (error?.response?.status === 401) {
       logout()
     }
     return Promise.reject(error)
   }
 )
 
-export default api
\ No newline at end of file
+// Keyset-paginated list endpoints return { next, previous, results }
+export const listResults = (data) => (Array.isArray(data) ? data : data?.results ?? [])
+
+// One page with its links; `next` / `previous` are null at either end
+export const listPage = (data) => ({
+  results: listResults(data),
+  next: data?.next ?? null,
+  previous: data?.previous ?? null,
+})
+
+// Every page, following `next`: for dropdowns and lookups, not for tables
+export const listAll = async (url) => {
+  const items = []
+  let next = url
+  while (next) {
+    const res = await api.get(next)
+    const page = listPage(res.data)
+    items.push(...page.results)
+    next = page.next
+  }
+  return items
+}
+
+export default api
@@ -0,0 +1,10 @@
+// Previous / Next controls for a page from listPage(); hidden on a single page
+export default function Pager({ page, onPage, disabled = false }) {
+  if (!page.next && !page.previous) return null
+  return (
+    <div className="row" style={{justifyContent:'flex-end', marginTop:8}}>
+      <button onClick={() => onPage(page.previous)} disabled={disabled || !page.previous}>Previous</button>
+      <button onClick={() => onPage(page.next)} disabled={disabled || !page.next} style={{marginLeft:8}}>Next</button>
+    </div>
+  )
+}
@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
-import api from '../api/client'
+import api, { listPage, listResults } from '../api/client'
+import Pager from '../components/Pager'
 import { useAuth } from '../context/AuthContext'
 import { useToast } from '../components/ToastProvider'
 import { isAuthed } from '../auth/auth'
@@ -7,7 +8,8 @@ import { isAuthed } from '../auth/auth'
 export default function Home() {
   const { isAdmin } = useAuth()
   const [me, setMe] = useState(null)
-  const [subs, setSubs] = useState([])
+  const [subsPage, setSubsPage] = useState(listPage())
+  const subs = subsPage.results
   const [plans, setPlans] = useState([])
   const [invoices, setInvoices] = useState([])
   const [loading, setLoading] = useState(true)
@@ -23,9 +25,9 @@ export default function Home() {
         api.get('/billing/'),
       ])
       setMe(meR.data)
-      setSubs(subsR.data)
+      setSubsPage(listPage(subsR.data))
       setPlans(plansR.data)
-      setInvoices(invR.data)
+      setInvoices(listResults(invR.data))
     } catch (e) {
       const status = e?.response?.status
       if (status !== 401 && status !== 403) toast.error('Failed to load home data')
@@ -42,6 +44,15 @@ export default function Home() {
     }
   }, [])
 
+  const loadSubs = async (url) => {
+    try {
+      const r = await api.get(url)
+      setSubsPage(listPage(r.data))
+    } catch (e) {
+      toast.error('Failed to load subscriptions')
+    }
+  }
+
   const planById = (id) => plans.find(p => p.id === id)
 
   // Public home (not logged in)
@@ -94,6 +105,7 @@ export default function Home() {
             </ul>
           )
         )}
+        <Pager page={subsPage} onPage={loadSubs} disabled={loading} />
       </div>
 
       <div style={{height:12}} />
@@ -1,10 +1,12 @@
 import { useEffect, useState } from 'react'
-import api from '../api/client'
+import api, { listAll, listPage } from '../api/client'
+import Pager from '../components/Pager'
 import { useToast } from '../components/ToastProvider'
 import formatError from '../utils/formatError'
 
 export default function Invoices() {
-  const [invoices, setInvoices] = useState([])
+  const [page, setPage] = useState(listPage())
+  const [pageUrl, setPageUrl] = useState('/billing/')
   const [subs, setSubs] = useState([])
   const [plans, setPlans] = useState([])
   const [selectedSub, setSelectedSub] = useState('')
@@ -15,17 +17,22 @@ export default function Invoices() {
   const [webhookAmount, setWebhookAmount] = useState('')
   const toast = useToast()
 
-  const load = async () => {
+  const invoices = page.results
+
+  // Loads a page of invoices (default: the one shown), every subscription for
+  // the dropdown, and the plans
+  const load = async (url = pageUrl) => {
     try {
-      const [i, s, p] = await Promise.all([
-        api.get('/billing/'),
-        api.get('/subscriptions/'),
+      const [i, subsList, p] = await Promise.all([
+        api.get(url),
+        listAll('/subscriptions/'),
         api.get('/plans/'),
       ])
-      setInvoices(i.data)
-      setSubs(s.data)
+      setPage(listPage(i.data))
+      setPageUrl(url)
+      setSubs(subsList)
       setPlans(p.data)
-      if (!selectedSub && s.data.length > 0) setSelectedSub(s.data[0].id)
+      if (!selectedSub && subsList.length > 0) setSelectedSub(subsList[0].id)
     } catch (e) {
       toast.error(formatError(e, 'Failed to load invoices'))
     }
@@ -37,7 +44,8 @@ export default function Invoices() {
     try {
       await api.post('/billing/', { subscription: selectedSub })
       toast.success('Invoice created')
-      load()
+      // Newest first: the new invoice is on the first page
+      load('/billing/')
     } catch (e) { toast.error(formatError(e, 'Create failed')) }
   }
 
@@ -58,7 +66,7 @@ export default function Invoices() {
       const amt = Number(webhookAmount || 0)
       if (amt > 0) payload.amount_cents = amt
       await api.post('/billing/webhooks/mock/', payload)
-      toast.success('Webhook processed')
+      toast.success('Webhook queued')
       load()
     } catch(e) { toast.error(formatError(e, 'Webhook failed')) }
   }
@@ -139,6 +147,7 @@ export default function Invoices() {
             </li>
           ))}
         </ul>
+        <Pager page={page} onPage={load} />
       </div>
     </div>
   )
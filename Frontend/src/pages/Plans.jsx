@@ -1,6 +1,6 @@
 import { useEffect, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
-import api from '../api/client'
+import api, { listAll } from '../api/client'
 import { useToast } from '../components/ToastProvider'
 import formatError from '../utils/formatError'
 
@@ -15,12 +15,13 @@ export default function Plans() {
   useEffect(() => {
     const load = async () => {
       try {
+        // Every subscription, so the active one is found on any page
         const [p, s] = await Promise.all([
           api.get('/plans/'),
-          api.get('/subscriptions/'),
+          listAll('/subscriptions/'),
         ])
         setPlans(p.data)
-        setSubs(s.data)
+        setSubs(s)
       } catch (e) {
         // plans is public; subscriptions require auth
         setPlans([])
@@ -1,5 +1,5 @@
 import { useEffect, useState } from 'react'
-import api from '../api/client'
+import api, { listAll } from '../api/client'
 import { useToast } from '../components/ToastProvider.jsx'
 import { isAuthed } from '../auth/auth'
 
@@ -17,11 +17,11 @@ export default function Register() {
     async function loadTenants() {
       if (!isAuthed()) return
       try {
-        const res = await api.get('/tenants/')
-        if (Array.isArray(res.data) && res.data.length > 0) {
-          setTenants(res.data)
+        const list = await listAll('/tenants/')
+        if (list.length > 0) {
+          setTenants(list)
           setUseTenantDropdown(true)
-          setForm(f => ({ ...f, tenant_id: res.data[0].id }))
+          setForm(f => ({ ...f, tenant_id: list[0].id }))
         }
       } catch (_) {
         // ignore; non-admin or not allowed
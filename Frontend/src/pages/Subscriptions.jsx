@@ -1,28 +1,35 @@
 import { useEffect, useState } from 'react'
-import api from '../api/client'
+import api, { listPage } from '../api/client'
+import Pager from '../components/Pager'
 import { useToast } from '../components/ToastProvider'
 import formatError from '../utils/formatError'
 
 export default function Subscriptions() {
-  const [items, setItems] = useState([])
+  const [page, setPage] = useState(listPage())
+  const [pageUrl, setPageUrl] = useState('/subscriptions/')
   const [plans, setPlans] = useState([])
   const toast = useToast()
 
-  useEffect(() => {
-    const load = async () => {
-      try {
-        const [s, p] = await Promise.all([
-          api.get('/subscriptions/'),
-          api.get('/plans/'),
-        ])
-        setItems(s.data)
-        setPlans(p.data)
-      } catch (e) {
-        toast.error(formatError(e, 'Failed to load subscriptions'))
-      }
+  // Loads a page of subscriptions (default: the one shown) with the plans
+  const load = async (url = pageUrl) => {
+    const [s, p] = await Promise.all([
+      api.get(url),
+      api.get('/plans/'),
+    ])
+    setPage(listPage(s.data))
+    setPageUrl(url)
+    setPlans(p.data)
+  }
+
+  const goTo = async (url) => {
+    try {
+      await load(url)
+    } catch (e) {
+      toast.error(formatError(e, 'Failed to load subscriptions'))
     }
-    load()
-  }, [])
+  }
+
+  useEffect(() => { goTo('/subscriptions/') }, [])
 
   const planName = (planId) => plans.find(p => p.id === planId)?.name || planId
 
@@ -39,12 +46,7 @@ export default function Subscriptions() {
       await api.post('/subscriptions/', { plan: createPlanId })
       toast.success('Subscription created')
       // reload list after creation
-      const [s, p] = await Promise.all([
-        api.get('/subscriptions/'),
-        api.get('/plans/'),
-      ])
-      setItems(s.data)
-      setPlans(p.data)
+      await load('/subscriptions/')
     } catch (e) {
       toast.error(formatError(e, 'Failed to create subscription'))
     }
@@ -55,12 +57,7 @@ export default function Subscriptions() {
     try {
       await api.post(`/subscriptions/${subId}/change-plan/`, { plan: newPlanId })
       // reload subscriptions
-      const [s, p] = await Promise.all([
-        api.get('/subscriptions/'),
-        api.get('/plans/'),
-      ])
-      setItems(s.data)
-      setPlans(p.data)
+      await load()
     } catch (e) {
       console.error(e)
       toast.error(formatError(e, 'Failed to change plan'))
@@ -88,7 +85,7 @@ export default function Subscriptions() {
           </div>
         </form>
         <ul className="list">
-          {items.map(s => (
+          {page.results.map(s => (
             <li key={s.id}>
               <div>
                 <div style={{fontWeight:600}}>{planName(s.plan)}</div>
@@ -109,6 +106,7 @@ export default function Subscriptions() {
             </li>
           ))}
         </ul>
+        <Pager page={page} onPage={goTo} />
       </div>
     </div>
   )
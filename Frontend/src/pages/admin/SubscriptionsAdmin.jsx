@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
-import api from '../../api/client'
+import api, { listAll, listPage } from '../../api/client'
+import Pager from '../../components/Pager'
 import { useToast } from '../../components/ToastProvider.jsx'
 import formatError from '../../utils/formatError'
 
@@ -16,7 +17,10 @@ const STATUS_OPTIONS = [
 export default function SubscriptionsAdmin() {
   const [tenants, setTenants] = useState([])
   const [plans, setPlans] = useState([])
-  const [subs, setSubs] = useState([])
+  const [page, setPage] = useState(listPage())
+  const [pageUrl, setPageUrl] = useState('/subscriptions/')
+  const subs = page.results
+  const setSubs = (update) => setPage(prev => ({ ...prev, results: update(prev.results) }))
   const [form, setForm] = useState({ tenant: '', plan: '', status: 'active' })
   const [loading, setLoading] = useState(true)
   const [submitting, setSubmitting] = useState(false)
@@ -24,18 +28,20 @@ export default function SubscriptionsAdmin() {
   const [changing, setChanging] = useState(null) // subId being plan-changed
   const [changingStatus, setChangingStatus] = useState(null) // subId being status-changed
 
-  const loadAll = async () => {
+  // Every tenant (dropdown, names) and a page of subscriptions (default: the one shown)
+  const loadAll = async (url = pageUrl) => {
     setLoading(true)
     try {
-      const [t, p, s] = await Promise.all([
-        api.get('/tenants/'),
+      const [tenantList, p, s] = await Promise.all([
+        listAll('/tenants/'),
         api.get('/plans/'),
-        api.get('/subscriptions/'),
+        api.get(url),
       ])
-      setTenants(t.data)
+      setTenants(tenantList)
       setPlans(p.data)
-      setSubs(s.data)
-      if (!form.tenant && t.data.length) setForm(f => ({ ...f, tenant: t.data[0].id }))
+      setPage(listPage(s.data))
+      setPageUrl(url)
+      if (!form.tenant && tenantList.length) setForm(f => ({ ...f, tenant: tenantList[0].id }))
       if (!form.plan && p.data.length) setForm(f => ({ ...f, plan: p.data[0].id }))
       if (!form.status) setForm(f => ({ ...f, status: STATUS_OPTIONS[0].value }))
     } catch (e) {
@@ -46,6 +52,17 @@ export default function SubscriptionsAdmin() {
     }
   }
 
+  const loadPage = async (url) => {
+    try {
+      const s = await api.get(url)
+      setPage(listPage(s.data))
+      setPageUrl(url)
+    } catch (e) {
+      console.error(e)
+      toast.error('Failed to load subscriptions')
+    }
+  }
+
   const changeStatus = async (id, newStatus) => {
     if (!newStatus) return
     setChangingStatus(id)
@@ -92,7 +109,7 @@ export default function SubscriptionsAdmin() {
       await api.post('/subscriptions/', payload)
       toast.success('Subscription created')
       setForm({ tenant: form.tenant, plan: form.plan, status: form.status || 'active' })
-      await loadAll()
+      await loadAll('/subscriptions/')
     } catch (e) {
       console.error(e)
       toast.error(formatError(e, 'Failed to create subscription'))
@@ -183,6 +200,7 @@ export default function SubscriptionsAdmin() {
                 </li>
               ))}
             </ul>
+            <Pager page={page} onPage={loadPage} />
           </>
         )}
       </div>
@@ -1,14 +1,15 @@
 import { useEffect, useState } from 'react'
-import api from '../../api/client'
+import api, { listPage } from '../../api/client'
+import Pager from '../../components/Pager'
 import { useToast } from '../../components/ToastProvider'
 
 export default function TenantsAdmin(){
-  const [tenants, setTenants] = useState([])
+  const [page, setPage] = useState(listPage())
   const [form, setForm] = useState({ name:'' })
   const toast = useToast()
 
-  const load = async ()=>{
-    try{ const r = await api.get('/tenants/'); setTenants(r.data) }catch(e){ toast.error('Failed to load tenants') }
+  const load = async (url = '/tenants/')=>{
+    try{ const r = await api.get(url); setPage(listPage(r.data)) }catch(e){ toast.error('Failed to load tenants') }
   }
   useEffect(()=>{ load() },[])
 
@@ -32,7 +33,7 @@ export default function TenantsAdmin(){
       <div className="card">
         <h2>Existing Tenants</h2>
         <ul className="list">
-          {tenants.map(t => (
+          {page.results.map(t => (
             <li key={t.id}>
               <div>
                 <div style={{fontWeight:600}}>{t.name}</div>
@@ -41,6 +42,7 @@ export default function TenantsAdmin(){
             </li>
           ))}
         </ul>
+        <Pager page={page} onPage={load} />
       </div>
     </div>
   )